@@ -12,6 +12,8 @@ from typing import List, Dict, Optional, Any
 from datetime import datetime, date, timedelta
 from dotenv import load_dotenv
 
+from cache import Counters
+
 load_dotenv()
 logger = logging.getLogger(__name__)
 
@@ -149,19 +151,19 @@ class PersonalAIManager:
             "Дай конкретные, применимые, глубокие советы на русском языке. "
         )
         
-        # Статистика использования
-        self.stats = {
-            'groq_success': 0,
-            'groq_failures': 0,
-            'deepseek_success': 0,
-            'deepseek_failures': 0,
-            'cohere_success': 0,
-            'cohere_failures': 0,
-            'huggingface_success': 0,
-            'huggingface_failures': 0,
-            'fallback_used': 0,
-            'total_requests': 0
-        }
+        # Статистика использования (общая для процессов при общем хранилище кэша)
+        self.stats = Counters([
+            'groq_success',
+            'groq_failures',
+            'deepseek_success',
+            'deepseek_failures',
+            'cohere_success',
+            'cohere_failures',
+            'huggingface_success',
+            'huggingface_failures',
+            'fallback_used',
+            'total_requests'
+        ], namespace="personal_manager_stats")
     
     async def _call_ai(self, system_prompt: str, user_prompt: str, max_tokens: int = 500) -> Optional[str]:
         """
@@ -176,7 +178,7 @@ class PersonalAIManager:
         Returns:
             Ответ от ИИ или None
         """
-        self.stats['total_requests'] += 1
+        await self.stats.incr('total_requests')
         
         # Проверяем доступные API ключи
         available_apis = []
@@ -191,7 +193,7 @@ class PersonalAIManager:
         
         if not available_apis:
             logger.error("❌ Нет доступных API ключей! Проверьте .env файл.")
-            self.stats['fallback_used'] += 1
+            await self.stats.incr('fallback_used')
             return None
         
         logger.info(f"🔄 Пробуем ИИ API (доступны: {', '.join(available_apis)})")
@@ -225,7 +227,7 @@ class PersonalAIManager:
                 return result
         
         # Если ничего не сработало, используем fallback
-        self.stats['fallback_used'] += 1
+        await self.stats.incr('fallback_used')
         logger.warning(f"⚠️ Все ИИ API ({', '.join(available_apis)}) недоступны, используем fallback ответ")
         return None
     
@@ -255,7 +257,7 @@ class PersonalAIManager:
                     if 'choices' in result and len(result['choices']) > 0:
                         text = result['choices'][0]['message']['content']
                         if text:
-                            self.stats['deepseek_success'] += 1
+                            await self.stats.incr('deepseek_success')
                             logger.info("✅ DeepSeek успешно обработал запрос")
                             return text.strip()
                     else:
@@ -267,7 +269,7 @@ class PersonalAIManager:
                         error_text = str(error_data)
                     except:
                         error_text = response.text[:200]
-                    self.stats['deepseek_failures'] += 1
+                    await self.stats.incr('deepseek_failures')
                     logger.warning(f"❌ DeepSeek недоступен: статус {response.status_code}, ошибка: {error_text}")
                     if response.status_code == 401:
                         logger.error("🔑 DeepSeek: Неверный API ключ или ключ истек!")
@@ -276,7 +278,7 @@ class PersonalAIManager:
                     elif response.status_code == 500:
                         logger.error("🔧 DeepSeek: Ошибка на стороне сервера!")
         except Exception as e:
-            self.stats['deepseek_failures'] += 1
+            await self.stats.incr('deepseek_failures')
             logger.error(f"❌ DeepSeek исключение: {type(e).__name__}: {str(e)}")
         return None
     
@@ -306,7 +308,7 @@ class PersonalAIManager:
                     if 'choices' in result and len(result['choices']) > 0:
                         text = result['choices'][0]['message']['content']
                         if text:
-                            self.stats['groq_success'] += 1
+                            await self.stats.incr('groq_success')
                             logger.info("✅ Groq успешно обработал запрос")
                             return text.strip()
                     else:
@@ -318,7 +320,7 @@ class PersonalAIManager:
                         error_text = str(error_data)
                     except:
                         error_text = response.text[:200]
-                    self.stats['groq_failures'] += 1
+                    await self.stats.incr('groq_failures')
                     logger.warning(f"❌ Groq недоступен: статус {response.status_code}, ошибка: {error_text}")
                     if response.status_code == 401:
                         logger.error("🔑 Groq: Неверный API ключ или ключ истек!")
@@ -327,7 +329,7 @@ class PersonalAIManager:
                     elif response.status_code == 500:
                         logger.error("🔧 Groq: Ошибка на стороне сервера!")
         except Exception as e:
-            self.stats['groq_failures'] += 1
+            await self.stats.incr('groq_failures')
             logger.error(f"❌ Groq исключение: {type(e).__name__}: {str(e)}")
         return None
     
@@ -355,14 +357,14 @@ class PersonalAIManager:
                     if 'text' in result:
                         text = result['text']
                         if text:
-                            self.stats['cohere_success'] += 1
+                            await self.stats.incr('cohere_success')
                             logger.info("Cohere успешно обработал запрос")
                             return text.strip()
                 
-                self.stats['cohere_failures'] += 1
+                await self.stats.incr('cohere_failures')
                 logger.warning(f"Cohere недоступен: {response.status_code}")
         except Exception as e:
-            self.stats['cohere_failures'] += 1
+            await self.stats.incr('cohere_failures')
             logger.warning(f"Cohere ошибка: {e}")
         return None
     
@@ -391,14 +393,14 @@ class PersonalAIManager:
                             # Извлекаем только ответ ассистента
                             if 'Assistant:' in text:
                                 text = text.split('Assistant:')[-1].strip()
-                            self.stats['huggingface_success'] += 1
+                            await self.stats.incr('huggingface_success')
                             logger.info("HuggingFace успешно обработал запрос")
                             return text.strip()
                 
-                self.stats['huggingface_failures'] += 1
+                await self.stats.incr('huggingface_failures')
                 logger.warning(f"HuggingFace недоступен: {response.status_code}")
         except Exception as e:
-            self.stats['huggingface_failures'] += 1
+            await self.stats.incr('huggingface_failures')
             logger.warning(f"HuggingFace ошибка: {e}")
         return None
     
@@ -814,7 +816,13 @@ class PersonalAIManager:
         # Анализируем данные пользователя
         active_goals = [g for g in user_data.get('goals', []) if not g.get('is_completed', False)]
         active_cards = [c for c in user_data.get('cards', []) if c.get('status') == 'active']
-        recent_actions = user_data.get('daily_actions', [])[:7]  # Последние 7 дней
+        # Последние 7 дней (действия приходят новыми первыми)
+        week_start = (date.today() - timedelta(days=6)).isoformat()
+        recent_actions = [a for a in user_data.get('daily_actions', []) if str(a.get('action_date')) >= week_start]
+        
+        # Счетчики из user_counters не требуют полного списка карт
+        cards_by_status = (user_data.get('counters') or {}).get('cards_by_status')
+        active_cards_count = cards_by_status.get('active', 0) if cards_by_status is not None else len(active_cards)
         
         # Если у пользователя нет активных целей - сразу возвращаем специальный ответ
         if len(active_goals) == 0:
@@ -842,7 +850,7 @@ class PersonalAIManager:
         
         user_prompt = (
             f"Активные цели: {len(active_goals)}\n"
-            f"Активные карты: {len(active_cards)}\n"
+            f"Активные карты: {active_cards_count}\n"
             f"Действий за последние 7 дней: {len(recent_actions)}\n"
             f"Топ-3 активных цели: {', '.join([g.get('description', g.get('title', 'Цель'))[:50] for g in active_goals[:3]])}\n\n"
             "Что пользователю делать дальше? Верни ТОЛЬКО JSON без дополнительного текста."
@@ -878,9 +886,9 @@ class PersonalAIManager:
                 logger.warning(f"Не удалось распарсить JSON: {response}")
         
         # Fallback рекомендации
-        return self._get_fallback_navigation(active_goals, active_cards, recent_actions)
+        return self._get_fallback_navigation(active_goals, active_cards_count, recent_actions)
     
-    def _get_fallback_navigation(self, active_goals: List, active_cards: List, recent_actions: List) -> Dict[str, Any]:
+    def _get_fallback_navigation(self, active_goals: List, active_cards_count: int, recent_actions: List) -> Dict[str, Any]:
         """Fallback навигация"""
         next_actions = []
         
@@ -903,7 +911,7 @@ class PersonalAIManager:
                 "priority": 4
             })
         
-        if len(active_cards) > 5:
+        if active_cards_count > 5:
             next_actions.append({
                 "title": "Пересмотри приоритеты",
                 "description": "У тебя много активных задач. Сосредоточься на самых важных",
@@ -1028,7 +1036,8 @@ class PersonalAIManager:
         if context:
             completed_goals = len([g for g in context.get('goals', []) if g.get('is_completed', False)])
             active_goals = len([g for g in context.get('goals', []) if not g.get('is_completed', False)])
-            recent_actions = len(context.get('daily_actions', []))
+            # Список действий ограничен последними днями, итог за все время - в счетчиках
+            recent_actions = (context.get('counters') or {}).get('actions_total', len(context.get('daily_actions', [])))
             context_str = f"У пользователя {completed_goals} выполненных целей, {active_goals} активных целей, {recent_actions} выполненных действий."
         
         system_prompt = (
@@ -1081,6 +1090,13 @@ class PersonalAIManager:
         active_cards = [c for c in all_cards if c.get('status') == 'active']
         completed_cards = [c for c in all_cards if c.get('status') == 'completed']
         
+        # Счетчики из user_counters (если есть) не зависят от того, сколько строк пришло в списках
+        counters = user_data.get('counters') or {}
+        cards_by_status = counters.get('cards_by_status')
+        total_cards = counters.get('cards_total', len(all_cards))
+        active_cards_count = cards_by_status.get('active', 0) if cards_by_status is not None else len(active_cards)
+        completed_cards_count = cards_by_status.get('completed', 0) if cards_by_status is not None else len(completed_cards)
+        
         # Получаем дату регистрации пользователя
         user = user_data.get('user', {})
         user_created = None
@@ -1099,7 +1115,12 @@ class PersonalAIManager:
         streak = 0
         today = date.today()
         
-        if actions:
+        if 'current_streak' in user:
+            # Серия хранится в users и обновляется при записи действия; она засчитывается,
+            # только если последнее действие было сегодня
+            if str(user.get('last_action_date')) == today.isoformat():
+                streak = user['current_streak']
+        elif actions:
             # Преобразуем все даты действий в объекты date и сортируем по убыванию
             action_dates = []
             for action in actions:
@@ -1131,7 +1152,7 @@ class PersonalAIManager:
         
         # Дополнительная статистика из БД
         days_since_start = (today - user_created).days if user_created else 0
-        total_actions = len(actions)
+        total_actions = counters.get('actions_total', len(actions))
         avg_actions_per_week = (total_actions / max(1, days_since_start / 7)) if days_since_start > 0 else 0
         
         # Процент выполнения целей
@@ -1149,7 +1170,7 @@ class PersonalAIManager:
             f"- Всего ежедневных действий: {total_actions}\n"
             f"- Текущая серия дней (streak): {streak}\n"
             f"- Средняя активность: {avg_actions_per_week:.1f} действий в неделю\n"
-            f"- Всего карт: {len(all_cards)} (активно: {len(active_cards)}, выполнено: {len(completed_cards)})\n"
+            f"- Всего карт: {total_cards} (активно: {active_cards_count}, выполнено: {completed_cards_count})\n"
             f"- Высокоприоритетных активных карт: {high_priority_cards}\n"
         )
         
@@ -1254,22 +1275,18 @@ class PersonalAIManager:
             "recommendations": recommendations[:3],
             "score": int(score),
             "streak": streak,
+            "longest_streak": user.get('longest_streak', streak),
             "days_since_start": days_since_start,
             "total_actions": total_actions,
             "avg_actions_per_week": round(avg_actions_per_week, 1),
             "goal_completion_rate": round(goal_completion_rate, 1)
         }
     
-    def get_stats(self) -> Dict[str, int]:
+    async def get_stats(self) -> Dict[str, int]:
         """Возвращает статистику использования"""
-        return self.stats.copy()
+        return await self.stats.copy()
     
-    def reset_stats(self):
+    async def reset_stats(self):
         """Сбрасывает статистику"""
-        self.stats = {
-            'groq_success': 0,
-            'groq_failures': 0,
-            'fallback_used': 0,
-            'total_requests': 0
-        }
+        await self.stats.reset()
 
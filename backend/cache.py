@@ -0,0 +1,730 @@
+"""
+Кэши сервиса поверх сменного хранилища
+
+Хранилище выбирается переменной CACHE_BACKEND:
+- memory (по умолчанию) - LRU в памяти процесса, у каждого кэша свое;
+- sqlite - файл CACHE_SQLITE_PATH, общий для всех процессов на одной машине;
+- redis - сервер CACHE_REDIS_URL (нужен пакет redis), общий для всех машин.
+
+Поверх хранилища работают LRU-кэш с TTL (TTLCache), кэш сериализованных
+ответов (ResponseCache) и счетчики статистики (Counters). Обращения к хранилищу
+асинхронные: запросы к Redis идут через redis.asyncio, а к файлу SQLite -
+в потоке (asyncio.to_thread), поэтому общий кэш не блокирует event loop.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class CacheBackend(ABC):
+    """
+    Хранилище ключ-значение (bytes) с временем жизни записей
+
+    Методы асинхронные: memory отвечает сразу, sqlite работает в потоке, redis -
+    один сетевой запрос без блокировки event loop. Ошибки общих хранилищ не пробрасываются: запись считается
+    отсутствующей, а хранилище пропускается на UNAVAILABLE_SECONDS, чтобы
+    недоступный кэш не останавливал сервис.
+    """
+
+    name = "base"
+    UNAVAILABLE_SECONDS = 5.0
+
+    def __init__(self):
+        self._unavailable_until = 0.0
+        self.stats = {'errors': 0}
+
+    async def get(self, key: str) -> Optional[bytes]:
+        """Значение по ключу или None, если его нет или оно устарело"""
+        return (await self.get_many([key]))[0]
+
+    @abstractmethod
+    async def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        """Значения нескольких ключей за одно обращение"""
+
+    @abstractmethod
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        """Сохраняет значение; ttl - время жизни в секундах (None - без ограничения)"""
+
+    @abstractmethod
+    async def delete(self, key: str):
+        """Удаляет значение"""
+
+    @abstractmethod
+    async def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        """
+        Атомарно увеличивает счетчик и возвращает новое значение
+
+        ttl задает время жизни нового счетчика (окно для ограничения частоты запросов)
+        """
+
+    @abstractmethod
+    async def clear(self, prefix: str = ""):
+        """Удаляет все значения с ключами, начинающимися с prefix"""
+
+    async def close(self):
+        """Закрывает соединения с хранилищем"""
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику хранилища"""
+        return {'backend': self.name, **self.stats}
+
+    def _available(self) -> bool:
+        return time.monotonic() >= self._unavailable_until
+
+    def _failed(self, operation: str, error: Exception):
+        """Учитывает ошибку хранилища и временно отключает его"""
+        self.stats['errors'] += 1
+        if self._available():
+            logger.warning(f"Кэш {self.name} недоступен ({operation}): {error!r}")
+        self._unavailable_until = time.monotonic() + self.UNAVAILABLE_SECONDS
+
+
+class MemoryBackend(CacheBackend):
+    """
+    LRU в памяти процесса
+
+    При превышении max_size записей или max_bytes байт значений вытесняются
+    записи, к которым дольше всего не обращались.
+    """
+
+    name = "memory"
+
+    def __init__(self, max_size: Optional[int] = None, max_bytes: Optional[int] = None):
+        super().__init__()
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._data: "OrderedDict[str, tuple]" = OrderedDict()
+        self.stats['evictions'] = 0
+
+    def _entry(self, key: str) -> Optional[tuple]:
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        expires_at = entry[1]
+        if expires_at is not None and expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        return entry
+
+    async def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        values = []
+        for key in keys:
+            entry = self._entry(key)
+            if entry is not None:
+                self._data.move_to_end(key)
+            values.append(entry[0] if entry is not None else None)
+        return values
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        if key in self._data:
+            self._remove(key)
+        self._data[key] = (value, time.monotonic() + ttl if ttl is not None else None)
+        self.bytes += len(value)
+
+        while (self.max_size is not None and len(self._data) > self.max_size) or \
+                (self.max_bytes is not None and self.bytes > self.max_bytes):
+            self._remove(next(iter(self._data)))
+            self.stats['evictions'] += 1
+
+    async def delete(self, key: str):
+        if key in self._data:
+            self._remove(key)
+
+    async def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        entry = self._entry(key)
+        if entry is None:
+            value, expires_at = amount, (time.monotonic() + ttl if ttl is not None else None)
+        else:
+            value, expires_at = int(entry[0]) + amount, entry[1]
+            self._remove(key)
+        encoded = str(value).encode()
+        self._data[key] = (encoded, expires_at)
+        self.bytes += len(encoded)
+        return value
+
+    async def clear(self, prefix: str = ""):
+        for key in [key for key in self._data if key.startswith(prefix)]:
+            self._remove(key)
+
+    def _remove(self, key: str):
+        value, _ = self._data.pop(key)
+        self.bytes -= len(value)
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**super().get_stats(), 'size': len(self._data), 'bytes': self.bytes}
+
+
+class SQLiteBackend(CacheBackend):
+    """
+    Файл SQLite, общий для процессов на одной машине (несколько воркеров uvicorn)
+
+    Соединение открывается отдельно в каждом процессе. Запросы выполняются
+    в потоке (asyncio.to_thread) по одному за раз: ожидание блокировки файла
+    другим процессом не останавливает event loop. Устаревшие записи удаляются
+    при чтении и периодически при записи.
+    """
+
+    name = "sqlite"
+    PRUNE_EVERY = 1000
+
+    def __init__(self, path: str, timeout: float = 1.0):
+        super().__init__()
+        self.path = path
+        self.timeout = timeout
+        self._db: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._writes = 0
+        # Одно соединение на процесс, запросы из потоков выполняются по очереди
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        """Соединение текущего процесса (соединение, унаследованное через fork, не используется)"""
+        if self._db is None or self._pid != os.getpid():
+            db = sqlite3.connect(self.path, timeout=self.timeout, isolation_level=None, check_same_thread=False)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute("PRAGMA synchronous=NORMAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS cache ("
+                "key TEXT PRIMARY KEY, value BLOB NOT NULL, expires_at REAL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS cache_expires_at ON cache (expires_at)")
+            self._db, self._pid = db, os.getpid()
+        return self._db
+
+    @staticmethod
+    def _expires_at(ttl: Optional[float]) -> Optional[float]:
+        return time.time() + ttl if ttl is not None else None
+
+    def _execute(self, query: Callable[[sqlite3.Connection], Any]) -> Any:
+        """Выполняет query(соединение) под блокировкой процесса (вызывается в потоке)"""
+        with self._lock:
+            return query(self._connection())
+
+    async def _run(self, operation: str, query: Callable[[sqlite3.Connection], Any], default: Any = None) -> Any:
+        """Выполняет запрос в потоке; при ошибке SQLite хранилище временно отключается и возвращается default"""
+        if not self._available():
+            return default
+        try:
+            return await asyncio.to_thread(self._execute, query)
+        except sqlite3.Error as e:
+            self._failed(operation, e)
+            return default
+
+    async def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        if not keys:
+            return []
+
+        def query(db: sqlite3.Connection) -> List[Optional[bytes]]:
+            rows = db.execute(
+                f"SELECT key, value FROM cache WHERE key IN ({','.join('?' * len(keys))}) "
+                "AND (expires_at IS NULL OR expires_at >= ?)",
+                [*keys, time.time()]
+            ).fetchall()
+            # Счетчики хранятся числами
+            found = {key: value if isinstance(value, bytes) else str(value).encode() for key, value in rows}
+            return [found.get(key) for key in keys]
+
+        return await self._run("get", query, [None] * len(keys))
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        def query(db: sqlite3.Connection):
+            db.execute(
+                "INSERT INTO cache (key, value, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET value = excluded.value, expires_at = excluded.expires_at",
+                (key, value, self._expires_at(ttl))
+            )
+            self._writes += 1
+            if self._writes % self.PRUNE_EVERY == 0:
+                db.execute("DELETE FROM cache WHERE expires_at < ?", (time.time(),))
+
+        await self._run("set", query)
+
+    async def delete(self, key: str):
+        await self._run("delete", lambda db: db.execute("DELETE FROM cache WHERE key = ?", (key,)))
+
+    async def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        def query(db: sqlite3.Connection) -> int:
+            now = time.time()
+            # Истекший счетчик начинается заново, как новый
+            row = db.execute(
+                "INSERT INTO cache (key, value, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT (key) DO UPDATE SET "
+                "value = CASE WHEN cache.expires_at < ? THEN excluded.value "
+                "ELSE CAST(cache.value AS INTEGER) + excluded.value END, "
+                "expires_at = CASE WHEN cache.expires_at < ? THEN excluded.expires_at "
+                "ELSE cache.expires_at END "
+                "RETURNING value",
+                (key, amount, self._expires_at(ttl), now, now)
+            ).fetchone()
+            return int(row[0])
+
+        return await self._run("incr", query, 0)
+
+    async def clear(self, prefix: str = ""):
+        await self._run(
+            "clear",
+            lambda db: db.execute("DELETE FROM cache WHERE substr(key, 1, ?) = ?", (len(prefix), prefix))
+        )
+
+    async def close(self):
+        with self._lock:
+            if self._db is not None and self._pid == os.getpid():
+                self._db.close()
+            self._db = None
+
+    def get_stats(self) -> Dict[str, Any]:
+        return {**super().get_stats(), 'path': self.path}
+
+
+class RedisBackend(CacheBackend):
+    """
+    Сервер Redis (или совместимый: Valkey, KeyDB), общий для всех процессов и машин
+
+    Работает через асинхронный клиент redis.asyncio. Ключи получают префикс
+    key_prefix, чтобы сервер можно было делить с другими приложениями. Пакет
+    redis импортируется только при выборе этого хранилища.
+    """
+
+    name = "redis"
+
+    def __init__(self, url: str, key_prefix: str = "road:", timeout: float = 0.5):
+        super().__init__()
+        try:
+            import redis
+            import redis.asyncio
+        except ImportError:
+            raise RuntimeError("Для CACHE_BACKEND=redis установите пакет redis: pip install redis")
+        self._errors = (redis.RedisError, OSError, asyncio.TimeoutError)
+        self.key_prefix = key_prefix
+        self._client = redis.asyncio.Redis.from_url(url, socket_timeout=timeout, socket_connect_timeout=timeout)
+
+    async def get_many(self, keys: List[str]) -> List[Optional[bytes]]:
+        if not keys or not self._available():
+            return [None] * len(keys)
+        try:
+            return await self._client.mget([self.key_prefix + key for key in keys])
+        except self._errors as e:
+            self._failed("get", e)
+            return [None] * len(keys)
+
+    async def set(self, key: str, value: bytes, ttl: Optional[float] = None):
+        if not self._available():
+            return
+        try:
+            await self._client.set(self.key_prefix + key, value, px=int(ttl * 1000) if ttl is not None else None)
+        except self._errors as e:
+            self._failed("set", e)
+
+    async def delete(self, key: str):
+        if not self._available():
+            return
+        try:
+            await self._client.delete(self.key_prefix + key)
+        except self._errors as e:
+            self._failed("delete", e)
+
+    async def incr(self, key: str, amount: int = 1, ttl: Optional[float] = None) -> int:
+        if not self._available():
+            return 0
+        try:
+            value = await self._client.incrby(self.key_prefix + key, amount)
+            if ttl is not None and value == amount:
+                await self._client.pexpire(self.key_prefix + key, int(ttl * 1000))
+        except self._errors as e:
+            self._failed("incr", e)
+            return 0
+        return value
+
+    async def clear(self, prefix: str = ""):
+        if not self._available():
+            return
+        try:
+            keys = [key async for key in self._client.scan_iter(match=self.key_prefix + prefix + "*", count=1000)]
+            for start in range(0, len(keys), 1000):
+                await self._client.delete(*keys[start:start + 1000])
+        except self._errors as e:
+            self._failed("clear", e)
+
+    async def close(self):
+        await self._client.aclose()
+
+
+# Общие хранилища создаются один раз на процесс
+_shared_backends: Dict[str, CacheBackend] = {}
+
+
+def create_backend(max_size: Optional[int] = None, max_bytes: Optional[int] = None) -> CacheBackend:
+    """
+    Хранилище для кэша по переменной CACHE_BACKEND
+
+    Ограничения max_size и max_bytes действуют только для memory: общие
+    хранилища ограничиваются временем жизни записей (и maxmemory у Redis).
+    """
+    kind = os.getenv("CACHE_BACKEND", "memory").lower()
+    if kind == "memory":
+        return MemoryBackend(max_size=max_size, max_bytes=max_bytes)
+
+    if kind not in _shared_backends:
+        if kind == "sqlite":
+            _shared_backends[kind] = SQLiteBackend(
+                os.getenv("CACHE_SQLITE_PATH", os.path.join(tempfile.gettempdir(), "road_to_dream_cache.sqlite3"))
+            )
+        elif kind == "redis":
+            _shared_backends[kind] = RedisBackend(
+                os.getenv("CACHE_REDIS_URL", "redis://localhost:6379/0"),
+                key_prefix=os.getenv("CACHE_KEY_PREFIX", "road:"),
+                timeout=float(os.getenv("CACHE_REDIS_TIMEOUT", "0.5"))
+            )
+        else:
+            raise ValueError(f"Неизвестный CACHE_BACKEND: {kind} (ожидается memory, sqlite или redis)")
+    return _shared_backends[kind]
+
+
+async def close_backends():
+    """Закрывает соединения общих хранилищ (при остановке сервиса)"""
+    for backend in _shared_backends.values():
+        await backend.close()
+
+
+class TTLCache:
+    """
+    Кэш с TTL поверх хранилища
+
+    Значения сериализуются в JSON. С хранилищем memory при переполнении
+    вытесняется запись, к которой дольше всего не обращались.
+    Записи старше ttl секунд считаются отсутствующими.
+    """
+
+    def __init__(self, max_size: int = 10000, ttl: float = 3600.0, namespace: str = "ttl",
+                 backend: Optional[CacheBackend] = None):
+        """
+        Args:
+            max_size: Максимальное количество записей (для хранилища memory)
+            ttl: Время жизни записи в секундах
+            namespace: Префикс ключей в общем хранилище
+            backend: Хранилище; по умолчанию create_backend()
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.namespace = namespace
+        self.backend = backend or create_backend(max_size=max_size)
+
+        # Статистика использования (по текущему процессу)
+        self.stats = {
+            'hits': 0,
+            'misses': 0
+        }
+
+    def _key(self, key: Hashable) -> str:
+        return f"{self.namespace}:{key}"
+
+    async def get(self, key: Hashable) -> Optional[Any]:
+        """Возвращает значение по ключу или None, если его нет или оно устарело"""
+        value = await self.backend.get(self._key(key))
+        if value is None:
+            self.stats['misses'] += 1
+            return None
+
+        self.stats['hits'] += 1
+        return json.loads(value)
+
+    async def set(self, key: Hashable, value: Any):
+        """Сохраняет значение на ttl секунд"""
+        await self.backend.set(self._key(key), json.dumps(value).encode(), self.ttl)
+
+    async def invalidate(self, key: Hashable):
+        """Удаляет запись из кэша"""
+        await self.backend.delete(self._key(key))
+
+    async def clear(self):
+        """Очищает кэш"""
+        await self.backend.clear(f"{self.namespace}:")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику использования кэша"""
+        total = self.stats['hits'] + self.stats['misses']
+        return {
+            **self.stats,
+            'hit_rate': round(self.stats['hits'] / total * 100, 2) if total else 0,
+            'storage': self.backend.get_stats()
+        }
+
+    def reset_stats(self):
+        """Сбрасывает статистику"""
+        self.stats = {
+            'hits': 0,
+            'misses': 0
+        }
+
+
+class Counters:
+    """
+    Счетчики статистики в хранилище кэша
+
+    С общим хранилищем счетчики одни на все процессы сервиса. Читаются через
+    get() и copy(), увеличиваются через incr().
+    """
+
+    def __init__(self, names: Iterable[str], namespace: str, backend: Optional[CacheBackend] = None):
+        """
+        Args:
+            names: Имена счетчиков
+            namespace: Префикс ключей в общем хранилище
+            backend: Хранилище; по умолчанию create_backend()
+        """
+        self.names = list(names)
+        self.namespace = namespace
+        self.backend = backend or create_backend()
+
+    def _key(self, name: str) -> str:
+        return f"{self.namespace}:{name}"
+
+    async def incr(self, name: str, amount: int = 1) -> int:
+        """Увеличивает счетчик"""
+        return await self.backend.incr(self._key(name), amount)
+
+    async def get(self, name: str) -> int:
+        """Значение счетчика"""
+        value = await self.backend.get(self._key(name))
+        return int(value) if value is not None else 0
+
+    async def copy(self) -> Dict[str, int]:
+        """Значения всех счетчиков одним обращением к хранилищу"""
+        values = await self.backend.get_many([self._key(name) for name in self.names])
+        return {name: int(value) if value is not None else 0 for name, value in zip(self.names, values)}
+
+    async def reset(self):
+        """Обнуляет все счетчики"""
+        for name in self.names:
+            await self.backend.delete(self._key(name))
+
+
+class ResponseCache:
+    """
+    Кэш сериализованных ответов (bytes) поверх хранилища
+
+    Записи сгруппированы по владельцу: у одного пользователя может быть несколько
+    вариантов ответа (страницы, фильтры), и при записи в его данные они устаревают
+    все сразу. Инвалидация - это одна отметка времени владельца в хранилище, поэтому
+    с общим хранилищем запись в одном процессе видна всем остальным. С хранилищем
+    memory при превышении max_bytes вытесняются записи, к которым дольше всего
+    не обращались.
+
+    Свежей считается запись не старше ttl секунд, которую не инвалидировали.
+    Устаревшие записи хранятся еще max_stale секунд и отдаются только через
+    get_stale() (stale-while-revalidate и stale-if-error), пока refresh()
+    загружает новый ответ: не больше одной загрузки на вариант ответа в процессе.
+
+    Чтобы ответ, прочитанный до записи, не считался свежим после инвалидации,
+    обработчик запоминает start_read() до чтения данных и передает его в set().
+    """
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: float = 60.0, max_stale: float = 0.0,
+                 namespace: str = "responses", backend: Optional[CacheBackend] = None):
+        """
+        Args:
+            max_bytes: Максимальный суммарный размер ответов в байтах (для хранилища memory)
+            ttl: Время жизни свежей записи в секундах
+            max_stale: Сколько секунд после ttl или инвалидации хранить устаревшую запись
+            namespace: Префикс ключей в общем хранилище
+            backend: Хранилище; по умолчанию create_backend()
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.namespace = namespace
+        self.backend = backend or create_backend(max_bytes=max_bytes)
+        self._refreshing: Dict[tuple, asyncio.Task] = {}
+
+        # Статистика использования (по текущему процессу)
+        self.stats = self._empty_stats()
+
+    @staticmethod
+    def _empty_stats() -> Dict[str, int]:
+        return {
+            'hits': 0,
+            'misses': 0,
+            'stale_hits': 0,
+            'invalidations': 0,
+            'stale_sets': 0,
+            'refreshes': 0,
+            'refresh_errors': 0
+        }
+
+    @property
+    def _lifetime(self) -> float:
+        """Сколько хранятся записи и отметки инвалидации"""
+        return self.ttl + self.max_stale
+
+    def _entry_key(self, owner: Hashable, variant: Hashable) -> str:
+        digest = hashlib.sha1(repr(variant).encode()).hexdigest()[:20]
+        return f"{self.namespace}:r:{owner}:{digest}"
+
+    def _invalidated_key(self, owner: Hashable) -> str:
+        return f"{self.namespace}:i:{owner}"
+
+    def _alias_key(self, alias: Hashable) -> str:
+        return f"{self.namespace}:a:{alias}"
+
+    def start_read(self) -> float:
+        """Отметка начала чтения данных для последующего set()"""
+        return time.time()
+
+    async def owner_of(self, alias: Hashable) -> Optional[str]:
+        """Владелец, сохраненный с псевдонимом alias (например, id пользователя по telegram_id)"""
+        owner = await self.backend.get(self._alias_key(alias))
+        return owner.decode() if owner is not None else None
+
+    async def _load(self, owner: Hashable, variant: Hashable) -> Optional[tuple]:
+        """
+        Запись и ее состояние без учета статистики
+
+        Returns:
+            Кортеж (тело, заголовки, время сохранения, время устаревания, инвалидирована) или None
+        """
+        value, invalidated_at = await self.backend.get_many([
+            self._entry_key(owner, variant), self._invalidated_key(owner)
+        ])
+        if value is None:
+            return None
+        meta, _, body = value.partition(b"\n")
+        meta = json.loads(meta)
+        stale_at = meta['stored_at'] + self.ttl
+
+        # Запись устарела, если владельца инвалидировали после начала чтения ее данных
+        invalidated = invalidated_at is not None and float(invalidated_at) >= meta['read_started']
+        if invalidated:
+            stale_at = min(stale_at, float(invalidated_at))
+        return body, meta['headers'], meta['stored_at'], stale_at, invalidated
+
+    async def get(self, owner: Hashable, variant: Hashable = None) -> Optional[Tuple[bytes, Dict[str, str]]]:
+        """Возвращает свежую запись (тело ответа, заголовки) или None"""
+        entry = await self._load(owner, variant)
+        if entry is None or entry[3] <= time.time():
+            self.stats['misses'] += 1
+            return None
+
+        self.stats['hits'] += 1
+        return entry[0], entry[1]
+
+    async def get_stale(self, owner: Hashable, variant: Hashable, max_stale: float,
+                        include_invalidated: bool = False) -> Optional[Tuple[bytes, Dict[str, str], float]]:
+        """
+        Возвращает запись, устаревшую не больше max_stale секунд назад (или свежую)
+
+        Args:
+            include_invalidated: Отдавать ли записи, инвалидированные после записи в данные
+                (их содержимое точно не совпадает с базой, подходят только при ее недоступности)
+
+        Returns:
+            Кортеж (тело ответа, заголовки, возраст в секундах) или None
+        """
+        entry = await self._load(owner, variant)
+        if entry is None:
+            return None
+        body, headers, stored_at, stale_at, invalidated = entry
+        now = time.time()
+        if now - stale_at > max_stale or (invalidated and not include_invalidated):
+            return None
+        self.stats['stale_hits'] += 1
+        return body, headers, max(now - stored_at, 0.0)
+
+    async def has(self, owner: Hashable, variant: Hashable = None) -> bool:
+        """Есть ли для варианта ответа владельца запись, свежая или устаревшая"""
+        return await self.backend.get(self._entry_key(owner, variant)) is not None
+
+    async def set(self, owner: Hashable, variant: Hashable, body: bytes, headers: Optional[Dict[str, str]] = None,
+                  read_started: Optional[float] = None, alias: Hashable = None):
+        """
+        Сохраняет тело ответа на ttl + max_stale секунд
+
+        Args:
+            headers: Заголовки, которые нужно вернуть вместе с телом (ETag и т.п.)
+            read_started: Результат start_read() перед чтением данных; если владельца
+                инвалидировали после этого момента, ответ устарел и не сохраняется
+            alias: Псевдоним владельца для owner_of()
+        """
+        if len(body) > self.max_bytes:
+            return
+        now = time.time()
+        if read_started is None:
+            read_started = now
+        invalidated_at = await self.backend.get(self._invalidated_key(owner))
+        if (invalidated_at is not None and float(invalidated_at) >= read_started) or \
+                read_started < now - self._lifetime:
+            self.stats['stale_sets'] += 1
+            return
+
+        meta = json.dumps({'headers': headers or {}, 'stored_at': now, 'read_started': read_started})
+        await self.backend.set(self._entry_key(owner, variant), meta.encode() + b"\n" + body, self._lifetime)
+        if alias is not None:
+            await self.backend.set(self._alias_key(alias), str(owner).encode(), self._lifetime)
+
+    async def invalidate(self, owner: Hashable):
+        """
+        Помечает все варианты ответа владельца устаревшими
+
+        Записи остаются для get_stale() с include_invalidated еще max_stale секунд.
+        """
+        await self.backend.set(self._invalidated_key(owner), repr(time.time()).encode(), self._lifetime)
+        self.stats['invalidations'] += 1
+
+    def refresh(self, owner: Hashable, variant: Hashable,
+                loader: Callable[[], Awaitable[Any]]) -> "asyncio.Task":
+        """
+        Запускает загрузку ответа, если она еще не идет, и возвращает ее задачу
+
+        Все запросы одного варианта ответа ждут одну и ту же загрузку, поэтому
+        при медленной базе к ней уходит один запрос, а не по одному на клиента.
+        loader сам сохраняет результат через set().
+        """
+        key = (owner, variant)
+        task = self._refreshing.get(key)
+        if task is None:
+            task = asyncio.ensure_future(loader())
+            self._refreshing[key] = task
+            self.stats['refreshes'] += 1
+            task.add_done_callback(lambda done: self._refresh_done(key, done))
+        return task
+
+    def _refresh_done(self, key: tuple, task: "asyncio.Task"):
+        """Снимает завершенную загрузку; ошибка забирается, чтобы не попасть в лог как необработанная"""
+        if self._refreshing.get(key) is task:
+            del self._refreshing[key]
+        if not task.cancelled() and task.exception() is not None:
+            self.stats['refresh_errors'] += 1
+
+    async def clear(self):
+        """Очищает кэш"""
+        await self.backend.clear(f"{self.namespace}:")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Возвращает статистику использования кэша"""
+        total = self.stats['hits'] + self.stats['misses']
+        return {
+            **self.stats,
+            'max_bytes': self.max_bytes,
+            'refreshing': len(self._refreshing),
+            'hit_rate': round(self.stats['hits'] / total * 100, 2) if total else 0,
+            'storage': self.backend.get_stats()
+        }
+
+    def reset_stats(self):
+        """Сбрасывает статистику"""
+        self.stats = self._empty_stats()
@@ -1,18 +1,25 @@
-from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks
+from fastapi import FastAPI, HTTPException, Depends, BackgroundTasks, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from supabase import create_client, Client
-from pydantic import BaseModel
-from typing import List, Optional, Dict, Any
-from datetime import datetime, date, timedelta
+from pydantic import BaseModel, TypeAdapter
+from typing import List, Optional, Dict, Any, Tuple, Callable, Awaitable
+from datetime import datetime, date, timedelta, timezone
 import os
 from dotenv import load_dotenv
 import uvicorn
 import httpx
 import random
 import logging
+import asyncio
+import base64
+import hashlib
+import json
+import uuid
 
 # Импортируем новый личный менеджер
 from ai_personal_manager import PersonalAIManager
+from repository import SupabaseRepository, PostgresRepository, RepositoryError, card_search_rank
+from memory_repository import MemoryRepository
+from cache import TTLCache, ResponseCache, Counters, close_backends
 
 # Настройка логирования
 logging.basicConfig(level=logging.INFO)
@@ -31,16 +38,93 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor", "ETag", "Age", "X-Data-Stale"],
 )
 
-# Настройка подключения к Supabase
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+# Источник данных: supabase (PostgREST по HTTPS), postgres (asyncpg напрямую)
+# или memory (таблицы в памяти процесса, для локального запуска, тестов и бенчмарков)
+DATA_BACKEND = os.getenv("DATA_BACKEND", "supabase").lower()
+
+if DATA_BACKEND == "postgres":
+    DATABASE_URL = os.getenv("DATABASE_URL")
+
+    if not DATABASE_URL:
+        raise ValueError("Для DATA_BACKEND=postgres должен быть установлен DATABASE_URL")
+
+    # Асинхронный репозиторий с пулом соединений asyncpg и подготовленными запросами
+    repository = PostgresRepository(
+        DATABASE_URL,
+        timeout=float(os.getenv("DATABASE_TIMEOUT", "10")),
+        max_connections=int(os.getenv("DATABASE_MAX_CONNECTIONS", "20")),
+        statement_cache_size=int(os.getenv("DATABASE_STATEMENT_CACHE_SIZE", "100"))
+    )
+elif DATA_BACKEND == "supabase":
+    # Настройка подключения к Supabase
+    SUPABASE_URL = os.getenv("SUPABASE_URL")
+    SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        raise ValueError(
+            "SUPABASE_URL и SUPABASE_KEY должны быть установлены в .env файле "
+            "(для запуска без базы: DATA_BACKEND=memory)"
+        )
+
+    # Асинхронный репозиторий с общим пулом соединений к PostgREST
+    repository = SupabaseRepository(
+        SUPABASE_URL,
+        SUPABASE_KEY,
+        timeout=float(os.getenv("SUPABASE_TIMEOUT", "10")),
+        max_connections=int(os.getenv("SUPABASE_MAX_CONNECTIONS", "20"))
+    )
+elif DATA_BACKEND == "memory":
+    # Данные не сохраняются между перезапусками и не общие для воркеров;
+    # задержка моделирует сеть до базы (для Supabase обычно 20-80 мс)
+    repository = MemoryRepository(
+        latency=float(os.getenv("MEMORY_LATENCY_MS", "0")) / 1000,
+        jitter=float(os.getenv("MEMORY_LATENCY_JITTER_MS", "0")) / 1000
+    )
+    logger.warning("DATA_BACKEND=memory: данные хранятся в памяти процесса и пропадут при перезапуске")
+else:
+    raise ValueError(f"Неизвестный DATA_BACKEND: {DATA_BACKEND} (ожидается supabase, postgres или memory)")
+
+# Кэш соответствия telegram_id -> id пользователя (id не меняется после регистрации)
+identity_cache = TTLCache(
+    max_size=int(os.getenv("IDENTITY_CACHE_SIZE", "10000")),
+    ttl=float(os.getenv("IDENTITY_CACHE_TTL", "3600")),
+    namespace="identity"
+)
 
-if not SUPABASE_URL or not SUPABASE_KEY:
-    raise ValueError("SUPABASE_URL и SUPABASE_KEY должны быть установлены в .env файле")
+# Сколько секунд после TTL ответ отдается сразу, пока в фоне идет обновление
+STALE_WHILE_REVALIDATE = float(os.getenv("STALE_WHILE_REVALIDATE", "30"))
+# Сколько секунд после устаревания ответ можно отдавать, если база недоступна
+STALE_IF_ERROR = float(os.getenv("STALE_IF_ERROR", "600"))
+# Сколько ждать базу, прежде чем отдать устаревший ответ (загрузка продолжится в фоне)
+STALE_TIMEOUT = float(os.getenv("STALE_TIMEOUT", "2"))
+
+# Кэш готовых JSON-ответов /users/{telegram_id}/data и /cards/{telegram_id} по id пользователя.
+# Обработчики записи помечают ответы пользователя устаревшими; TTL ограничивает
+# устаревание при записи другими процессами
+response_cache = ResponseCache(
+    max_bytes=int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    ttl=float(os.getenv("RESPONSE_CACHE_TTL", "60")),
+    max_stale=max(STALE_WHILE_REVALIDATE, STALE_IF_ERROR),
+    namespace="responses"
+)
 
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
+@app.on_event("shutdown")
+async def close_repository():
+    """Закрывает пул соединений с базой данных и общие хранилища кэша при остановке сервера"""
+    await repository.close()
+    await close_backends()
+
+async def resolve_user_id(telegram_id: int) -> Optional[str]:
+    """Возвращает id пользователя по telegram_id, обращаясь к базе только при промахе кэша"""
+    user_id = await identity_cache.get(telegram_id)
+    if user_id is None:
+        user_id = await repository.get_user_id(telegram_id)
+        if user_id:
+            await identity_cache.set(telegram_id, user_id)
+    return user_id
 
 # AI-агент класс
 class SimpleAIAgent:
@@ -64,16 +148,16 @@ class SimpleAIAgent:
             "Пиши на русском языке."
         )
         
-        # Статистика использования API
-        self.stats = {
-            'groq_success': 0,
-            'groq_failures': 0,
-            'huggingface_success': 0,
-            'huggingface_failures': 0,
-            'cohere_success': 0,
-            'cohere_failures': 0,
-            'fallback_used': 0
-        }
+        # Статистика использования API (общая для процессов при общем хранилище кэша)
+        self.stats = Counters([
+            'groq_success',
+            'groq_failures',
+            'huggingface_success',
+            'huggingface_failures',
+            'cohere_success',
+            'cohere_failures',
+            'fallback_used'
+        ], namespace="ai_agent_stats")
     
     async def get_ai_motivation(self, event: str) -> str:
         """
@@ -108,7 +192,7 @@ class SimpleAIAgent:
         
         # Fallback на предустановленные сообщения
         logger.info(f"Используем fallback для события: {event}")
-        self.stats['fallback_used'] += 1
+        await self.stats.incr('fallback_used')
         return self._get_fallback_motivation(event)
     
     async def _try_groq(self, prompt: str, event: str) -> str:
@@ -137,16 +221,16 @@ class SimpleAIAgent:
                     if 'choices' in result and len(result['choices']) > 0:
                         text = result['choices'][0]['message']['content']
                         if text:
-                            self.stats['groq_success'] += 1
+                            await self.stats.incr('groq_success')
                             logger.info(f"Groq сгенерировал мотивацию для события: {event}")
                             return text.strip()
                 
-                self.stats['groq_failures'] += 1
+                await self.stats.incr('groq_failures')
                 logger.warning(f"Groq недоступен: {response.status_code}")
                 return None
                 
         except Exception as e:
-            self.stats['groq_failures'] += 1
+            await self.stats.incr('groq_failures')
             logger.warning(f"Groq недоступен: {e}")
             return None
     
@@ -165,16 +249,16 @@ class SimpleAIAgent:
                     if isinstance(result, list) and len(result) > 0:
                         text = result[0].get('generated_text', '')
                         if text:
-                            self.stats['huggingface_success'] += 1
+                            await self.stats.incr('huggingface_success')
                             logger.info(f"Hugging Face сгенерировал мотивацию для события: {event}")
                             return text.strip()
                 
-                self.stats['huggingface_failures'] += 1
+                await self.stats.incr('huggingface_failures')
                 logger.warning(f"Hugging Face недоступен: {response.status_code}")
                 return None
                 
         except Exception as e:
-            self.stats['huggingface_failures'] += 1
+            await self.stats.incr('huggingface_failures')
             logger.warning(f"Hugging Face недоступен: {e}")
             return None
     
@@ -201,16 +285,16 @@ class SimpleAIAgent:
                     if 'generations' in result and len(result['generations']) > 0:
                         text = result['generations'][0].get('text', '')
                         if text:
-                            self.stats['cohere_success'] += 1
+                            await self.stats.incr('cohere_success')
                             logger.info(f"Cohere сгенерировал мотивацию для события: {event}")
                             return text.strip()
                 
-                self.stats['cohere_failures'] += 1
+                await self.stats.incr('cohere_failures')
                 logger.warning(f"Cohere недоступен: {response.status_code}")
                 return None
                 
         except Exception as e:
-            self.stats['cohere_failures'] += 1
+            await self.stats.incr('cohere_failures')
             logger.warning(f"Cohere недоступен: {e}")
             return None
     
@@ -309,21 +393,13 @@ class SimpleAIAgent:
         # Возвращаем случайное сообщение из списка
         return random.choice(messages)
     
-    def get_stats(self):
+    async def get_stats(self):
         """Возвращает статистику использования API"""
-        return self.stats.copy()
+        return await self.stats.copy()
     
-    def reset_stats(self):
+    async def reset_stats(self):
         """Сбрасывает статистику"""
-        self.stats = {
-            'groq_success': 0,
-            'groq_failures': 0,
-            'huggingface_success': 0,
-            'huggingface_failures': 0,
-            'cohere_success': 0,
-            'cohere_failures': 0,
-            'fallback_used': 0
-        }
+        await self.stats.reset()
 
 # Глобальный экземпляр AI-агента
 ai_agent = None
@@ -354,38 +430,42 @@ def get_personal_manager():
     return personal_manager
 
 # Функции для проверки триггеров AI
-async def check_ai_triggers(telegram_id: int, event_type: str = None):
-    """Проверяет триггеры для вызова AI и отправляет мотивационные сообщения"""
+async def check_ai_triggers(telegram_id: int, event_type: str = None, goals_total: Optional[int] = None):
+    """
+    Проверяет триггеры для вызова AI и отправляет мотивационные сообщения
+    
+    goals_total передают обработчики записи, которые уже знают количество целей:
+    тогда список целей не читается повторно.
+    """
     try:
         agent = get_ai_agent()
         if not agent:
             return None
         
-        # Получаем данные пользователя
-        user_data = await get_user_data_internal(telegram_id)
-        if not user_data:
+        # Получаем только нужные для триггеров данные: статусы целей и серию дней
+        user_id = await resolve_user_id(telegram_id)
+        if not user_id:
             return None
         
+        if goals_total is None:
+            goals, streak = await asyncio.gather(
+                repository.list_goals(user_id, projection='goal_status'),
+                repository.get_user_streak(user_id)
+            )
+            goals_total = len(goals)
+        else:
+            streak = await repository.get_user_streak(user_id)
+        last_action_date = (streak or {}).get('last_action_date')
+        
         # Проверяем различные триггеры
         triggers = []
         
-        # 1. Проверяем 7-дневную серию
-        if len(user_data['daily_actions']) >= 7:
-            # Проверяем, что последние 7 дней подряд
-            today = date.today()
-            consecutive_days = 0
-            for i in range(7):
-                check_date = today - timedelta(days=i)
-                if any(action['action_date'] == check_date.isoformat() for action in user_data['daily_actions']):
-                    consecutive_days += 1
-                else:
-                    break
-            
-            if consecutive_days == 7:
-                triggers.append('7_days_streak')
+        # 1. Проверяем 7-дневную серию (серия хранится в users и обновляется при записи действия)
+        if last_action_date == date.today().isoformat() and streak.get('current_streak', 0) >= 7:
+            triggers.append('7_days_streak')
         
         # 2. Проверяем первую цель
-        if len(user_data['goals']) == 1 and event_type == 'goal_created':
+        if goals_total == 1 and event_type == 'goal_created':
             triggers.append('first_goal')
         
         # 3. Проверяем завершение цели
@@ -393,13 +473,12 @@ async def check_ai_triggers(telegram_id: int, event_type: str = None):
             triggers.append('goal_completed')
         
         # 4. Проверяем вехи (каждые 5 целей)
-        if len(user_data['goals']) > 0 and len(user_data['goals']) % 5 == 0:
+        if goals_total > 0 and goals_total % 5 == 0:
             triggers.append('milestone_reached')
         
         # 5. Проверяем недельный обзор (каждые 7 дней с последнего действия)
-        if user_data['daily_actions']:
-            last_action_date = datetime.fromisoformat(user_data['daily_actions'][0]['action_date']).date()
-            days_since_last = (date.today() - last_action_date).days
+        if last_action_date:
+            days_since_last = (date.today() - date.fromisoformat(last_action_date)).days
             if days_since_last >= 7:
                 triggers.append('weekly_review')
         
@@ -418,38 +497,334 @@ async def check_ai_triggers(telegram_id: int, event_type: str = None):
         logger.error(f"Ошибка при проверке AI триггеров: {e}")
         return None
 
+# Таймаут одного запроса при параллельной загрузке данных пользователя
+SNAPSHOT_QUERY_TIMEOUT = float(os.getenv("SNAPSHOT_QUERY_TIMEOUT", "5"))
+
+async def fetch_user_snapshot(telegram_id: int, limit: Optional[int] = None,
+                              cards_after: Optional[tuple] = None,
+                              actions_before: Optional[str] = None,
+                              actions_since: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Получает все данные пользователя одним запросом к базе (функция get_user_snapshot)
+    
+    Если функция не установлена в базе, переключается на параллельные запросы к таблицам.
+    
+    Args:
+        telegram_id: ID пользователя в Telegram
+        limit: Максимальное количество карт и действий (None - все)
+        cards_after: Ключ (created_at, id) последней полученной карты
+        actions_before: Дата последнего полученного действия
+        actions_since: Только действия с этой даты
+    
+    Returns:
+        Словарь с ключами user, goals, daily_actions, cards или None, если пользователь не найден
+    """
+    try:
+        snapshot = await repository.get_user_snapshot(telegram_id, limit, cards_after, actions_before, actions_since)
+    except RepositoryError as e:
+        if not e.is_missing_function:
+            raise
+        return await fetch_user_snapshot_concurrently(telegram_id, limit, cards_after, actions_before, actions_since)
+    
+    if not snapshot:
+        await identity_cache.invalidate(telegram_id)
+        return None
+    
+    await identity_cache.set(telegram_id, snapshot['user']['id'])
+    return snapshot
+
+async def _fetch_snapshot_part(name: str, query) -> Optional[List[Dict[str, Any]]]:
+    """Выполняет запрос части данных с таймаутом, возвращает None при ошибке"""
+    try:
+        return await asyncio.wait_for(query, timeout=SNAPSHOT_QUERY_TIMEOUT)
+    except Exception as e:
+        logger.warning(f"Не удалось получить {name}: {e!r}")
+        return None
+
+async def fetch_user_snapshot_concurrently(telegram_id: int, limit: Optional[int] = None,
+                                           cards_after: Optional[tuple] = None,
+                                           actions_before: Optional[str] = None,
+                                           actions_since: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """
+    Запасной путь без get_user_snapshot: цели, действия и карты запрашиваются параллельно
+    
+    Части, которые не удалось получить за SNAPSHOT_QUERY_TIMEOUT, возвращаются пустыми,
+    а снимок помечается как degraded со списком недостающих частей в degraded_parts.
+    """
+    parts = {
+        'goals': lambda user_id: repository.list_goals(user_id),
+        'daily_actions': lambda user_id: repository.list_daily_actions(
+            user_id, limit=limit, before=actions_before, since=actions_since
+        ),
+        'cards': lambda user_id: repository.list_cards(user_id, limit=limit, after=cards_after)
+    }
+    
+    def fetch_parts(user_id: str):
+        return [_fetch_snapshot_part(name, fetch(user_id)) for name, fetch in parts.items()]
+    
+    user_query = asyncio.wait_for(repository.get_user_by_telegram_id(telegram_id), timeout=SNAPSHOT_QUERY_TIMEOUT)
+    
+    # Если id уже известен, пользователь запрашивается вместе с остальными таблицами
+    cached_user_id = await identity_cache.get(telegram_id)
+    if cached_user_id:
+        user_data, *results = await asyncio.gather(user_query, *fetch_parts(cached_user_id))
+    else:
+        user_data = await user_query
+        results = []
+    
+    if not user_data:
+        await identity_cache.invalidate(telegram_id)
+        return None
+    
+    if user_data['id'] != cached_user_id:
+        results = await asyncio.gather(*fetch_parts(user_data['id']))
+    await identity_cache.set(telegram_id, user_data['id'])
+    
+    snapshot = {'user': user_data}
+    degraded_parts = []
+    for name, result in zip(parts, results):
+        if result is None:
+            degraded_parts.append(name)
+        snapshot[name] = result or []
+    
+    snapshot['degraded'] = bool(degraded_parts)
+    snapshot['degraded_parts'] = degraded_parts
+    return snapshot
+
+# За сколько последних дней личный менеджер получает действия пользователя. Итоги за все
+# время берутся из user_counters, поэтому старые секции daily_actions не читаются
+AI_ACTIONS_WINDOW_DAYS = int(os.getenv("AI_ACTIONS_WINDOW_DAYS", "30"))
+
 async def get_user_data_internal(telegram_id: int):
     """Внутренняя функция для получения данных пользователя без HTTP ответа"""
     try:
-        # Находим пользователя
-        user = supabase.table("users").select("*").eq("telegram_id", telegram_id).execute()
-        
-        if not user.data:
-            return None
-        
-        user_data = user.data[0]
-        user_id = user_data["id"]
-        
-        # Получаем цели пользователя
-        goals = supabase.table("goals").select("*").eq("user_id", user_id).execute()
-        
-        # Получаем ежедневные действия пользователя
-        daily_actions = supabase.table("daily_actions").select("*").eq("user_id", user_id).order("action_date", desc=True).execute()
-        
-        # Получаем карты пользователя
-        cards = supabase.table("cards").select("*").eq("user_id", user_id).execute()
-        
-        return {
-            'user': user_data,
-            'goals': goals.data,
-            'daily_actions': daily_actions.data,
-            'cards': cards.data
-        }
+        # Окно ограничено с двух сторон: иначе читались бы еще секция следующего года и секция по умолчанию
+        today = date.today()
+        return await fetch_user_snapshot(
+            telegram_id,
+            actions_before=(today + timedelta(days=1)).isoformat(),
+            actions_since=(today - timedelta(days=AI_ACTIONS_WINDOW_DAYS)).isoformat()
+        )
         
     except Exception as e:
         logger.error(f"Ошибка при получении данных пользователя: {e}")
         return None
 
+# ========== Постраничная выдача ==========
+
+# Максимальный размер страницы карт и действий
+MAX_PAGE_SIZE = 500
+
+def encode_cursor(value: Any) -> str:
+    """Кодирует ключ последней строки страницы в непрозрачный курсор"""
+    return base64.urlsafe_b64encode(json.dumps(value).encode()).decode().rstrip("=")
+
+def _decode_cursor(cursor: str) -> Any:
+    """Раскодирует курсор, полученный от клиента"""
+    try:
+        return json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+
+def decode_cards_cursor(cursor: Optional[str]) -> Optional[tuple]:
+    """Возвращает ключ (created_at, id) из курсора карт"""
+    if not cursor:
+        return None
+    value = _decode_cursor(cursor)
+    try:
+        created_at, card_id = value
+        created_at = datetime.fromisoformat(created_at.replace('Z', '+00:00'))
+        card_id = uuid.UUID(card_id)
+    except (ValueError, TypeError, AttributeError):
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+    return created_at.isoformat(), str(card_id)
+
+def decode_search_cursor(cursor: Optional[str]) -> Optional[tuple]:
+    """Возвращает ключ (rank, id) из курсора поиска по картам"""
+    if not cursor:
+        return None
+    value = _decode_cursor(cursor)
+    try:
+        rank, card_id = value
+        if isinstance(rank, bool) or not isinstance(rank, (int, float)):
+            raise ValueError(rank)
+        card_id = uuid.UUID(card_id)
+    except (ValueError, TypeError, AttributeError):
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+    return float(rank), str(card_id)
+
+def decode_actions_cursor(cursor: Optional[str]) -> Optional[str]:
+    """Возвращает дату action_date из курсора действий"""
+    if not cursor:
+        return None
+    value = _decode_cursor(cursor)
+    try:
+        return date.fromisoformat(value).isoformat()
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Некорректный курсор")
+
+def parse_card_id(card_id: str) -> str:
+    """Проверяет id карты из пути: некорректный id - 400, а не ошибка базы"""
+    try:
+        return str(uuid.UUID(card_id))
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Некорректный id карты: {card_id}")
+
+def split_page(rows: List[Dict[str, Any]], limit: Optional[int], key) -> tuple:
+    """
+    Отрезает страницу от строк, запрошенных с запасом в одну строку
+    
+    Returns:
+        Кортеж (строки страницы, курсор следующей страницы или None)
+    """
+    if limit is None or len(rows) <= limit:
+        return rows, None
+    page = rows[:limit]
+    return page, encode_cursor(key(page[-1]))
+
+def card_cursor_key(card: Dict[str, Any]) -> list:
+    """Ключ курсора карты: (created_at, id)"""
+    return [card["created_at"], card["id"]]
+
+def archived_card_cursor_key(card: Dict[str, Any]) -> list:
+    """Ключ курсора карты из архива: (archived_at, id)"""
+    return [card["archived_at"], card["id"]]
+
+def search_cursor_key(card: Dict[str, Any]) -> list:
+    """Ключ курсора найденной карты: (rank, id)"""
+    return [card["rank"], card["id"]]
+
+def action_cursor_key(action: Dict[str, Any]) -> str:
+    """Ключ курсора действия: action_date"""
+    return action["action_date"]
+
+# ========== Условные запросы (ETag) ==========
+
+# Ответы с данными пользователя всегда перепроверяются по ETag
+DATA_CACHE_CONTROL = "private, no-cache"
+
+def make_etag(user_id: str, version: int, request: Request) -> str:
+    """
+    ETag ответа: версия данных пользователя из user_counters.data_version
+    и отпечаток запроса (путь и параметры страницы и фильтров)
+    """
+    fingerprint = hashlib.sha1(f"{user_id}|{request.url.path}|{request.url.query}".encode()).hexdigest()[:16]
+    return f'"{version}-{fingerprint}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Проверяет заголовок If-None-Match (слабое сравнение, как требует RFC 9110)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return any((tag[2:] if tag.startswith("W/") else tag) == etag for tag in candidates)
+
+async def current_etag(telegram_id: int, request: Request) -> Optional[str]:
+    """
+    ETag по текущей версии данных пользователя (один запрос по первичному ключу)
+    
+    Версия читается до самих данных: если данные изменятся между запросами,
+    клиент получит устаревший ETag и при следующей загрузке просто скачает данные заново.
+    """
+    user_id = await resolve_user_id(telegram_id)
+    if not user_id:
+        return None
+    counters = await repository.get_user_counters(user_id, projection='data_version')
+    if not counters:
+        return None
+    return make_etag(user_id, counters["data_version"], request)
+
+def not_modified(etag: str) -> Response:
+    """Ответ 304 без тела"""
+    return Response(status_code=304, headers={"ETag": etag, "Cache-Control": DATA_CACHE_CONTROL})
+
+def data_headers(etag: Optional[str]) -> Dict[str, str]:
+    """Заголовки ответа с данными пользователя"""
+    return {"ETag": etag, "Cache-Control": DATA_CACHE_CONTROL} if etag else {}
+
+def json_response(body: bytes, headers: Dict[str, str], request: Request, age: Optional[float] = None) -> Response:
+    """
+    Ответ с уже сериализованным JSON; 304, если ETag совпадает с If-None-Match
+    
+    Args:
+        age: Возраст устаревшего ответа в секундах; такой ответ помечается
+            заголовками Age и X-Data-Stale
+    """
+    headers = dict(headers)
+    if age is not None:
+        headers["Age"] = str(int(age))
+        headers["X-Data-Stale"] = "1"
+    etag = headers.get("ETag")
+    if etag and etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+# ========== Устаревшие ответы (stale-while-revalidate) ==========
+
+def response_variant(request: Request) -> tuple:
+    """Вариант ответа в response_cache: путь и параметры запроса"""
+    return request.url.path, request.url.query
+
+async def serve_user_response(telegram_id: int, user_id: Optional[str], request: Request,
+                              loader: Callable[[], Awaitable[Tuple[bytes, Dict[str, str]]]]) -> Response:
+    """
+    Отдает ответ с данными пользователя через response_cache
+    
+    - свежий ответ из кэша отдается без обращения к базе;
+    - ответ, устаревший не больше STALE_WHILE_REVALIDATE секунд назад, отдается сразу,
+      а обновление идет в фоне;
+    - если база не ответила за STALE_TIMEOUT секунд или вернула ошибку, отдается ответ,
+      устаревший не больше STALE_IF_ERROR секунд назад, даже после записи в данные;
+    - иначе запрос ждет загрузку.
+    Загрузка одного варианта ответа всегда одна: одновременные запросы ждут ее вместе.
+    
+    Args:
+        user_id: Id пользователя, если он известен без запроса к базе
+        loader: Загружает ответ (тело, заголовки) и сохраняет его в response_cache
+    """
+    variant = response_variant(request)
+    if user_id:
+        cached = await response_cache.get(user_id, variant)
+        if cached:
+            return json_response(*cached, request)
+        
+        stale = await response_cache.get_stale(user_id, variant, STALE_WHILE_REVALIDATE)
+        if stale:
+            response_cache.refresh(user_id, variant, loader)
+            body, headers, age = stale
+            return json_response(body, headers, request, age=age)
+    
+    has_fallback = user_id is not None and await response_cache.has(user_id, variant)
+    
+    # Данные не изменились: 304 без загрузки и сериализации данных
+    if not has_fallback and request.headers.get("if-none-match"):
+        etag = await current_etag(telegram_id, request)
+        if etag and etag_matches(request.headers.get("if-none-match"), etag):
+            return not_modified(etag)
+    
+    if not user_id:
+        return json_response(*await loader(), request)
+    
+    # shield: отключение клиента не отменяет загрузку, которую ждут другие запросы
+    task = response_cache.refresh(user_id, variant, loader)
+    if not has_fallback:
+        return json_response(*await asyncio.shield(task), request)
+    
+    try:
+        return json_response(*await asyncio.wait_for(asyncio.shield(task), timeout=STALE_TIMEOUT), request)
+    except HTTPException:
+        raise
+    except Exception as e:
+        stale = await response_cache.get_stale(user_id, variant, STALE_IF_ERROR, include_invalidated=True)
+        if not stale:
+            if isinstance(e, asyncio.TimeoutError):
+                return json_response(*await asyncio.shield(task), request)
+            raise
+        logger.warning(f"База не ответила, отдаем устаревший ответ пользователю {telegram_id}: {e!r}")
+        body, headers, age = stale
+        return json_response(body, headers, request, age=age)
+
 # Pydantic модели
 class UserCreate(BaseModel):
     telegram_id: int
@@ -465,6 +840,9 @@ class User(BaseModel):
     first_name: Optional[str] = None
     last_name: Optional[str] = None
     photo_url: Optional[str] = None
+    current_streak: int = 0
+    longest_streak: int = 0
+    last_action_date: Optional[date] = None
     created_at: datetime
     updated_at: datetime
 
@@ -476,6 +854,24 @@ class GoalsRequest(BaseModel):
     telegram_id: int
     goals: List[GoalCreate]
 
+class GoalUpdate(BaseModel):
+    goal_type: Optional[str] = None
+    description: Optional[str] = None
+    is_completed: Optional[bool] = None
+
+class GoalUpdateRequest(GoalUpdate):
+    telegram_id: int
+
+class GoalCompleteRequest(BaseModel):
+    telegram_id: int
+
+class GoalBatchItem(GoalUpdate):
+    id: str
+
+class GoalsBatchRequest(BaseModel):
+    telegram_id: int
+    items: List[GoalBatchItem]
+
 class ActionCompleteRequest(BaseModel):
     telegram_id: int
 
@@ -545,10 +941,29 @@ class Card(BaseModel):
     created_at: datetime
     updated_at: datetime
 
+card_list_adapter = TypeAdapter(List[Card])
+
+class ArchivedCard(Card):
+    archived_at: datetime  # время переноса в cards_archive
+
+class CardSearchResult(Card):
+    rank: float  # релевантность запросу: совпадение в заголовке весит больше, чем в описании
+
+class CardRestoreRequest(BaseModel):
+    telegram_id: int
+
 class CardsRequest(BaseModel):
     telegram_id: int
     cards: List[CardCreate]
 
+class CardBatchItem(CardUpdate):
+    id: str
+    delete: bool = False  # мягкое удаление, остальные поля игнорируются
+
+class CardsBatchRequest(BaseModel):
+    telegram_id: int
+    items: List[CardBatchItem]
+
 class TelegramAuthData(BaseModel):
     telegram_id: int
     username: Optional[str] = None
@@ -563,6 +978,23 @@ class UserData(BaseModel):
     goals: List[Goal]
     daily_actions: List[DailyAction]
     cards: List[Card]
+    degraded: bool = False  # часть данных не удалось получить
+    degraded_parts: List[str] = []
+    next_cursors: Dict[str, str] = {}  # курсоры следующих страниц: cards, daily_actions
+    counters: Optional[Dict[str, Any]] = None  # счетчики из user_counters
+
+class CardTombstone(BaseModel):
+    id: str
+    updated_at: datetime
+
+class UserChanges(BaseModel):
+    user: Optional[User] = None  # только если профиль или серия изменились
+    goals: List[Goal]
+    cards: List[Card]
+    deleted_cards: List[CardTombstone]  # мягко удаленные и перенесенные в архив карты
+    daily_actions: List[DailyAction]
+    counters: Optional[Dict[str, Any]] = None
+    watermark: datetime  # передается как since в следующем запросе
 
 # Функции для работы с Telegram WebApp
 def verify_telegram_auth(auth_data: TelegramAuthData) -> bool:
@@ -587,69 +1019,144 @@ async def root():
     """Базовый эндпоинт для проверки статуса API"""
     return {"status": "ok"}
 
+def build_user(user: Dict[str, Any]) -> User:
+    """Строит модель ответа из строки users"""
+    return User(
+        id=user["id"],
+        telegram_id=user["telegram_id"],
+        username=user["username"],
+        first_name=user.get("first_name"),
+        last_name=user.get("last_name"),
+        photo_url=user.get("photo_url"),
+        current_streak=user.get("current_streak", 0),
+        longest_streak=user.get("longest_streak", 0),
+        last_action_date=user.get("last_action_date"),
+        created_at=datetime.fromisoformat(user["created_at"].replace('Z', '+00:00')),
+        updated_at=datetime.fromisoformat(user["updated_at"].replace('Z', '+00:00'))
+    )
+
+def build_goal(goal: Dict[str, Any]) -> Goal:
+    """Строит модель ответа из строки goals"""
+    return Goal(
+        id=goal["id"],
+        user_id=goal["user_id"],
+        goal_type=goal["goal_type"],
+        description=goal["description"],
+        is_completed=goal["is_completed"],
+        created_at=datetime.fromisoformat(goal["created_at"].replace('Z', '+00:00')),
+        updated_at=datetime.fromisoformat(goal["updated_at"].replace('Z', '+00:00'))
+    )
+
+def build_daily_action(action: Dict[str, Any]) -> DailyAction:
+    """Строит модель ответа из строки daily_actions"""
+    return DailyAction(
+        id=action["id"],
+        user_id=action["user_id"],
+        action_date=datetime.fromisoformat(action["action_date"]).date(),
+        created_at=datetime.fromisoformat(action["created_at"].replace('Z', '+00:00'))
+    )
+
+def build_card(card: Dict[str, Any]) -> Card:
+    """Строит модель ответа из строки cards"""
+    return Card(
+        id=card["id"],
+        user_id=card["user_id"],
+        title=card["title"],
+        description=card["description"],
+        card_type=card["card_type"],
+        status=card["status"],
+        priority=card["priority"],
+        due_date=datetime.fromisoformat(card["due_date"]).date() if card["due_date"] else None,
+        tags=card["tags"] or [],
+        metadata=card["metadata"] or {},
+        created_at=datetime.fromisoformat(card["created_at"].replace('Z', '+00:00')),
+        updated_at=datetime.fromisoformat(card["updated_at"].replace('Z', '+00:00'))
+    )
+
+def build_archived_card(card: Dict[str, Any]) -> ArchivedCard:
+    """Строит модель ответа из строки cards_archive"""
+    return ArchivedCard(
+        **build_card(card).model_dump(),
+        archived_at=datetime.fromisoformat(card["archived_at"].replace('Z', '+00:00'))
+    )
+
+def build_card_search_result(card: Dict[str, Any]) -> CardSearchResult:
+    """Строит модель ответа из карты, найденной search_cards"""
+    return CardSearchResult(**build_card(card).model_dump(), rank=card["rank"])
+
+async def register_user_in_steps(user_data: UserCreate) -> Tuple[Optional[Dict[str, Any]], bool]:
+    """
+    Регистрация без функции upsert_user: чтение, сравнение и запись отдельными запросами
+    
+    Returns:
+        Пара (пользователь, была ли строка создана или изменена)
+    """
+    existing_user = await repository.get_user_by_telegram_id(user_data.telegram_id)
+    
+    if existing_user:
+        # Пользователь существует, обновляем его данные если нужно
+        user = existing_user
+        update_data = {}
+        
+        # Обновляем поля если они изменились
+        if user_data.first_name and user_data.first_name != user.get("first_name"):
+            update_data["first_name"] = user_data.first_name
+        if user_data.last_name and user_data.last_name != user.get("last_name"):
+            update_data["last_name"] = user_data.last_name
+        if user_data.photo_url and user_data.photo_url != user.get("photo_url"):
+            update_data["photo_url"] = user_data.photo_url
+        if user_data.username and user_data.username != user.get("username"):
+            update_data["username"] = user_data.username
+        
+        if update_data:
+            update_data["updated_at"] = datetime.now().isoformat()
+            updated_user = await repository.update_user(user["id"], update_data)
+            if updated_user:
+                user = updated_user
+        return user, bool(update_data)
+    
+    # Пользователя нет в базе - старое соответствие в кэше недействительно
+    await identity_cache.invalidate(user_data.telegram_id)
+    
+    # Создаем нового пользователя
+    new_user = await repository.create_user({
+        "telegram_id": user_data.telegram_id,
+        "username": user_data.username,
+        "first_name": user_data.first_name,
+        "last_name": user_data.last_name,
+        "photo_url": user_data.photo_url
+    })
+    return new_user, True
+
 @app.post("/register", response_model=User)
 async def register_user(user_data: UserCreate):
     """Регистрация пользователя или получение существующего"""
     try:
-        # Проверяем, существует ли пользователь
-        existing_user = supabase.table("users").select("*").eq("telegram_id", user_data.telegram_id).execute()
-        
-        if existing_user.data:
-            # Пользователь существует, обновляем его данные если нужно
-            user = existing_user.data[0]
-            update_data = {}
-            
-            # Обновляем поля если они изменились
-            if user_data.first_name and user_data.first_name != user.get("first_name"):
-                update_data["first_name"] = user_data.first_name
-            if user_data.last_name and user_data.last_name != user.get("last_name"):
-                update_data["last_name"] = user_data.last_name
-            if user_data.photo_url and user_data.photo_url != user.get("photo_url"):
-                update_data["photo_url"] = user_data.photo_url
-            if user_data.username and user_data.username != user.get("username"):
-                update_data["username"] = user_data.username
-            
-            if update_data:
-                update_data["updated_at"] = datetime.now().isoformat()
-                updated_user = supabase.table("users").update(update_data).eq("id", user["id"]).execute()
-                if updated_user.data:
-                    user = updated_user.data[0]
-            
-            return User(
-                id=user["id"],
-                telegram_id=user["telegram_id"],
-                username=user["username"],
-                first_name=user.get("first_name"),
-                last_name=user.get("last_name"),
-                photo_url=user.get("photo_url"),
-                created_at=datetime.fromisoformat(user["created_at"].replace('Z', '+00:00')),
-                updated_at=datetime.fromisoformat(user["updated_at"].replace('Z', '+00:00'))
-            )
-        else:
-            # Создаем нового пользователя
-            new_user = supabase.table("users").insert({
+        # Один запрос: вставка или обновление изменившихся полей профиля Telegram.
+        # Если профиль не изменился, запись не выполняется
+        try:
+            user, changed = await repository.upsert_user({
                 "telegram_id": user_data.telegram_id,
                 "username": user_data.username,
                 "first_name": user_data.first_name,
                 "last_name": user_data.last_name,
                 "photo_url": user_data.photo_url
-            }).execute()
-            
-            if new_user.data:
-                user = new_user.data[0]
-                return User(
-                    id=user["id"],
-                    telegram_id=user["telegram_id"],
-                    username=user["username"],
-                    first_name=user.get("first_name"),
-                    last_name=user.get("last_name"),
-                    photo_url=user.get("photo_url"),
-                    created_at=datetime.fromisoformat(user["created_at"].replace('Z', '+00:00')),
-                    updated_at=datetime.fromisoformat(user["updated_at"].replace('Z', '+00:00'))
-                )
-            else:
-                raise HTTPException(status_code=500, detail="Ошибка при создании пользователя")
-                
+            })
+        except RepositoryError as e:
+            if not e.is_missing_function:
+                raise
+            user, changed = await register_user_in_steps(user_data)
+        
+        if not user:
+            raise HTTPException(status_code=500, detail="Ошибка при создании пользователя")
+        
+        await identity_cache.set(user["telegram_id"], user["id"])
+        if changed:
+            await response_cache.invalidate(user["id"])
+        return build_user(user)
+    
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
 
@@ -678,13 +1185,11 @@ async def create_goals(goals_request: GoalsRequest, background_tasks: Background
     """Создание целей для пользователя"""
     try:
         # Находим пользователя
-        user = supabase.table("users").select("id").eq("telegram_id", goals_request.telegram_id).execute()
+        user_id = await resolve_user_id(goals_request.telegram_id)
         
-        if not user.data:
+        if not user_id:
             raise HTTPException(status_code=404, detail="Пользователь не найден")
         
-        user_id = user.data[0]["id"]
-        
         # Подготавливаем данные для вставки
         goals_to_insert = []
         for goal in goals_request.goals:
@@ -696,13 +1201,14 @@ async def create_goals(goals_request: GoalsRequest, background_tasks: Background
             })
         
         # Вставляем цели
-        result = supabase.table("goals").insert(goals_to_insert).execute()
+        result = await repository.create_goals(goals_to_insert)
+        await response_cache.invalidate(user_id)
         
-        if result.data:
+        if result:
             # Проверяем AI-триггеры в фоновом режиме
             background_tasks.add_task(check_ai_triggers, goals_request.telegram_id, "goal_created")
             
-            return {"message": f"Создано {len(result.data)} целей", "goals": result.data}
+            return {"message": f"Создано {len(result)} целей", "goals": result}
         else:
             raise HTTPException(status_code=500, detail="Ошибка при создании целей")
             
@@ -711,38 +1217,192 @@ async def create_goals(goals_request: GoalsRequest, background_tasks: Background
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
 
+# Максимальное количество целей или карт в одном пакетном изменении
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "500"))
+
+def goal_update_values(goal_update: GoalUpdate) -> Dict[str, Any]:
+    """Поля цели, переданные в запросе на обновление"""
+    update_data = {}
+    
+    if goal_update.goal_type is not None:
+        update_data["goal_type"] = goal_update.goal_type
+    if goal_update.description is not None:
+        update_data["description"] = goal_update.description
+    if goal_update.is_completed is not None:
+        update_data["is_completed"] = goal_update.is_completed
+    
+    return update_data
+
+async def apply_goal_updates(telegram_id: int, items: List[Dict[str, Any]],
+                             background_tasks: BackgroundTasks) -> List[Dict[str, Any]]:
+    """
+    Применяет изменения целей пользователя одним запросом и запускает AI-триггеры
+    
+    Args:
+        items: Элементы {"id", "values"}
+    
+    Returns:
+        Результаты в порядке элементов: {"id", "status", "goal", "completed_now"}
+    """
+    for item in items:
+        try:
+            item["id"] = str(uuid.UUID(item["id"]))
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Некорректный id цели: {item['id']}")
+        if not item["values"]:
+            raise HTTPException(status_code=400, detail=f"Нет данных для обновления цели {item['id']}")
+    
+    if len({item["id"] for item in items}) != len(items):
+        raise HTTPException(status_code=400, detail="Цель указана в пакете несколько раз")
+    
+    user_id = await resolve_user_id(telegram_id)
+    if not user_id:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    
+    goals_total = None
+    try:
+        batch = await repository.update_goals_batch(user_id, items)
+        results = batch["results"]
+        goals_total = batch["goals_total"]
+    except RepositoryError as e:
+        if not e.is_missing_function:
+            raise
+        # Функции update_goals_batch нет в базе: параллельные обновления по одной цели.
+        # Прежнее состояние цели здесь неизвестно, поэтому выполненной считается
+        # любая цель, которой передали is_completed = true
+        updated_at = datetime.now().isoformat()
+        goals = await asyncio.gather(*(
+            repository.update_goal(user_id, item["id"], {**item["values"], "updated_at": updated_at})
+            for item in items
+        ))
+        results = [
+            {
+                "id": item["id"],
+                "status": "updated" if goal else "not_found",
+                "goal": goal,
+                "completed_now": bool(goal) and item["values"].get("is_completed") is True
+            }
+            for item, goal in zip(items, goals)
+        ]
+    await response_cache.invalidate(user_id)
+    
+    if any(result["completed_now"] for result in results):
+        # Проверяем AI-триггеры в фоновом режиме, не перечитывая цели пользователя
+        background_tasks.add_task(check_ai_triggers, telegram_id, "goal_completed", goals_total)
+    
+    return results
+
+@app.put("/goals/{goal_id}")
+async def update_goal(goal_id: str, goal_update: GoalUpdateRequest, background_tasks: BackgroundTasks):
+    """Обновление цели (в том числе отметка о выполнении)"""
+    try:
+        results = await apply_goal_updates(
+            goal_update.telegram_id,
+            [{"id": goal_id, "values": goal_update_values(goal_update)}],
+            background_tasks
+        )
+        
+        if results[0]["status"] == "not_found":
+            raise HTTPException(status_code=404, detail="Цель не найдена")
+        
+        return {"message": "Цель обновлена", "goal": results[0]["goal"]}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
+
+@app.post("/goals/{goal_id}/complete")
+async def complete_goal(goal_id: str, complete_request: GoalCompleteRequest, background_tasks: BackgroundTasks):
+    """Отметка цели как выполненной"""
+    try:
+        results = await apply_goal_updates(
+            complete_request.telegram_id,
+            [{"id": goal_id, "values": {"is_completed": True}}],
+            background_tasks
+        )
+        
+        if results[0]["status"] == "not_found":
+            raise HTTPException(status_code=404, detail="Цель не найдена")
+        
+        return {"message": "Цель выполнена", "goal": results[0]["goal"]}
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
+
+@app.patch("/goals/batch")
+async def update_goals_batch(batch_request: GoalsBatchRequest, background_tasks: BackgroundTasks):
+    """
+    Пакетное изменение и выполнение целей одним запросом
+    
+    Для каждого элемента возвращается результат в том же порядке:
+    updated или not_found (цели нет или она чужая).
+    """
+    try:
+        if not batch_request.items:
+            raise HTTPException(status_code=400, detail="Нет данных для обновления")
+        if len(batch_request.items) > MAX_BATCH_SIZE:
+            raise HTTPException(status_code=400, detail=f"Не больше {MAX_BATCH_SIZE} целей за запрос")
+        
+        results = await apply_goal_updates(
+            batch_request.telegram_id,
+            [{"id": item.id, "values": goal_update_values(item)} for item in batch_request.items],
+            background_tasks
+        )
+        
+        return {
+            "message": "Цели обновлены",
+            "updated": sum(1 for result in results if result["status"] == "updated"),
+            "completed": sum(1 for result in results if result["completed_now"]),
+            "not_found": sum(1 for result in results if result["status"] == "not_found"),
+            "results": results
+        }
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
+
 @app.post("/actions/complete")
 async def complete_action(action_request: ActionCompleteRequest, background_tasks: BackgroundTasks):
     """Отметить выполнение ежедневного действия"""
     try:
         # Находим пользователя
-        user = supabase.table("users").select("id").eq("telegram_id", action_request.telegram_id).execute()
+        user_id = await resolve_user_id(action_request.telegram_id)
         
-        if not user.data:
+        if not user_id:
             raise HTTPException(status_code=404, detail="Пользователь не найден")
         
-        user_id = user.data[0]["id"]
         today = date.today()
         
-        # Проверяем, есть ли уже запись на сегодня
-        existing_action = supabase.table("daily_actions").select("*").eq("user_id", user_id).eq("action_date", today.isoformat()).execute()
+        # Один запрос: вставка по уникальному индексу (user_id, action_date),
+        # повторное нажатие возвращает уже существующую запись
+        try:
+            action, created = await repository.complete_daily_action(user_id, today)
+        except RepositoryError as e:
+            if not e.is_missing_function:
+                raise
+            # Функции complete_daily_action нет в базе: проверка и вставка двумя запросами
+            action = await repository.get_daily_action(user_id, today)
+            created = False
+            if not action:
+                action = await repository.create_daily_action(user_id, today)
+                created = True
+        
+        if not action:
+            raise HTTPException(status_code=500, detail="Ошибка при создании записи о действии")
         
-        if existing_action.data:
-            return {"message": "Действие уже отмечено на сегодня", "action": existing_action.data[0]}
+        if not created:
+            return {"message": "Действие уже отмечено на сегодня", "action": action}
         
-        # Создаем новую запись
-        new_action = supabase.table("daily_actions").insert({
-            "user_id": user_id,
-            "action_date": today.isoformat()
-        }).execute()
+        await response_cache.invalidate(user_id)
         
-        if new_action.data:
-            # Проверяем AI-триггеры в фоновом режиме
-            background_tasks.add_task(check_ai_triggers, action_request.telegram_id, "action_completed")
-            
-            return {"message": "Действие успешно отмечено", "action": new_action.data[0]}
-        else:
-            raise HTTPException(status_code=500, detail="Ошибка при создании записи о действии")
+        # Проверяем AI-триггеры в фоновом режиме
+        background_tasks.add_task(check_ai_triggers, action_request.telegram_id, "action_completed")
+        
+        return {"message": "Действие успешно отмечено", "action": action}
             
     except HTTPException:
         raise
@@ -750,82 +1410,172 @@ async def complete_action(action_request: ActionCompleteRequest, background_task
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
 
 @app.get("/users/{telegram_id}/data", response_model=UserData)
-async def get_user_data(telegram_id: int):
-    """Получение всех данных пользователя"""
+async def get_user_data(
+    telegram_id: int,
+    request: Request,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cards_cursor: Optional[str] = None,
+    actions_cursor: Optional[str] = None
+):
+    """
+    Получение всех данных пользователя
+    
+    Без limit возвращаются все карты и действия. С limit карты и действия отдаются
+    страницами, курсоры следующих страниц приходят в next_cursors.
+    Поддерживает If-None-Match: если данные не изменились, возвращается 304.
+    Ответ отдается через response_cache (см. serve_user_response): при медленной
+    или недоступной базе может прийти устаревший ответ с заголовком X-Data-Stale.
+    """
     try:
-        # Находим пользователя
-        user = supabase.table("users").select("*").eq("telegram_id", telegram_id).execute()
-        
-        if not user.data:
-            raise HTTPException(status_code=404, detail="Пользователь не найден")
-        
-        user_data = user.data[0]
-        user_id = user_data["id"]
-        
-        # Получаем цели пользователя
-        goals = supabase.table("goals").select("*").eq("user_id", user_id).execute()
+        cards_after = decode_cards_cursor(cards_cursor)
+        actions_before = decode_actions_cursor(actions_cursor)
         
-        # Получаем ежедневные действия пользователя
-        daily_actions = supabase.table("daily_actions").select("*").eq("user_id", user_id).order("action_date", desc=True).execute()
-        
-        # Получаем карты пользователя
-        cards = supabase.table("cards").select("*").eq("user_id", user_id).order("created_at", desc=True).execute()
+        async def load() -> Tuple[bytes, Dict[str, str]]:
+            read_started = response_cache.start_read()
+            
+            # Получаем пользователя, цели, действия и карты одним запросом
+            # (на одну строку больше страницы, чтобы узнать, есть ли продолжение)
+            snapshot = await fetch_user_snapshot(
+                telegram_id,
+                limit=limit + 1 if limit else None,
+                cards_after=cards_after,
+                actions_before=actions_before
+            )
+            
+            if not snapshot:
+                raise HTTPException(status_code=404, detail="Пользователь не найден")
+            
+            user_data = snapshot['user']
+            goals = snapshot['goals']
+            
+            # Версия из снимка согласована с его данными
+            version = (snapshot.get('counters') or {}).get('data_version')
+            etag = make_etag(user_data['id'], version, request) if version is not None else None
+            
+            daily_actions, next_actions_cursor = split_page(snapshot['daily_actions'], limit, action_cursor_key)
+            cards, next_cards_cursor = split_page(snapshot['cards'], limit, card_cursor_key)
+            
+            next_cursors = {}
+            if next_cards_cursor:
+                next_cursors['cards'] = next_cards_cursor
+            if next_actions_cursor:
+                next_cursors['daily_actions'] = next_actions_cursor
+            
+            # Формируем ответ
+            user_obj = build_user(user_data)
+            
+            goals_list = [build_goal(goal) for goal in goals]
+            actions_list = [build_daily_action(action) for action in daily_actions]
+            cards_list = [build_card(card) for card in cards]
+            
+            payload = UserData(
+                user=user_obj,
+                goals=goals_list,
+                daily_actions=actions_list,
+                cards=cards_list,
+                degraded=snapshot.get('degraded', False),
+                degraded_parts=snapshot.get('degraded_parts', []),
+                next_cursors=next_cursors,
+                counters=snapshot.get('counters')
+            )
+            body = payload.model_dump_json().encode()
+            headers = data_headers(etag)
+            
+            # Неполный снимок не кэшируется, чтобы следующий запрос попробовал загрузить все данные
+            if not payload.degraded:
+                await response_cache.set(user_data['id'], response_variant(request), body, headers,
+                                         read_started=read_started, alias=telegram_id)
+            return body, headers
         
-        # Формируем ответ
-        user_obj = User(
-            id=user_data["id"],
-            telegram_id=user_data["telegram_id"],
-            username=user_data["username"],
-            first_name=user_data.get("first_name"),
-            last_name=user_data.get("last_name"),
-            photo_url=user_data.get("photo_url"),
-            created_at=datetime.fromisoformat(user_data["created_at"].replace('Z', '+00:00')),
-            updated_at=datetime.fromisoformat(user_data["updated_at"].replace('Z', '+00:00'))
-        )
+        # Id пользователя берется из кэшей, без запроса к базе
+        user_id = await response_cache.owner_of(telegram_id) or await identity_cache.get(telegram_id)
+        return await serve_user_response(telegram_id, user_id, request, load)
         
-        goals_list = []
-        for goal in goals.data:
-            goals_list.append(Goal(
-                id=goal["id"],
-                user_id=goal["user_id"],
-                goal_type=goal["goal_type"],
-                description=goal["description"],
-                is_completed=goal["is_completed"],
-                created_at=datetime.fromisoformat(goal["created_at"].replace('Z', '+00:00')),
-                updated_at=datetime.fromisoformat(goal["updated_at"].replace('Z', '+00:00'))
-            ))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
+
+# Эндпоинты для работы с картами
+# Перекрытие окон синхронизации: строки транзакций, зафиксированных с опозданием, придут повторно
+SYNC_OVERLAP_SECONDS = float(os.getenv("SYNC_OVERLAP_SECONDS", "5"))
+
+def parse_since(since: str) -> datetime:
+    """Разбирает метку since (ISO 8601); метка без часового пояса считается UTC"""
+    try:
+        # "+" в неэкранированной строке запроса превращается в пробел
+        value = datetime.fromisoformat(since.strip().replace(' ', '+').replace('Z', '+00:00'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Некорректная метка since")
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+async def fetch_user_changes_concurrently(telegram_id: int, since: datetime) -> Optional[Dict[str, Any]]:
+    """Изменения без функции get_user_changes: параллельные запросы к таблицам"""
+    # Метка берется до запросов, чтобы следующий запрос не пропустил строки, записанные во время этого
+    watermark = datetime.now(timezone.utc) - timedelta(seconds=SYNC_OVERLAP_SECONDS)
+    
+    user = await repository.get_user_by_telegram_id(telegram_id)
+    if not user:
+        await identity_cache.invalidate(telegram_id)
+        return None
+    await identity_cache.set(telegram_id, user["id"])
+    
+    goals, cards, archived, daily_actions, counters = await asyncio.gather(
+        repository.list_changed_rows("goals", user["id"], since, 'goal'),
+        repository.list_changed_rows("cards", user["id"], since, 'card'),
+        repository.list_archived_since(user["id"], since),
+        repository.list_changed_rows("daily_actions", user["id"], since, 'daily_action', column="created_at"),
+        repository.get_user_counters(user["id"])
+    )
+    
+    return {
+        'watermark': watermark.isoformat(),
+        'user': user if parse_since(user["updated_at"]) > since else None,
+        'goals': goals,
+        'cards': [card for card in cards if card["status"] != "deleted"],
+        'deleted_cards': [
+            {"id": card["id"], "updated_at": card["updated_at"]}
+            for card in cards if card["status"] == "deleted"
+        ] + [
+            # Для клиента карта в архиве удалена; метка tombstone - время переноса
+            {"id": card["id"], "updated_at": card["archived_at"]}
+            for card in archived
+        ],
+        'daily_actions': daily_actions,
+        'counters': counters
+    }
+
+@app.get("/users/{telegram_id}/changes", response_model=UserChanges)
+async def get_user_changes(telegram_id: int, since: str):
+    """
+    Изменения данных пользователя после метки since
+    
+    Возвращает цели, карты и действия, измененные после since, а мягко удаленные
+    и перенесенные в архив карты - в виде tombstone. Размер ответа зависит от объема изменений, а не от истории.
+    Ответ содержит watermark для следующего запроса; строки на границе окна
+    могут прийти повторно, их нужно применять по id.
+    """
+    try:
+        since_value = parse_since(since)
         
-        actions_list = []
-        for action in daily_actions.data:
-            actions_list.append(DailyAction(
-                id=action["id"],
-                user_id=action["user_id"],
-                action_date=datetime.fromisoformat(action["action_date"]).date(),
-                created_at=datetime.fromisoformat(action["created_at"].replace('Z', '+00:00'))
-            ))
+        try:
+            changes = await repository.get_user_changes(telegram_id, since_value, SYNC_OVERLAP_SECONDS)
+        except RepositoryError as e:
+            if not e.is_missing_function:
+                raise
+            changes = await fetch_user_changes_concurrently(telegram_id, since_value)
         
-        cards_list = []
-        for card in cards.data:
-            cards_list.append(Card(
-                id=card["id"],
-                user_id=card["user_id"],
-                title=card["title"],
-                description=card["description"],
-                card_type=card["card_type"],
-                status=card["status"],
-                priority=card["priority"],
-                due_date=datetime.fromisoformat(card["due_date"]).date() if card["due_date"] else None,
-                tags=card["tags"] or [],
-                metadata=card["metadata"] or {},
-                created_at=datetime.fromisoformat(card["created_at"].replace('Z', '+00:00')),
-                updated_at=datetime.fromisoformat(card["updated_at"].replace('Z', '+00:00'))
-            ))
+        if not changes:
+            raise HTTPException(status_code=404, detail="Пользователь не найден")
         
-        return UserData(
-            user=user_obj,
-            goals=goals_list,
-            daily_actions=actions_list,
-            cards=cards_list
+        return UserChanges(
+            user=build_user(changes['user']) if changes['user'] else None,
+            goals=[build_goal(goal) for goal in changes['goals']],
+            cards=[build_card(card) for card in changes['cards']],
+            deleted_cards=[CardTombstone(**tombstone) for tombstone in changes['deleted_cards']],
+            daily_actions=[build_daily_action(action) for action in changes['daily_actions']],
+            counters=changes.get('counters'),
+            watermark=changes['watermark']
         )
         
     except HTTPException:
@@ -833,19 +1583,16 @@ async def get_user_data(telegram_id: int):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
 
-# Эндпоинты для работы с картами
 @app.post("/cards")
 async def create_cards(cards_request: CardsRequest, background_tasks: BackgroundTasks):
     """Создание карт для пользователя"""
     try:
         # Находим пользователя
-        user = supabase.table("users").select("id").eq("telegram_id", cards_request.telegram_id).execute()
+        user_id = await resolve_user_id(cards_request.telegram_id)
         
-        if not user.data:
+        if not user_id:
             raise HTTPException(status_code=404, detail="Пользователь не найден")
         
-        user_id = user.data[0]["id"]
-        
         # Подготавливаем данные для вставки
         cards_to_insert = []
         for card in cards_request.cards:
@@ -861,10 +1608,11 @@ async def create_cards(cards_request: CardsRequest, background_tasks: Background
             })
         
         # Вставляем карты
-        result = supabase.table("cards").insert(cards_to_insert).execute()
+        result = await repository.create_cards(cards_to_insert)
+        await response_cache.invalidate(user_id)
         
-        if result.data:
-            return {"message": f"Создано {len(result.data)} карт", "cards": result.data}
+        if result:
+            return {"message": f"Создано {len(result)} карт", "cards": result}
         else:
             raise HTTPException(status_code=500, detail="Ошибка при создании карт")
             
@@ -874,47 +1622,207 @@ async def create_cards(cards_request: CardsRequest, background_tasks: Background
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
 
 @app.get("/cards/{telegram_id}", response_model=List[Card])
-async def get_user_cards(telegram_id: int, card_type: Optional[str] = None, status: Optional[str] = None):
-    """Получение карт пользователя"""
+async def get_user_cards(
+    telegram_id: int,
+    request: Request,
+    card_type: Optional[str] = None,
+    status: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    """
+    Получение карт пользователя
+    
+    Мягко удаленные карты возвращаются только с status=deleted, перенесенные
+    в архив - через /cards/{telegram_id}/archive.
+    С limit карты отдаются страницами, курсор следующей страницы приходит
+    в заголовке X-Next-Cursor. Поддерживает If-None-Match: если данные
+    не изменились, возвращается 304. Как и /users/{telegram_id}/data, при
+    медленной или недоступной базе может вернуть устаревший ответ.
+    """
     try:
+        after = decode_cards_cursor(cursor)
+        
         # Находим пользователя
-        user = supabase.table("users").select("id").eq("telegram_id", telegram_id).execute()
+        user_id = await response_cache.owner_of(telegram_id) or await resolve_user_id(telegram_id)
         
-        if not user.data:
+        if not user_id:
             raise HTTPException(status_code=404, detail="Пользователь не найден")
         
-        user_id = user.data[0]["id"]
-        
-        # Строим запрос
-        query = supabase.table("cards").select("*").eq("user_id", user_id)
-        
-        if card_type:
-            query = query.eq("card_type", card_type)
-        if status:
-            query = query.eq("status", status)
-        
-        # Выполняем запрос
-        result = query.order("created_at", desc=True).execute()
-        
-        cards = []
-        for card in result.data:
-            cards.append(Card(
-                id=card["id"],
-                user_id=card["user_id"],
-                title=card["title"],
-                description=card["description"],
-                card_type=card["card_type"],
-                status=card["status"],
-                priority=card["priority"],
-                due_date=datetime.fromisoformat(card["due_date"]).date() if card["due_date"] else None,
-                tags=card["tags"] or [],
-                metadata=card["metadata"] or {},
-                created_at=datetime.fromisoformat(card["created_at"].replace('Z', '+00:00')),
-                updated_at=datetime.fromisoformat(card["updated_at"].replace('Z', '+00:00'))
-            ))
+        async def load() -> Tuple[bytes, Dict[str, str]]:
+            read_started = response_cache.start_read()
+            
+            # Версия читается до карт, поэтому ETag никогда не опережает данные
+            headers = data_headers(await current_etag(telegram_id, request))
+            
+            # Выполняем запрос с фильтрами
+            result = await repository.list_cards(
+                user_id,
+                card_type=card_type,
+                status=status,
+                limit=limit + 1 if limit else None,
+                after=after
+            )
+            result, next_cursor = split_page(result, limit, card_cursor_key)
+            if next_cursor:
+                headers["X-Next-Cursor"] = next_cursor
+            
+            body = card_list_adapter.dump_json([build_card(card) for card in result])
+            await response_cache.set(user_id, response_variant(request), body, headers,
+                                     read_started=read_started, alias=telegram_id)
+            return body, headers
+        
+        return await serve_user_response(telegram_id, user_id, request, load)
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
+
+# Размер страницы поиска по умолчанию и максимальная длина запроса
+SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_QUERY_LENGTH = 200
+
+async def search_cards_in_steps(user_id: str, query: str, limit: int,
+                                after: Optional[tuple]) -> List[Dict[str, Any]]:
+    """
+    Поиск без функции search_cards: все карты пользователя читаются одним запросом
+    и ранжируются в приложении (card_search_rank, без русской морфологии)
+    """
+    found = []
+    for card in await repository.list_cards(user_id):
+        rank = card_search_rank(card, query)
+        if rank is not None and (after is None or (rank, card["id"]) < after):
+            found.append({**card, "rank": rank})
+    found.sort(key=lambda card: (card["rank"], card["id"]), reverse=True)
+    return found[:limit]
+
+@app.get("/cards/{telegram_id}/search", response_model=List[CardSearchResult])
+async def search_user_cards(
+    telegram_id: int,
+    response: Response,
+    q: str = Query(..., min_length=1, max_length=MAX_SEARCH_QUERY_LENGTH),
+    limit: int = Query(SEARCH_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    """
+    Полнотекстовый поиск по заголовкам и описаниям карт пользователя
+    
+    Слова ищутся в любой форме и по началу слова; поддерживаются "точная фраза",
+    or и -исключение. Самые релевантные карты первыми, курсор следующей страницы
+    приходит в заголовке X-Next-Cursor. Удаленные карты не ищутся.
+    """
+    try:
+        if not q.strip():
+            raise HTTPException(status_code=400, detail="Пустой поисковый запрос")
+        after = decode_search_cursor(cursor)
+        
+        user_id = await resolve_user_id(telegram_id)
+        
+        if not user_id:
+            raise HTTPException(status_code=404, detail="Пользователь не найден")
+        
+        try:
+            cards = await repository.search_cards(user_id, q, limit=limit + 1, after=after)
+        except RepositoryError as e:
+            if not e.is_missing_function:
+                raise
+            cards = await search_cards_in_steps(user_id, q, limit + 1, after)
+        cards, next_cursor = split_page(cards, limit, search_cursor_key)
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        
+        return [build_card_search_result(card) for card in cards]
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
+
+def card_update_values(card_update: CardUpdate) -> Dict[str, Any]:
+    """Поля карты, переданные в запросе на обновление"""
+    update_data = {}
+    
+    if card_update.title is not None:
+        update_data["title"] = card_update.title
+    if card_update.description is not None:
+        update_data["description"] = card_update.description
+    if card_update.card_type is not None:
+        update_data["card_type"] = card_update.card_type
+    if card_update.status is not None:
+        update_data["status"] = card_update.status
+    if card_update.priority is not None:
+        update_data["priority"] = card_update.priority
+    if card_update.due_date is not None:
+        update_data["due_date"] = card_update.due_date.isoformat()
+    if card_update.tags is not None:
+        update_data["tags"] = card_update.tags
+    if card_update.metadata is not None:
+        update_data["metadata"] = card_update.metadata
+    
+    return update_data
+
+@app.patch("/cards/batch")
+async def update_cards_batch(batch_request: CardsBatchRequest):
+    """
+    Пакетное изменение карт пользователя (перестановка, выполнение шагов, архивирование карты пути)
+    
+    Все изменения применяются одной транзакцией. Для каждого элемента возвращается
+    результат в том же порядке: updated, deleted или not_found (карты нет или она чужая).
+    """
+    try:
+        if not batch_request.items:
+            raise HTTPException(status_code=400, detail="Нет данных для обновления")
+        if len(batch_request.items) > MAX_BATCH_SIZE:
+            raise HTTPException(status_code=400, detail=f"Не больше {MAX_BATCH_SIZE} карт за запрос")
+        
+        items = []
+        for item in batch_request.items:
+            try:
+                card_id = str(uuid.UUID(item.id))
+            except ValueError:
+                raise HTTPException(status_code=400, detail=f"Некорректный id карты: {item.id}")
+            values = {"status": "deleted"} if item.delete else card_update_values(item)
+            if not values:
+                raise HTTPException(status_code=400, detail=f"Нет данных для обновления карты {item.id}")
+            items.append({"id": card_id, "delete": item.delete, "values": values})
+        
+        if len({item["id"] for item in items}) != len(items):
+            raise HTTPException(status_code=400, detail="Карта указана в пакете несколько раз")
+        
+        user_id = await resolve_user_id(batch_request.telegram_id)
+        if not user_id:
+            raise HTTPException(status_code=404, detail="Пользователь не найден")
         
-        return cards
+        try:
+            results = await repository.update_cards_batch(user_id, items)
+        except RepositoryError as e:
+            if not e.is_missing_function:
+                raise
+            # Функции update_cards_batch нет в базе: параллельные обновления по одной карте
+            updated_at = datetime.now().isoformat()
+            cards = await asyncio.gather(*(
+                repository.update_card(item["id"], {**item["values"], "updated_at": updated_at}, user_id=user_id)
+                for item in items
+            ))
+            results = [
+                {
+                    "id": item["id"],
+                    "status": ("deleted" if item["delete"] else "updated") if card else "not_found",
+                    "card": card
+                }
+                for item, card in zip(items, cards)
+            ]
+        await response_cache.invalidate(user_id)
         
+        return {
+            "message": "Карты обновлены",
+            "updated": sum(1 for result in results if result["status"] == "updated"),
+            "deleted": sum(1 for result in results if result["status"] == "deleted"),
+            "not_found": sum(1 for result in results if result["status"] == "not_found"),
+            "results": results
+        }
+    
     except HTTPException:
         raise
     except Exception as e:
@@ -924,44 +1832,24 @@ async def get_user_cards(telegram_id: int, card_type: Optional[str] = None, stat
 async def update_card(card_id: str, card_update: CardUpdate):
     """Обновление карты"""
     try:
-        # Проверяем существование карты
-        existing_card = supabase.table("cards").select("*").eq("id", card_id).execute()
-        
-        if not existing_card.data:
-            raise HTTPException(status_code=404, detail="Карта не найдена")
+        card_id = parse_card_id(card_id)
         
         # Подготавливаем данные для обновления
-        update_data = {}
-        
-        if card_update.title is not None:
-            update_data["title"] = card_update.title
-        if card_update.description is not None:
-            update_data["description"] = card_update.description
-        if card_update.card_type is not None:
-            update_data["card_type"] = card_update.card_type
-        if card_update.status is not None:
-            update_data["status"] = card_update.status
-        if card_update.priority is not None:
-            update_data["priority"] = card_update.priority
-        if card_update.due_date is not None:
-            update_data["due_date"] = card_update.due_date.isoformat()
-        if card_update.tags is not None:
-            update_data["tags"] = card_update.tags
-        if card_update.metadata is not None:
-            update_data["metadata"] = card_update.metadata
+        update_data = card_update_values(card_update)
         
         if not update_data:
             raise HTTPException(status_code=400, detail="Нет данных для обновления")
         
         update_data["updated_at"] = datetime.now().isoformat()
         
-        # Обновляем карту
-        result = supabase.table("cards").update(update_data).eq("id", card_id).execute()
+        # Обновляем карту одним запросом: пустой результат значит, что карты нет
+        result = await repository.update_card(card_id, update_data)
         
-        if result.data:
-            return {"message": "Карта обновлена", "card": result.data[0]}
-        else:
-            raise HTTPException(status_code=500, detail="Ошибка при обновлении карты")
+        if not result:
+            raise HTTPException(status_code=404, detail="Карта не найдена")
+        
+        await response_cache.invalidate(result["user_id"])
+        return {"message": "Карта обновлена", "card": result}
             
     except HTTPException:
         raise
@@ -972,22 +1860,90 @@ async def update_card(card_id: str, card_update: CardUpdate):
 async def delete_card(card_id: str):
     """Удаление карты (мягкое удаление - изменение статуса)"""
     try:
-        # Проверяем существование карты
-        existing_card = supabase.table("cards").select("*").eq("id", card_id).execute()
-        
-        if not existing_card.data:
-            raise HTTPException(status_code=404, detail="Карта не найдена")
+        card_id = parse_card_id(card_id)
         
-        # Мягкое удаление - меняем статус на deleted
-        result = supabase.table("cards").update({
+        # Мягкое удаление - меняем статус на deleted одним запросом;
+        # пустой результат значит, что карты нет
+        result = await repository.update_card(card_id, {
             "status": "deleted",
             "updated_at": datetime.now().isoformat()
-        }).eq("id", card_id).execute()
+        }, projection='card_owner')
         
-        if result.data:
-            return {"message": "Карта удалена"}
-        else:
-            raise HTTPException(status_code=500, detail="Ошибка при удалении карты")
+        if not result:
+            raise HTTPException(status_code=404, detail="Карта не найдена")
+        
+        await response_cache.invalidate(result["user_id"])
+        return {"message": "Карта удалена"}
+            
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
+
+@app.get("/cards/{telegram_id}/archive", response_model=List[ArchivedCard])
+async def get_archived_cards(
+    telegram_id: int,
+    response: Response,
+    limit: Optional[int] = Query(None, ge=1, le=MAX_PAGE_SIZE),
+    cursor: Optional[str] = None
+):
+    """
+    Карты пользователя, перенесенные в архив фоновой задачей (scripts/archive_cards.py)
+
+    Последние перенесенные первыми; с limit курсор следующей страницы приходит
+    в заголовке X-Next-Cursor.
+    """
+    try:
+        after = decode_cards_cursor(cursor)
+        
+        user_id = await resolve_user_id(telegram_id)
+        
+        if not user_id:
+            raise HTTPException(status_code=404, detail="Пользователь не найден")
+        
+        cards = await repository.list_archived_cards(user_id, limit=limit + 1 if limit else None, after=after)
+        cards, next_cursor = split_page(cards, limit, archived_card_cursor_key)
+        if next_cursor:
+            response.headers["X-Next-Cursor"] = next_cursor
+        
+        return [build_archived_card(card) for card in cards]
+        
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
+
+@app.post("/cards/{card_id}/restore")
+async def restore_card(card_id: str, restore_request: CardRestoreRequest):
+    """
+    Восстановление карты: из архива или из мягко удаленных, карта снова становится активной
+    
+    Повторный запрос возвращает уже восстановленную карту.
+    """
+    try:
+        card_id = parse_card_id(card_id)
+        
+        user_id = await resolve_user_id(restore_request.telegram_id)
+        
+        if not user_id:
+            raise HTTPException(status_code=404, detail="Пользователь не найден")
+        
+        try:
+            result = await repository.restore_card(user_id, card_id)
+        except RepositoryError as e:
+            if not e.is_missing_function:
+                raise
+            # Без функции restore_card архива нет - возвращаем карту из удаленных
+            result = await repository.update_card(card_id, {
+                "status": "active",
+                "updated_at": datetime.now().isoformat()
+            }, user_id=user_id)
+        
+        if not result:
+            raise HTTPException(status_code=404, detail="Карта не найдена")
+        
+        await response_cache.invalidate(user_id)
+        return {"message": "Карта восстановлена", "card": result}
             
     except HTTPException:
         raise
@@ -999,44 +1955,41 @@ async def get_cards_stats(telegram_id: int):
     """Получение статистики карт пользователя"""
     try:
         # Находим пользователя
-        user = supabase.table("users").select("id").eq("telegram_id", telegram_id).execute()
+        user_id = await resolve_user_id(telegram_id)
         
-        if not user.data:
+        if not user_id:
             raise HTTPException(status_code=404, detail="Пользователь не найден")
         
-        user_id = user.data[0]["id"]
-        
-        # Получаем все карты пользователя
-        cards = supabase.table("cards").select("*").eq("user_id", user_id).execute()
-        
-        if not cards.data:
+        # Счетчики поддерживаются триггерами - чтение одной строки
+        counters = await repository.get_user_counters(user_id)
+        if counters is not None:
             return {
-                "total_cards": 0,
-                "by_type": {},
-                "by_status": {},
-                "by_priority": {}
+                "total_cards": counters["cards_total"],
+                "by_type": counters["cards_by_type"],
+                "by_status": counters["cards_by_status"],
+                "by_priority": counters["cards_by_priority"]
             }
         
-        # Подсчитываем статистику
         stats = {
-            "total_cards": len(cards.data),
+            "total_cards": 0,
             "by_type": {},
             "by_status": {},
             "by_priority": {}
         }
         
-        for card in cards.data:
-            # По типам
-            card_type = card["card_type"]
-            stats["by_type"][card_type] = stats["by_type"].get(card_type, 0) + 1
-            
-            # По статусам
-            status = card["status"]
-            stats["by_status"][status] = stats["by_status"].get(status, 0) + 1
-            
-            # По приоритетам
-            priority = card["priority"]
-            stats["by_priority"][str(priority)] = stats["by_priority"].get(str(priority), 0) + 1
+        # Группировка выполняется в Postgres: ответ не зависит от количества карт
+        try:
+            rows = await repository.get_card_stats(user_id)
+        except RepositoryError as e:
+            if not e.is_missing_function:
+                raise
+            return await count_cards_stats(user_id)
+        
+        for row in rows:
+            if row["dimension"] == "total":
+                stats["total_cards"] = row["card_count"]
+            else:
+                stats[row["dimension"]][row["key"]] = row["card_count"]
         
         return stats
         
@@ -1045,6 +1998,42 @@ async def get_cards_stats(telegram_id: int):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Ошибка сервера: {str(e)}")
 
+async def count_cards_stats(user_id: str) -> Dict[str, Any]:
+    """Запасной путь без get_card_stats: статистика считается по строкам карт"""
+    # Получаем только колонки, по которым считается статистика
+    cards = await repository.list_cards(user_id, projection='card_stats')
+    
+    stats = {
+        "total_cards": len(cards),
+        "by_type": {},
+        "by_status": {},
+        "by_priority": {}
+    }
+    
+    for card in cards:
+        # По типам
+        card_type = card["card_type"]
+        stats["by_type"][card_type] = stats["by_type"].get(card_type, 0) + 1
+        
+        # По статусам
+        status = card["status"]
+        stats["by_status"][status] = stats["by_status"].get(status, 0) + 1
+        
+        # По приоритетам
+        priority = card["priority"]
+        stats["by_priority"][str(priority)] = stats["by_priority"].get(str(priority), 0) + 1
+    
+    return stats
+
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """Получить статистику кэшей и обращений к базе данных"""
+    return {
+        "identity": identity_cache.get_stats(),
+        "responses": response_cache.get_stats(),
+        "repository": repository.stats.copy()
+    }
+
 # AI-эндпоинты
 @app.post("/ai/motivation", response_model=AIMotivationResponse)
 async def get_ai_motivation(request: AIMotivationRequest):
@@ -1092,7 +2081,7 @@ async def get_ai_stats():
         if not agent:
             raise HTTPException(status_code=503, detail="AI-агент недоступен")
         
-        stats = agent.get_stats()
+        stats = await agent.get_stats()
         total_requests = (stats['groq_success'] + stats['groq_failures'] + 
                          stats['huggingface_success'] + stats['huggingface_failures'] + 
                          stats['cohere_success'] + stats['cohere_failures'] + 
@@ -1120,7 +2109,7 @@ async def reset_ai_stats():
         if not agent:
             raise HTTPException(status_code=503, detail="AI-агент недоступен")
         
-        agent.reset_stats()
+        await agent.reset_stats()
         return {"message": "Статистика AI сброшена"}
         
     except Exception as e:
@@ -1381,7 +2370,8 @@ async def analyze_user_progress(request: ProgressAnalysisRequest):
             "days_since_start": result.get("days_since_start", 0),
             "total_actions": result.get("total_actions", 0),
             "avg_actions_per_week": result.get("avg_actions_per_week", 0),
-            "goal_completion_rate": result.get("goal_completion_rate", 0)
+            "goal_completion_rate": result.get("goal_completion_rate", 0),
+            "degraded": user_data_dict.get("degraded", False)
         }
         
     except HTTPException:
@@ -1433,7 +2423,7 @@ async def get_manager_stats():
         if not manager:
             raise HTTPException(status_code=503, detail="Личный менеджер недоступен")
         
-        stats = manager.get_stats()
+        stats = await manager.get_stats()
         
         # Проверяем доступность API ключей
         api_status = {
@@ -0,0 +1,930 @@
+"""
+Репозиторий в памяти процесса
+Повторяет схему config/database_schema.sql без базы данных: уникальные индексы,
+внешние ключи с каскадным удалением, триггеры (updated_at, user_counters,
+data_version, серии дней) и функции API. Нужен для запуска без Supabase,
+тестов и бенчмарков; задержка сети задается параметрами
+"""
+
+import asyncio
+import copy
+import random
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from repository import Repository, RepositoryError, card_search_rank, split_filter, split_logical_filter
+
+# Колонки таблиц в порядке схемы и их типы
+SCHEMA = {
+    'users': {
+        'id': 'uuid', 'telegram_id': 'bigint', 'username': 'text', 'first_name': 'text',
+        'last_name': 'text', 'photo_url': 'text', 'current_streak': 'integer',
+        'longest_streak': 'integer', 'last_action_date': 'date',
+        'created_at': 'timestamptz', 'updated_at': 'timestamptz',
+    },
+    'goals': {
+        'id': 'uuid', 'user_id': 'uuid', 'goal_type': 'text', 'description': 'text',
+        'is_completed': 'boolean', 'created_at': 'timestamptz', 'updated_at': 'timestamptz',
+    },
+    'daily_actions': {
+        'id': 'uuid', 'user_id': 'uuid', 'action_date': 'date', 'created_at': 'timestamptz',
+    },
+    'cards': {
+        'id': 'uuid', 'user_id': 'uuid', 'title': 'text', 'description': 'text', 'card_type': 'text',
+        'status': 'text', 'priority': 'integer', 'due_date': 'date', 'tags': 'text[]',
+        'metadata': 'jsonb', 'created_at': 'timestamptz', 'updated_at': 'timestamptz',
+    },
+    'cards_archive': {
+        'id': 'uuid', 'user_id': 'uuid', 'title': 'text', 'description': 'text', 'card_type': 'text',
+        'status': 'text', 'priority': 'integer', 'due_date': 'date', 'tags': 'text[]',
+        'metadata': 'jsonb', 'created_at': 'timestamptz', 'updated_at': 'timestamptz',
+        'archived_at': 'timestamptz',
+    },
+    'user_counters': {
+        'user_id': 'uuid', 'goals_total': 'integer', 'goals_completed': 'integer',
+        'actions_total': 'integer', 'cards_total': 'integer', 'cards_by_type': 'jsonb',
+        'cards_by_status': 'jsonb', 'cards_by_priority': 'jsonb', 'data_version': 'bigint',
+        'updated_at': 'timestamptz',
+    },
+}
+
+PRIMARY_KEYS = {
+    'users': 'id', 'goals': 'id', 'daily_actions': 'id', 'cards': 'id', 'cards_archive': 'id',
+    'user_counters': 'user_id',
+}
+
+# Значения DEFAULT (id, created_at, updated_at и archived_at заполняются отдельно)
+DEFAULTS = {
+    'users': {'current_streak': 0, 'longest_streak': 0},
+    'goals': {'is_completed': False},
+    'daily_actions': {},
+    'cards': {'status': 'active', 'priority': 1},
+    'cards_archive': {},
+    'user_counters': {
+        'goals_total': 0, 'goals_completed': 0, 'actions_total': 0, 'cards_total': 0,
+        'cards_by_type': {}, 'cards_by_status': {}, 'cards_by_priority': {}, 'data_version': 0,
+    },
+}
+
+NOT_NULL = {
+    'users': ('telegram_id', 'current_streak', 'longest_streak'),
+    'goals': ('user_id', 'goal_type'),
+    'daily_actions': ('user_id', 'action_date'),
+    'cards': ('user_id', 'title', 'card_type'),
+    'cards_archive': ('user_id', 'title', 'card_type', 'archived_at'),
+    'user_counters': ('goals_total', 'goals_completed', 'actions_total', 'cards_total',
+                      'cards_by_type', 'cards_by_status', 'cards_by_priority', 'data_version'),
+}
+
+# Уникальные индексы кроме первичного ключа
+UNIQUE = {
+    'users': [('telegram_id',)],
+    'daily_actions': [('user_id', 'action_date')],
+}
+
+# Таблицы со ссылкой user_id -> users(id) ON DELETE CASCADE
+USER_TABLES = ('goals', 'daily_actions', 'cards', 'cards_archive', 'user_counters')
+
+# Таблицы с триггерами счетчиков и версии данных (архив карт их не меняет)
+COUNTED_TABLES = ('goals', 'daily_actions', 'cards')
+
+# Колонки, которые меняет пакетное изменение (update_cards_batch, update_goals_batch)
+CARD_BATCH_COLUMNS = ('title', 'description', 'card_type', 'status', 'priority', 'due_date', 'tags', 'metadata')
+GOAL_BATCH_COLUMNS = ('goal_type', 'description', 'is_completed')
+
+INTERVAL_UNITS = {'second': 1, 'minute': 60, 'hour': 3600, 'day': 86400}
+
+
+class MemoryRepository(Repository):
+    """
+    Асинхронный репозиторий, хранящий таблицы в памяти процесса
+
+    Принимает те же фильтры в синтаксисе PostgREST и возвращает те же JSON-представления
+    строк, что SupabaseRepository, а ошибки - с теми же кодами (23505 для нарушения
+    уникальности, 23503 для внешнего ключа, PGRST202 для неизвестной функции).
+    Каждый примитив - один "запрос": ждет latency (плюс случайную добавку до jitter)
+    и выполняется атомарно, при ошибке изменения откатываются.
+
+    Данные живут только в этом процессе: при нескольких воркерах у каждого своя база.
+    """
+
+    def __init__(self, latency: float = 0.0, jitter: float = 0.0):
+        """
+        Args:
+            latency: Задержка каждого запроса в секундах (моделирует сеть до базы)
+            jitter: Максимальная случайная добавка к задержке в секундах
+        """
+        super().__init__()
+        self.latency = latency
+        self.jitter = jitter
+
+        self._tables: Dict[str, Dict[Any, Dict[str, Any]]] = {table: {} for table in SCHEMA}
+        # Уникальные индексы: (таблица, колонки) -> {значения: первичный ключ}
+        self._unique: Dict[Tuple[str, Tuple[str, ...]], Dict[tuple, Any]] = {
+            (table, columns): {} for table, indexes in UNIQUE.items() for columns in indexes
+        }
+        # Строки пользователя по таблицам: таблица -> {user_id: {первичный ключ: строка}}
+        self._by_user: Dict[str, Dict[str, Dict[Any, Dict[str, Any]]]] = {
+            table: {} for table in ('goals', 'daily_actions', 'cards', 'cards_archive')
+        }
+
+        # Журнал текущего запроса для отката: (таблица, первичный ключ, прежняя строка)
+        self._journal: List[Tuple[str, Any, Optional[Dict[str, Any]]]] = []
+        # Время текущего запроса (NOW() в Postgres)
+        self._now = datetime.now(timezone.utc)
+
+    async def _execute(self, operation: Callable, *args) -> Any:
+        """
+        Выполняет операцию как один запрос к базе: задержка, затем атомарное выполнение
+
+        Raises:
+            RepositoryError: При нарушении ограничений схемы; изменения запроса откатываются
+        """
+        self.stats['requests'] += 1
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+        self._now = datetime.now(timezone.utc)
+        self._journal = []
+        try:
+            return operation(*args)
+        except Exception as e:
+            for table, key, previous in reversed(self._journal):
+                self._store(table, key, previous, journal=False)
+            if isinstance(e, RepositoryError):
+                self.stats['errors'] += 1
+            raise
+        finally:
+            self._journal = []
+
+    # ========== Типы ==========
+
+    def _schema(self, table: str) -> Dict[str, str]:
+        """Колонки таблицы; неизвестная таблица - ошибка, как в PostgREST"""
+        if table not in SCHEMA:
+            raise RepositoryError(f"Таблица {table} не найдена в базе", status_code=404, code="PGRST205")
+        return SCHEMA[table]
+
+    def _column_names(self, table: str, columns: str) -> List[str]:
+        """Список колонок PostgREST "id,user_id" с проверкой по схеме"""
+        schema = self._schema(table)
+        names = [column.strip() for column in columns.split(",")]
+        for name in names:
+            if name not in schema:
+                raise RepositoryError(f"Колонка {table}.{name} не существует", status_code=400, code="42703")
+        return names
+
+    @staticmethod
+    def _invalid(column_type: str, value: Any) -> RepositoryError:
+        return RepositoryError(
+            f'Некорректное значение для типа {column_type}: "{value}"',
+            status_code=400,
+            code="22P02"
+        )
+
+    def _coerce(self, column_type: str, value: Any) -> Any:
+        """Приводит значение из JSON или фильтра к типу колонки, как это делает Postgres"""
+        if value is None:
+            return None
+        try:
+            if column_type == 'uuid':
+                return str(uuid.UUID(str(value)))
+            if column_type in ('bigint', 'integer'):
+                if isinstance(value, bool) or (isinstance(value, float) and not value.is_integer()):
+                    raise ValueError(value)
+                return int(value)
+            if column_type == 'real':
+                if isinstance(value, bool):
+                    raise ValueError(value)
+                return float(value)
+            if column_type == 'boolean':
+                if isinstance(value, bool):
+                    return value
+                if str(value).lower() in ('true', 't'):
+                    return True
+                if str(value).lower() in ('false', 'f'):
+                    return False
+                raise ValueError(value)
+            if column_type == 'date':
+                if isinstance(value, datetime):
+                    return value.date()
+                if isinstance(value, date):
+                    return value
+                return date.fromisoformat(str(value)[:10])
+            if column_type == 'timestamptz':
+                if not isinstance(value, datetime):
+                    value = datetime.fromisoformat(str(value))
+                # Время без пояса Postgres считает временем пояса сессии (UTC)
+                if value.tzinfo is None:
+                    value = value.replace(tzinfo=timezone.utc)
+                return value.astimezone(timezone.utc)
+            if column_type == 'text[]':
+                if not isinstance(value, list):
+                    raise ValueError(value)
+                return [str(item) if item is not None else None for item in value]
+            if column_type == 'jsonb':
+                return copy.deepcopy(value)
+            return str(value)
+        except (TypeError, ValueError):
+            raise self._invalid(column_type, value) from None
+
+    @staticmethod
+    def _to_json(value: Any) -> Any:
+        """Значение колонки в том виде, в каком его возвращает PostgREST"""
+        if isinstance(value, (date, datetime)):
+            return value.isoformat()
+        if isinstance(value, (list, dict)):
+            return copy.deepcopy(value)
+        return value
+
+    def _json_row(self, table: str, row: Dict[str, Any], names: Optional[List[str]] = None) -> Dict[str, Any]:
+        """Строка как JSON-объект (все колонки - как to_jsonb в функциях схемы)"""
+        return {name: self._to_json(row[name]) for name in (names or SCHEMA[table])}
+
+    # ========== Хранение и индексы ==========
+
+    def _store(self, table: str, key: Any, row: Optional[Dict[str, Any]], journal: bool = True):
+        """Записывает строку (или удаляет при row=None), поддерживая индексы и журнал отката"""
+        rows = self._tables[table]
+        previous = rows.get(key)
+        if journal:
+            self._journal.append((table, key, previous))
+
+        if previous is not None:
+            for columns in UNIQUE.get(table, ()):
+                self._unique[(table, columns)].pop(tuple(previous[column] for column in columns), None)
+            if table in self._by_user:
+                owned = self._by_user[table].get(previous['user_id'], {})
+                owned.pop(key, None)
+                if not owned:
+                    self._by_user[table].pop(previous['user_id'], None)
+
+        if row is None:
+            rows.pop(key, None)
+            return
+        rows[key] = row
+        for columns in UNIQUE.get(table, ()):
+            self._unique[(table, columns)][tuple(row[column] for column in columns)] = key
+        if table in self._by_user:
+            self._by_user[table].setdefault(row['user_id'], {})[key] = row
+
+    def _check_constraints(self, table: str, row: Dict[str, Any], creating: bool):
+        """NOT NULL, первичный ключ, уникальные индексы и внешний ключ на users"""
+        key = row[PRIMARY_KEYS[table]]
+        for column in (PRIMARY_KEYS[table],) + NOT_NULL.get(table, ()):
+            if row[column] is None:
+                raise RepositoryError(
+                    f'Значение NULL в колонке "{column}" таблицы "{table}" нарушает ограничение NOT NULL',
+                    status_code=400,
+                    code="23502"
+                )
+
+        conflicts = [(PRIMARY_KEYS[table],)] if creating and key in self._tables[table] else []
+        for columns in UNIQUE.get(table, ()):
+            values = tuple(row[column] for column in columns)
+            owner = self._unique[(table, columns)].get(values)
+            if None not in values and owner is not None and owner != key:
+                conflicts.append(columns)
+        if conflicts:
+            raise RepositoryError(
+                f'Повторяющееся значение ключа ({", ".join(conflicts[0])}) в таблице "{table}"',
+                status_code=409,
+                code="23505"
+            )
+
+        if table in USER_TABLES and row['user_id'] not in self._tables['users']:
+            raise RepositoryError(
+                f'Запись в таблицу "{table}" нарушает внешний ключ: пользователь {row["user_id"]} не найден',
+                status_code=409,
+                code="23503"
+            )
+
+    def _insert_row(self, table: str, values: Dict[str, Any]) -> Dict[str, Any]:
+        """INSERT одной строки с DEFAULT, проверками и триггерами"""
+        schema = SCHEMA[table]
+        row = {column: None for column in schema}
+        row.update(copy.deepcopy(DEFAULTS[table]))
+        if 'id' in schema:
+            row['id'] = str(uuid.uuid4())
+        for column in ('created_at', 'updated_at', 'archived_at'):
+            if column in schema:
+                row[column] = self._now
+        for column, value in values.items():
+            row[column] = self._coerce(schema[column], value)
+
+        self._check_constraints(table, row, creating=True)
+        self._store(table, row[PRIMARY_KEYS[table]], row)
+        self._after_write(table, None, row)
+        return row
+
+    def _update_row(self, table: str, previous: Dict[str, Any], values: Dict[str, Any]) -> Dict[str, Any]:
+        """UPDATE одной строки с проверками и триггерами"""
+        schema = SCHEMA[table]
+        row = dict(previous)
+        for column, value in values.items():
+            row[column] = self._coerce(schema[column], value)
+        # trg_*_set_updated_at: метку ставит база, а не приложение
+        if table in ('users', 'goals', 'cards'):
+            row['updated_at'] = self._now
+
+        key = previous[PRIMARY_KEYS[table]]
+        if row[PRIMARY_KEYS[table]] != key:
+            raise RepositoryError(f"Изменение первичного ключа {table} не поддерживается", status_code=400)
+        self._check_constraints(table, row, creating=False)
+        self._store(table, key, row)
+        self._after_write(table, previous, row)
+        return row
+
+    def _delete_row(self, table: str, row: Dict[str, Any]):
+        """DELETE одной строки; удаление пользователя каскадно удаляет его данные"""
+        key = row[PRIMARY_KEYS[table]]
+        if table == 'users':
+            for child in self._by_user:
+                for child_key in list(self._by_user[child].get(key, {})):
+                    self._store(child, child_key, None)
+            self._store('user_counters', key, None)
+            self._store(table, key, None)
+            return
+        self._store(table, key, None)
+        self._after_write(table, row, None)
+
+    # ========== Триггеры ==========
+
+    def _after_write(self, table: str, previous: Optional[Dict[str, Any]], row: Optional[Dict[str, Any]]):
+        """AFTER-триггеры схемы: счетчики, версия данных и серия дней"""
+        if table == 'users':
+            if previous is None:
+                self._ensure_counters(row['id'])
+            else:
+                self._bump_data_version(row['id'])
+            return
+        if table not in COUNTED_TABLES:
+            return
+
+        if previous is not None:
+            self._add_to_counters(table, previous, -1)
+        if row is not None:
+            self._add_to_counters(table, row, 1)
+
+        if row is None:
+            self._bump_data_version(previous['user_id'], create=False)
+        else:
+            if previous is not None and previous['user_id'] != row['user_id']:
+                self._bump_data_version(previous['user_id'], create=False)
+            self._bump_data_version(row['user_id'])
+
+        if table == 'daily_actions':
+            self._update_streak(previous, row)
+
+    def _ensure_counters(self, user_id: str) -> Dict[str, Any]:
+        """INSERT INTO user_counters ... ON CONFLICT DO NOTHING"""
+        counters = self._tables['user_counters'].get(user_id)
+        if counters is None:
+            counters = self._insert_row('user_counters', {'user_id': user_id})
+        return counters
+
+    def _bump_data_version(self, user_id: str, create: bool = True):
+        """user_data_version_trigger: версия для ETag растет при любом изменении"""
+        counters = self._tables['user_counters'].get(user_id)
+        if counters is None:
+            if not create or user_id not in self._tables['users']:
+                return
+            counters = self._ensure_counters(user_id)
+        self._store('user_counters', user_id, {**counters, 'data_version': counters['data_version'] + 1})
+
+    @staticmethod
+    def _counter_add(counters: Dict[str, int], key: Any, delta: int) -> Dict[str, int]:
+        """jsonb_counter_add: прибавляет delta к счетчику, нулевые счетчики удаляются"""
+        if key is None:
+            return counters
+        key = str(key)
+        result = dict(counters)
+        value = result.get(key, 0) + delta
+        if value == 0:
+            result.pop(key, None)
+        else:
+            result[key] = value
+        return result
+
+    def _add_to_counters(self, table: str, row: Dict[str, Any], sign: int):
+        """user_counters_*_trigger: вклад строки в счетчики пользователя со знаком sign"""
+        if sign > 0:
+            counters = self._ensure_counters(row['user_id'])
+        else:
+            counters = self._tables['user_counters'].get(row['user_id'])
+            if counters is None:
+                return
+        # Мягко удаленные карты в счетчиках не учитываются
+        if table == 'cards' and row['status'] == 'deleted':
+            return
+
+        counters = {**counters, 'updated_at': self._now}
+        if table == 'goals':
+            counters['goals_total'] += sign
+            counters['goals_completed'] += sign if row['is_completed'] else 0
+        elif table == 'daily_actions':
+            counters['actions_total'] += sign
+        else:
+            counters['cards_total'] += sign
+            counters['cards_by_type'] = self._counter_add(counters['cards_by_type'], row['card_type'], sign)
+            counters['cards_by_status'] = self._counter_add(counters['cards_by_status'], row['status'], sign)
+            counters['cards_by_priority'] = self._counter_add(counters['cards_by_priority'], row['priority'], sign)
+        self._store('user_counters', row['user_id'], counters)
+
+    def _update_streak(self, previous: Optional[Dict[str, Any]], row: Optional[Dict[str, Any]]):
+        """user_streak_daily_actions_trigger: новый день продлевает серию за O(1), остальное - пересчет"""
+        if previous is None:
+            user = self._tables['users'][row['user_id']]
+            last_action_date = user['last_action_date']
+            if last_action_date is None or last_action_date < row['action_date']:
+                streak = user['current_streak'] + 1 \
+                    if last_action_date == row['action_date'] - timedelta(days=1) else 1
+                self._update_row('users', user, {
+                    'current_streak': streak,
+                    'longest_streak': max(user['longest_streak'], streak),
+                    'last_action_date': row['action_date'],
+                })
+            else:
+                self._recalculate_streak(row['user_id'])
+            return
+
+        self._recalculate_streak(previous['user_id'])
+        if row is not None and row['user_id'] != previous['user_id']:
+            self._recalculate_streak(row['user_id'])
+
+    def _recalculate_streak(self, user_id: str) -> bool:
+        """Пересчитывает серию пользователя по daily_actions; True, если строка изменилась"""
+        user = self._tables['users'].get(user_id)
+        if user is None:
+            return False
+
+        current = longest = 0
+        last_action_date = None
+        action_dates = sorted({action['action_date'] for action in self._owned('daily_actions', user_id)})
+        for action_date in action_dates:
+            current = current + 1 if last_action_date == action_date - timedelta(days=1) else 1
+            longest = max(longest, current)
+            last_action_date = action_date
+
+        streak = {'current_streak': current, 'longest_streak': longest, 'last_action_date': last_action_date}
+        if all(user[column] == value for column, value in streak.items()):
+            return False
+        self._update_row('users', user, streak)
+        return True
+
+    # ========== Фильтры ==========
+
+    def _predicate(self, table: str, column: str, expression: str) -> Callable[[Dict[str, Any]], bool]:
+        """Условие PostgREST "колонка op.значение" (в том числе or/and) -> функция от строки"""
+        if column in ("or", "and"):
+            predicates = [
+                self._predicate(table, item_column, item_expression)
+                for item_column, item_expression in split_logical_filter(expression)
+            ]
+            combine = any if column == "or" else all
+            return lambda row: combine(predicate(row) for predicate in predicates)
+
+        schema = self._schema(table)
+        if column not in schema:
+            raise RepositoryError(f"Колонка {table}.{column} не существует", status_code=400, code="42703")
+        operator, value = split_filter(expression)
+        compare = {
+            "eq": lambda a, b: a == b, "neq": lambda a, b: a != b,
+            "lt": lambda a, b: a < b, "lte": lambda a, b: a <= b,
+            "gt": lambda a, b: a > b, "gte": lambda a, b: a >= b,
+        }.get(operator)
+        if compare is None:
+            raise ValueError(f"Неподдерживаемый оператор фильтра: {operator}")
+        value = self._coerce(schema[column], value)
+        # Сравнение с NULL в SQL не выполняется ни для одного оператора
+        return lambda row: row[column] is not None and compare(row[column], value)
+
+    def _find(self, table: str, filters: Optional[Dict[str, Any]] = None,
+              where: Optional[Dict[str, str]] = None) -> List[Dict[str, Any]]:
+        """Строки по фильтрам равенства и фильтрам PostgREST; индексы сужают перебор"""
+        schema = self._schema(table)
+        filters = filters or {}
+        for column in filters:
+            if column not in schema:
+                raise RepositoryError(f"Колонка {table}.{column} не существует", status_code=400, code="42703")
+        values = {column: self._coerce(schema[column], value) for column, value in filters.items()}
+
+        rows = self._tables[table]
+        primary_key = PRIMARY_KEYS[table]
+        if primary_key in values:
+            candidates = [rows[values[primary_key]]] if values[primary_key] in rows else []
+        elif 'user_id' in values and table in self._by_user:
+            candidates = list(self._by_user[table].get(values['user_id'], {}).values())
+        else:
+            candidates = None
+            for columns in UNIQUE.get(table, ()):
+                if all(column in values for column in columns):
+                    key = self._unique[(table, columns)].get(tuple(values[column] for column in columns))
+                    candidates = [rows[key]] if key is not None else []
+                    break
+            if candidates is None:
+                candidates = list(rows.values())
+
+        predicates = [self._predicate(table, column, expression) for column, expression in (where or {}).items()]
+        return [
+            row for row in candidates
+            if all(row[column] is not None and row[column] == value for column, value in values.items())
+            and all(predicate(row) for predicate in predicates)
+        ]
+
+    def _sort(self, table: str, rows: List[Dict[str, Any]], order: str) -> List[Dict[str, Any]]:
+        """Сортировка PostgREST "created_at.desc,id.desc"; NULL - последними при ASC и первыми при DESC"""
+        terms = []
+        for term in order.split(","):
+            column, _, direction = term.partition(".")
+            self._column_names(table, column)
+            terms.append((column, direction.startswith('desc')))
+
+        # Устойчивая сортировка по ключам от младшего к старшему
+        for column, descending in reversed(terms):
+            nulls = [row for row in rows if row[column] is None]
+            present = sorted((row for row in rows if row[column] is not None),
+                             key=lambda row: row[column], reverse=descending)
+            rows = nulls + present if descending else present + nulls
+        return rows
+
+    # ========== Примитивы ==========
+
+    async def select(self, table: str, columns: str, filters: Optional[Dict[str, Any]] = None,
+                     order: Optional[str] = None, limit: Optional[int] = None,
+                     where: Optional[Dict[str, str]] = None) -> List[Dict[str, Any]]:
+        """Выбирает строки таблицы"""
+        def run():
+            names = self._column_names(table, columns)
+            rows = self._find(table, filters, where)
+            if order:
+                rows = self._sort(table, rows, order)
+            if limit is not None:
+                rows = rows[:limit]
+            return [self._json_row(table, row, names) for row in rows]
+
+        return await self._execute(run)
+
+    def _check_write_columns(self, table: str, columns: List[str]):
+        """Колонки записи должны быть в схеме (PostgREST отвечает PGRST204)"""
+        schema = self._schema(table)
+        for column in columns:
+            if column not in schema:
+                raise RepositoryError(f"Колонка {column} не найдена в таблице {table}", status_code=400, code="PGRST204")
+
+    async def insert(self, table: str, rows: Any, columns: str) -> List[Dict[str, Any]]:
+        """Вставляет строки одной транзакцией"""
+        def run():
+            items = rows if isinstance(rows, list) else [rows]
+            names = self._column_names(table, columns)
+            # Как в PostgREST: колонки - объединение ключей, отсутствующие в строке ключи - NULL
+            target = list(dict.fromkeys(column for item in items for column in item))
+            self._check_write_columns(table, target)
+            created = [self._insert_row(table, {column: item.get(column) for column in target}) for item in items]
+            return [self._json_row(table, row, names) for row in created]
+
+        return await self._execute(run)
+
+    async def update(self, table: str, values: Dict[str, Any], filters: Dict[str, Any],
+                     columns: str) -> List[Dict[str, Any]]:
+        """Обновляет строки по фильтрам равенства одной транзакцией"""
+        def run():
+            names = self._column_names(table, columns)
+            self._check_write_columns(table, list(values))
+            updated = [self._update_row(table, row, values) for row in self._find(table, filters)]
+            return [self._json_row(table, row, names) for row in updated]
+
+        return await self._execute(run)
+
+    async def delete(self, table: str, filters: Dict[str, Any]) -> int:
+        """
+        Удаляет строки по фильтрам равенства (API строки не удаляет: метод для тестов и
+        подготовки данных). Удаление пользователя каскадно удаляет его цели, действия,
+        карты и счетчики
+
+        Returns:
+            Количество удаленных строк таблицы table
+        """
+        def run():
+            found = self._find(table, filters)
+            for row in found:
+                self._delete_row(table, row)
+            return len(found)
+
+        return await self._execute(run)
+
+    async def _call_function(self, function: str, params: Dict[str, Any]) -> Any:
+        """Выполняет функцию схемы, реализованную методом _fn_<имя>"""
+        implementation = getattr(self, f"_fn_{function}", None)
+        if implementation is None:
+            self.stats['requests'] += 1
+            self.stats['errors'] += 1
+            raise RepositoryError(f"Функция {function} не найдена в базе", status_code=404, code="PGRST202")
+        return await self._execute(implementation, params)
+
+    # ========== Функции схемы ==========
+
+    def _args(self, function: str, params: Dict[str, Any], signature: Dict[str, str]) -> Dict[str, Any]:
+        """Именованные параметры функции, приведенные к типам; лишний параметр - PGRST202"""
+        unknown = set(params) - set(signature)
+        if unknown:
+            raise RepositoryError(
+                f"Функция {function} с параметрами {', '.join(sorted(params))} не найдена в базе",
+                status_code=404,
+                code="PGRST202"
+            )
+        args = {}
+        for name, column_type in signature.items():
+            value = params.get(name)
+            if column_type == 'interval':
+                args[name] = self._interval(value) if value is not None else None
+            elif column_type == 'jsonb':
+                args[name] = copy.deepcopy(value)
+            else:
+                args[name] = self._coerce(column_type, value)
+        return args
+
+    def _interval(self, value: Any) -> timedelta:
+        """Интервал Postgres вида "5 seconds" или число секунд"""
+        if isinstance(value, (int, float)):
+            return timedelta(seconds=value)
+        amount, _, unit = str(value).strip().partition(" ")
+        try:
+            seconds = float(amount) * INTERVAL_UNITS[(unit.strip() or 'second').rstrip('s')]
+        except (KeyError, ValueError):
+            raise self._invalid('interval', value) from None
+        return timedelta(seconds=seconds)
+
+    def _user_by_telegram_id(self, telegram_id: int) -> Optional[Dict[str, Any]]:
+        key = self._unique[('users', ('telegram_id',))].get((telegram_id,))
+        return self._tables['users'][key] if key is not None else None
+
+    def _owned(self, table: str, user_id: str) -> List[Dict[str, Any]]:
+        return list(self._by_user[table].get(user_id, {}).values())
+
+    def _live_cards(self, user_id: str) -> List[Dict[str, Any]]:
+        """Карты пользователя с status <> 'deleted'"""
+        return [card for card in self._owned('cards', user_id)
+                if card['status'] is not None and card['status'] != 'deleted']
+
+    def _counters_json(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """to_jsonb(uc) - 'user_id'"""
+        counters = self._tables['user_counters'].get(user_id)
+        if counters is None:
+            return None
+        row = self._json_row('user_counters', counters)
+        row.pop('user_id')
+        return row
+
+    def _fn_get_user_snapshot(self, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        args = self._args('get_user_snapshot', params, {
+            'p_telegram_id': 'bigint', 'p_limit': 'integer', 'p_cards_after_created_at': 'timestamptz',
+            'p_cards_after_id': 'uuid', 'p_actions_before': 'date', 'p_actions_since': 'date',
+        })
+        user = self._user_by_telegram_id(args['p_telegram_id'])
+        if user is None:
+            return None
+        limit = args['p_limit']
+
+        actions = [
+            action for action in self._owned('daily_actions', user['id'])
+            if (args['p_actions_before'] is None or action['action_date'] < args['p_actions_before'])
+            and (args['p_actions_since'] is None or action['action_date'] >= args['p_actions_since'])
+        ]
+        actions = self._sort('daily_actions', actions, 'action_date.desc')[:limit]
+
+        cards = self._live_cards(user['id'])
+        if args['p_cards_after_created_at'] is not None:
+            after = (args['p_cards_after_created_at'], args['p_cards_after_id'])
+            cards = [card for card in cards if (card['created_at'], card['id']) < after]
+        cards = self._sort('cards', cards, 'created_at.desc,id.desc')[:limit]
+
+        return {
+            'user': self._json_row('users', user),
+            'goals': [self._json_row('goals', goal)
+                      for goal in self._sort('goals', self._owned('goals', user['id']), 'created_at')],
+            'daily_actions': [self._json_row('daily_actions', action) for action in actions],
+            'counters': self._counters_json(user['id']),
+            'cards': [self._json_row('cards', card) for card in cards],
+        }
+
+    def _fn_get_card_stats(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        args = self._args('get_card_stats', params, {'p_user_id': 'uuid'})
+        cards = self._live_cards(args['p_user_id']) if args['p_user_id'] else []
+
+        # GROUPING SETS (..., ()) возвращает итог и для пользователя без карт
+        rows = []
+        for dimension, column in (('by_type', 'card_type'), ('by_status', 'status'), ('by_priority', 'priority')):
+            counts: Dict[Any, int] = {}
+            for card in cards:
+                counts[card[column]] = counts.get(card[column], 0) + 1
+            rows += [
+                {'dimension': dimension, 'key': str(key) if key is not None else None, 'card_count': count}
+                for key, count in counts.items()
+            ]
+        rows.append({'dimension': 'total', 'key': None, 'card_count': len(cards)})
+        return rows
+
+    def _fn_upsert_user(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        args = self._args('upsert_user', params, {
+            'p_telegram_id': 'bigint', 'p_username': 'text', 'p_first_name': 'text',
+            'p_last_name': 'text', 'p_photo_url': 'text',
+        })
+        profile = {name[2:]: value for name, value in args.items()}
+        user = self._user_by_telegram_id(profile['telegram_id'])
+        if user is None:
+            return {**self._json_row('users', self._insert_row('users', profile)), 'changed': True}
+
+        # Пустые значения не затирают сохраненные; без изменений строка не переписывается
+        values = {column: value or user[column] for column, value in profile.items() if column != 'telegram_id'}
+        if all(user[column] == value for column, value in values.items()):
+            return {**self._json_row('users', user), 'changed': False}
+        return {**self._json_row('users', self._update_row('users', user, values)), 'changed': True}
+
+    def _fn_search_cards(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Без русской морфологии: релевантность считает card_search_rank"""
+        args = self._args('search_cards', params, {
+            'p_user_id': 'uuid', 'p_query': 'text', 'p_limit': 'integer',
+            'p_after_rank': 'real', 'p_after_id': 'uuid',
+        })
+        cards = self._live_cards(args['p_user_id']) if args['p_user_id'] else []
+        ranked = [(card_search_rank(card, args['p_query'] or ''), card) for card in cards]
+        found = [(rank, card) for rank, card in ranked if rank is not None]
+
+        if args['p_after_rank'] is not None:
+            after = (args['p_after_rank'], args['p_after_id'])
+            found = [(rank, card) for rank, card in found if (rank, card['id']) < after]
+        found.sort(key=lambda item: (item[0], item[1]['id']), reverse=True)
+        if args['p_limit'] is not None:
+            found = found[:args['p_limit']]
+        return [{**self._json_row('cards', card), 'rank': rank} for rank, card in found]
+
+    def _fn_get_user_changes(self, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        args = self._args('get_user_changes', params, {
+            'p_telegram_id': 'bigint', 'p_since': 'timestamptz', 'p_overlap': 'interval',
+        })
+        user = self._user_by_telegram_id(args['p_telegram_id'])
+        if user is None:
+            return None
+        since = args['p_since']
+        overlap = args['p_overlap'] if args['p_overlap'] is not None else timedelta(seconds=5)
+
+        def changed(table: str, column: str) -> List[Dict[str, Any]]:
+            rows = [row for row in self._owned(table, user['id']) if row[column] is not None and row[column] > since]
+            return self._sort(table, rows, f"{column}.asc")
+
+        cards = changed('cards', 'updated_at')
+        tombstones = [(card['updated_at'], card['id']) for card in cards if card['status'] == 'deleted']
+        tombstones += [(card['archived_at'], card['id']) for card in changed('cards_archive', 'archived_at')]
+        return {
+            'watermark': (self._now - overlap).isoformat(),
+            'user': self._json_row('users', user) if user['updated_at'] > since else None,
+            'goals': [self._json_row('goals', goal) for goal in changed('goals', 'updated_at')],
+            'cards': [self._json_row('cards', card) for card in cards
+                      if card['status'] is not None and card['status'] != 'deleted'],
+            'deleted_cards': [{'id': card_id, 'updated_at': updated_at.isoformat()}
+                              for updated_at, card_id in sorted(tombstones, key=lambda item: item[0])],
+            'daily_actions': [self._json_row('daily_actions', action)
+                              for action in changed('daily_actions', 'created_at')],
+            'counters': self._counters_json(user['id']),
+        }
+
+    def _fn_complete_daily_action(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        args = self._args('complete_daily_action', params, {'p_user_id': 'uuid', 'p_action_date': 'date'})
+        action_date = args['p_action_date'] or self._now.date()
+        key = self._unique[('daily_actions', ('user_id', 'action_date'))].get((args['p_user_id'], action_date))
+        if key is not None:
+            return {**self._json_row('daily_actions', self._tables['daily_actions'][key]), 'created': False}
+        action = self._insert_row('daily_actions', {'user_id': args['p_user_id'], 'action_date': action_date})
+        return {**self._json_row('daily_actions', action), 'created': True}
+
+    def _fn_update_cards_batch(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        args = self._args('update_cards_batch', params, {'p_user_id': 'uuid', 'p_items': 'jsonb'})
+        results = []
+        for item in args['p_items'] or []:
+            card_id = self._coerce('uuid', item.get('id'))
+            is_delete = bool(self._coerce('boolean', item.get('delete')))
+            card = self._tables['cards'].get(card_id)
+            if card is None or card['user_id'] != args['p_user_id']:
+                results.append({'id': card_id, 'status': 'not_found', 'card': None})
+                continue
+
+            values = {column: value for column, value in (item.get('values') or {}).items()
+                      if column in CARD_BATCH_COLUMNS}
+            if is_delete:
+                values['status'] = 'deleted'
+            card = self._update_row('cards', card, values)
+            results.append({
+                'id': card_id,
+                'status': 'deleted' if is_delete else 'updated',
+                'card': self._json_row('cards', card),
+            })
+        return results
+
+    def _fn_update_goals_batch(self, params: Dict[str, Any]) -> Dict[str, Any]:
+        args = self._args('update_goals_batch', params, {'p_user_id': 'uuid', 'p_items': 'jsonb'})
+        results = []
+        for item in args['p_items'] or []:
+            goal_id = self._coerce('uuid', item.get('id'))
+            goal = self._tables['goals'].get(goal_id)
+            if goal is None or goal['user_id'] != args['p_user_id']:
+                results.append({'id': goal_id, 'status': 'not_found', 'goal': None, 'completed_now': False})
+                continue
+
+            was_completed = goal['is_completed']
+            values = {column: value for column, value in (item.get('values') or {}).items()
+                      if column in GOAL_BATCH_COLUMNS}
+            goal = self._update_row('goals', goal, values)
+            results.append({
+                'id': goal_id,
+                'status': 'updated',
+                'goal': self._json_row('goals', goal),
+                'completed_now': bool(goal['is_completed'] and not was_completed),
+            })
+
+        counters = self._tables['user_counters'].get(args['p_user_id'])
+        goals_total = counters['goals_total'] if counters else len(self._owned('goals', args['p_user_id']))
+        return {'results': results, 'goals_total': goals_total}
+
+    def _fn_repair_user_counters(self, params: Dict[str, Any]) -> int:
+        args = self._args('repair_user_counters', params, {'p_user_id': 'uuid'})
+        user_ids = [args['p_user_id']] if args['p_user_id'] else list(self._tables['users'])
+
+        fixed_rows = 0
+        for user_id in user_ids:
+            if user_id not in self._tables['users']:
+                continue
+            expected = {column: copy.deepcopy(value) for column, value in DEFAULTS['user_counters'].items()
+                        if column != 'data_version'}
+            for table in ('goals', 'daily_actions', 'cards'):
+                for row in self._owned(table, user_id):
+                    if table == 'goals':
+                        expected['goals_total'] += 1
+                        expected['goals_completed'] += 1 if row['is_completed'] else 0
+                    elif table == 'daily_actions':
+                        expected['actions_total'] += 1
+                    elif row['status'] != 'deleted':
+                        expected['cards_total'] += 1
+                        for column, key in (('cards_by_type', row['card_type']), ('cards_by_status', row['status']),
+                                            ('cards_by_priority', row['priority'])):
+                            expected[column] = self._counter_add(expected[column], key, 1)
+
+            counters = self._ensure_counters(user_id)
+            if any(counters[column] != value for column, value in expected.items()):
+                self._store('user_counters', user_id, {
+                    **counters, **expected,
+                    'data_version': counters['data_version'] + 1,
+                    'updated_at': self._now,
+                })
+                fixed_rows += 1
+        return fixed_rows
+
+    def _fn_recalculate_user_streaks(self, params: Dict[str, Any]) -> int:
+        args = self._args('recalculate_user_streaks', params, {'p_user_id': 'uuid'})
+        user_ids = [args['p_user_id']] if args['p_user_id'] else list(self._tables['users'])
+        return sum(self._recalculate_streak(user_id) for user_id in user_ids)
+
+    def _fn_archive_cards(self, params: Dict[str, Any]) -> int:
+        args = self._args('archive_cards', params, {
+            'p_deleted_after': 'interval', 'p_archived_after': 'interval', 'p_batch_size': 'integer',
+        })
+        defaults = {'p_deleted_after': timedelta(days=30), 'p_archived_after': timedelta(days=180), 'p_batch_size': 1000}
+        args = {name: default if args[name] is None else args[name] for name, default in defaults.items()}
+        deleted_before = self._now - args['p_deleted_after']
+        archived_before = self._now - args['p_archived_after']
+
+        batch = [
+            card for card in self._tables['cards'].values()
+            if card['updated_at'] is not None and (
+                (card['status'] == 'deleted' and card['updated_at'] < deleted_before)
+                or (card['status'] == 'archived' and card['updated_at'] < archived_before)
+            )
+        ]
+        batch = self._sort('cards', batch, 'updated_at')[:args['p_batch_size']]
+        for card in batch:
+            self._delete_row('cards', card)
+            # ON CONFLICT (id) DO UPDATE: карта, уже побывавшая в архиве, перезаписывается
+            previous = self._tables['cards_archive'].get(card['id'])
+            if previous is not None:
+                self._update_row('cards_archive', previous, {**card, 'archived_at': self._now})
+            else:
+                self._insert_row('cards_archive', {**card, 'archived_at': self._now})
+        return len(batch)
+
+    def _fn_restore_card(self, params: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        args = self._args('restore_card', params, {'p_user_id': 'uuid', 'p_card_id': 'uuid'})
+        card = self._tables['cards'].get(args['p_card_id'])
+        if card is not None and card['user_id'] != args['p_user_id']:
+            card = None
+        if card is not None and card['status'] in ('deleted', 'archived'):
+            card = self._update_row('cards', card, {'status': 'active'})
+
+        archived = self._tables['cards_archive'].get(args['p_card_id'])
+        if card is None and archived is not None and archived['user_id'] == args['p_user_id']:
+            self._delete_row('cards_archive', archived)
+            values = {column: archived[column] for column in SCHEMA['cards']}
+            card = self._insert_row('cards', {**values, 'status': 'active', 'updated_at': self._now})
+
+        return self._json_row('cards', card) if card is not None else None
@@ -12,6 +12,9 @@ CREATE TABLE users (
     first_name TEXT,
     last_name TEXT,
     photo_url TEXT,
+    current_streak INTEGER NOT NULL DEFAULT 0, -- серия дней подряд, заканчивающаяся last_action_date
+    longest_streak INTEGER NOT NULL DEFAULT 0,
+    last_action_date DATE,
     created_at TIMESTAMPTZ DEFAULT NOW(),
     updated_at TIMESTAMPTZ DEFAULT NOW()
 );
@@ -28,14 +31,25 @@ CREATE TABLE goals (
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 );
 
--- 3. Таблица ежедневных действий
+-- 3. Таблица ежедневных действий.
+-- Одна строка на пользователя в день, строки только добавляются, поэтому таблица
+-- секционирована по годам action_date: запросы с условием на action_date (последние
+-- N дней, страница по курсору) читают только секции нужных лет, а старые годы можно
+-- отключить от таблицы (DETACH PARTITION), не трогая горячие данные.
+-- Годовые секции создает ensure_daily_actions_partitions (раздел "Секции daily_actions"),
+-- строки за годы без секции попадают в daily_actions_default.
+-- Переход существующей базы: config/migrate_daily_actions_partitioning.sql
 CREATE TABLE daily_actions (
-    id UUID PRIMARY KEY DEFAULT uuid_generate_v4(),
+    id UUID NOT NULL DEFAULT uuid_generate_v4(),
     user_id UUID NOT NULL,
     action_date DATE NOT NULL,
     created_at TIMESTAMPTZ DEFAULT NOW(),
+    -- Первичный ключ секционированной таблицы обязан включать ключ секционирования
+    PRIMARY KEY (id, action_date),
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
-);
+) PARTITION BY RANGE (action_date);
+
+CREATE TABLE daily_actions_default PARTITION OF daily_actions DEFAULT;
 
 -- 4. Таблица карт пользователей
 CREATE TABLE cards (
@@ -51,24 +65,115 @@ CREATE TABLE cards (
     metadata JSONB, -- дополнительные данные в JSON формате
     created_at TIMESTAMPTZ DEFAULT NOW(),
     updated_at TIMESTAMPTZ DEFAULT NOW(),
+    -- слова заголовка (вес A) и описания (вес B) для поиска; в ответы API не попадает
+    search_vector TSVECTOR GENERATED ALWAYS AS (
+        setweight(to_tsvector('russian', COALESCE(title, '')), 'A') ||
+        setweight(to_tsvector('russian', COALESCE(description, '')), 'B')
+    ) STORED,
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+-- 5. Счетчики пользователя (поддерживаются триггерами, см. раздел "Триггеры счетчиков")
+CREATE TABLE user_counters (
+    user_id UUID PRIMARY KEY,
+    goals_total INTEGER NOT NULL DEFAULT 0,
+    goals_completed INTEGER NOT NULL DEFAULT 0,
+    actions_total INTEGER NOT NULL DEFAULT 0,
+    cards_total INTEGER NOT NULL DEFAULT 0,
+    cards_by_type JSONB NOT NULL DEFAULT '{}', -- {"task": 3, "goal": 1}
+    cards_by_status JSONB NOT NULL DEFAULT '{}', -- {"active": 2, "completed": 2}
+    cards_by_priority JSONB NOT NULL DEFAULT '{}', -- {"1": 3, "5": 1}
+    data_version BIGINT NOT NULL DEFAULT 0, -- растет при любом изменении данных пользователя (ETag)
+    updated_at TIMESTAMPTZ DEFAULT NOW(),
     FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
 );
 
--- Создаем индексы для оптимизации запросов
-CREATE INDEX idx_users_telegram_id ON users(telegram_id);
-CREATE INDEX idx_goals_user_id ON goals(user_id);
-CREATE INDEX idx_goals_completed ON goals(is_completed);
-CREATE INDEX idx_daily_actions_user_id ON daily_actions(user_id);
-CREATE INDEX idx_daily_actions_date ON daily_actions(action_date);
-CREATE INDEX idx_cards_user_id ON cards(user_id);
-CREATE INDEX idx_cards_type ON cards(card_type);
-CREATE INDEX idx_cards_status ON cards(status);
-CREATE INDEX idx_cards_priority ON cards(priority);
-CREATE INDEX idx_cards_due_date ON cards(due_date);
-
--- Создаем составной индекс для уникальности ежедневных действий пользователя
+-- 6. Архив карт: удаленные и давно архивные карты, перенесенные из cards функцией archive_cards.
+-- Горячая таблица cards не растет от истории; карту можно вернуть функцией restore_card
+CREATE TABLE cards_archive (
+    id UUID PRIMARY KEY,
+    user_id UUID NOT NULL,
+    title TEXT NOT NULL,
+    description TEXT,
+    card_type TEXT NOT NULL,
+    status TEXT, -- статус на момент переноса: 'deleted' или 'archived'
+    priority INTEGER,
+    due_date DATE,
+    tags TEXT[],
+    metadata JSONB,
+    created_at TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ,
+    archived_at TIMESTAMPTZ NOT NULL DEFAULT NOW(),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+);
+
+-- Индексы повторяют формы запросов API (фильтр + сортировка), чтобы горячие
+-- запросы читали ровно нужную страницу без Seq Scan и без Sort.
+-- Поиск пользователя по telegram_id обслуживает индекс ограничения UNIQUE (users_telegram_id_key).
+-- Проверка планов: tests/test_query_plans.py (в том числе общих планов подготовленных запросов)
+
+-- Цели пользователя в порядке создания (снимок данных, check_ai_triggers)
+CREATE INDEX idx_goals_user_created ON goals(user_id, created_at);
+
+-- Уникальность ежедневных действий пользователя; он же обслуживает
+-- постраничную выдачу действий по action_date DESC
 CREATE UNIQUE INDEX idx_daily_actions_user_date ON daily_actions(user_id, action_date);
 
+-- Постраничная выдача карт по курсору (created_at, id); условие status <> 'deleted'
+-- проверяется по строкам индекса, а удаленные карты не копятся: их переносит archive_cards
+CREATE INDEX idx_cards_user_created ON cards(user_id, created_at DESC, id DESC);
+
+-- /cards/{telegram_id}?status=...: индекс без частичного условия, потому что
+-- условие WHERE status <> 'deleted' планировщик не может доказать для status = $n
+-- в общем (generic) плане подготовленного запроса. Удаленные карты в индексе
+-- не копятся: archive_cards переносит их в cards_archive
+CREATE INDEX idx_cards_user_status_created ON cards(user_id, status, created_at DESC, id DESC);
+
+-- /cards/{telegram_id}?card_type=...
+CREATE INDEX idx_cards_user_type_created ON cards(user_id, card_type, created_at DESC, id DESC);
+
+-- Индексы для синхронизации изменений (/users/{telegram_id}/changes?since=)
+CREATE INDEX idx_goals_user_updated ON goals(user_id, updated_at);
+CREATE INDEX idx_cards_user_updated ON cards(user_id, updated_at);
+CREATE INDEX idx_daily_actions_user_created ON daily_actions(user_id, created_at);
+
+-- Полнотекстовый поиск по картам (/cards/{telegram_id}/search, функция search_cards)
+CREATE INDEX idx_cards_search ON cards USING GIN(search_vector);
+
+-- Кандидаты на перенос в архив (archive_cards): только удаленные и архивные карты
+CREATE INDEX idx_cards_archivable ON cards(updated_at) WHERE status IN ('deleted', 'archived');
+
+-- Архив пользователя (/cards/{telegram_id}/archive) и tombstone в синхронизации изменений
+CREATE INDEX idx_cards_archive_user_archived ON cards_archive(user_id, archived_at DESC, id DESC);
+
+-- Для уже развернутой базы: составные индексы заменяют одноколоночные, которые
+-- запросы не используют (низкая селективность) или которые повторяют префикс составного
+--   CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_goals_user_created ON goals(user_id, created_at);
+--   -- частичный вариант индекса (WHERE status <> 'deleted') не годится для общих планов
+--   DROP INDEX CONCURRENTLY IF EXISTS idx_cards_user_status_created;
+--   CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_cards_user_status_created
+--       ON cards(user_id, status, created_at DESC, id DESC);
+--   CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_cards_user_type_created
+--       ON cards(user_id, card_type, created_at DESC, id DESC);
+--   CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_cards_archivable
+--       ON cards(updated_at) WHERE status IN ('deleted', 'archived');
+--   -- добавление вычисляемой колонки перезаписывает таблицу под блокировкой
+--   ALTER TABLE cards ADD COLUMN IF NOT EXISTS search_vector TSVECTOR GENERATED ALWAYS AS (
+--       setweight(to_tsvector('russian', COALESCE(title, '')), 'A') ||
+--       setweight(to_tsvector('russian', COALESCE(description, '')), 'B')
+--   ) STORED;
+--   CREATE INDEX CONCURRENTLY IF NOT EXISTS idx_cards_search ON cards USING GIN(search_vector);
+--   DROP INDEX CONCURRENTLY IF EXISTS idx_users_telegram_id;
+--   DROP INDEX CONCURRENTLY IF EXISTS idx_goals_user_id;
+--   DROP INDEX CONCURRENTLY IF EXISTS idx_goals_completed;
+--   DROP INDEX CONCURRENTLY IF EXISTS idx_daily_actions_user_id;
+--   DROP INDEX CONCURRENTLY IF EXISTS idx_daily_actions_date;
+--   DROP INDEX CONCURRENTLY IF EXISTS idx_cards_user_id;
+--   DROP INDEX CONCURRENTLY IF EXISTS idx_cards_type;
+--   DROP INDEX CONCURRENTLY IF EXISTS idx_cards_status;
+--   DROP INDEX CONCURRENTLY IF EXISTS idx_cards_priority;
+--   DROP INDEX CONCURRENTLY IF EXISTS idx_cards_due_date;
+
 -- Создаем GIN индекс для поиска по тегам
 CREATE INDEX idx_cards_tags ON cards USING GIN(tags);
 
@@ -80,6 +185,8 @@ COMMENT ON TABLE users IS 'Таблица пользователей Telegram';
 COMMENT ON TABLE goals IS 'Таблица целей пользователей';
 COMMENT ON TABLE daily_actions IS 'Таблица ежедневных действий пользователей';
 COMMENT ON TABLE cards IS 'Таблица карт пользователей';
+COMMENT ON TABLE user_counters IS 'Счетчики целей, действий и карт пользователя, обновляемые триггерами';
+COMMENT ON TABLE cards_archive IS 'Удаленные и давно архивные карты, перенесенные из cards';
 
 -- Комментарии к полям
 COMMENT ON COLUMN users.telegram_id IS 'Уникальный ID пользователя в Telegram';
@@ -87,6 +194,9 @@ COMMENT ON COLUMN users.username IS 'Имя пользователя в Telegram
 COMMENT ON COLUMN users.first_name IS 'Имя пользователя из Telegram';
 COMMENT ON COLUMN users.last_name IS 'Фамилия пользователя из Telegram';
 COMMENT ON COLUMN users.photo_url IS 'URL аватарки пользователя из Telegram';
+COMMENT ON COLUMN users.current_streak IS 'Длина серии дней подряд, заканчивающейся last_action_date (поддерживается триггером)';
+COMMENT ON COLUMN users.longest_streak IS 'Самая длинная серия дней подряд';
+COMMENT ON COLUMN users.last_action_date IS 'Дата последнего ежедневного действия';
 COMMENT ON COLUMN goals.goal_type IS 'Тип цели (например: health, career, education)';
 COMMENT ON COLUMN goals.description IS 'Описание цели';
 COMMENT ON COLUMN goals.is_completed IS 'Статус выполнения цели';
@@ -99,3 +209,873 @@ COMMENT ON COLUMN cards.priority IS 'Приоритет карты (1-5)';
 COMMENT ON COLUMN cards.due_date IS 'Срок выполнения карты';
 COMMENT ON COLUMN cards.tags IS 'Теги карты (массив строк)';
 COMMENT ON COLUMN cards.metadata IS 'Дополнительные данные карты в JSON формате';
+COMMENT ON COLUMN cards.search_vector IS 'Слова заголовка и описания для полнотекстового поиска (вычисляется)';
+COMMENT ON COLUMN cards_archive.archived_at IS 'Время переноса карты в архив';
+
+-- ========== Функции для API ==========
+
+-- Снимок всех данных пользователя одним запросом (/users/{telegram_id}/data)
+-- Возвращает NULL, если пользователь не найден.
+-- Карты и действия отдаются страницами по keyset-курсору, если задан p_limit;
+-- p_actions_since ограничивает действия последними днями (/ai/manager/*).
+-- Границы action_date заданы через COALESCE, а не "IS NULL OR", чтобы Postgres
+-- отсекал лишние секции daily_actions во время выполнения.
+-- Мягко удаленные карты не возвращаются
+DROP FUNCTION IF EXISTS get_user_snapshot(BIGINT);
+DROP FUNCTION IF EXISTS get_user_snapshot(BIGINT, INTEGER, TIMESTAMPTZ, UUID, DATE);
+
+CREATE OR REPLACE FUNCTION get_user_snapshot(
+    p_telegram_id BIGINT,
+    p_limit INTEGER DEFAULT NULL,
+    p_cards_after_created_at TIMESTAMPTZ DEFAULT NULL,
+    p_cards_after_id UUID DEFAULT NULL,
+    p_actions_before DATE DEFAULT NULL,
+    p_actions_since DATE DEFAULT NULL
+)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT jsonb_build_object(
+        'user', to_jsonb(u),
+        'goals', COALESCE(
+            (SELECT jsonb_agg(to_jsonb(g) ORDER BY g.created_at)
+             FROM goals g WHERE g.user_id = u.id),
+            '[]'::jsonb
+        ),
+        'daily_actions', COALESCE(
+            (SELECT jsonb_agg(to_jsonb(a) ORDER BY a.action_date DESC)
+             FROM (
+                 SELECT * FROM daily_actions
+                 WHERE user_id = u.id
+                   AND action_date < COALESCE(p_actions_before, 'infinity'::DATE)
+                   AND action_date >= COALESCE(p_actions_since, '-infinity'::DATE)
+                 ORDER BY action_date DESC
+                 LIMIT p_limit
+             ) a),
+            '[]'::jsonb
+        ),
+        'counters', (SELECT to_jsonb(uc) - 'user_id' FROM user_counters uc WHERE uc.user_id = u.id),
+        'cards', COALESCE(
+            (SELECT jsonb_agg(to_jsonb(c) - 'search_vector' ORDER BY c.created_at DESC, c.id DESC)
+             FROM (
+                 SELECT * FROM cards
+                 WHERE user_id = u.id
+                   AND status <> 'deleted'
+                   AND (p_cards_after_created_at IS NULL
+                        OR (created_at, id) < (p_cards_after_created_at, p_cards_after_id))
+                 ORDER BY created_at DESC, id DESC
+                 LIMIT p_limit
+             ) c),
+            '[]'::jsonb
+        )
+    )
+    FROM users u
+    WHERE u.telegram_id = p_telegram_id;
+$$;
+
+COMMENT ON FUNCTION get_user_snapshot(BIGINT, INTEGER, TIMESTAMPTZ, UUID, DATE, DATE) IS 'Пользователь, цели, ежедневные действия и карты одним JSON-документом';
+
+-- Статистика карт пользователя (/cards/{telegram_id}/stats)
+-- Одна строка на каждое значение типа, статуса и приоритета плюс общий итог (dimension = 'total').
+-- Мягко удаленные карты не учитываются
+CREATE OR REPLACE FUNCTION get_card_stats(p_user_id UUID)
+RETURNS TABLE(dimension TEXT, key TEXT, card_count BIGINT)
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT
+        CASE
+            WHEN GROUPING(card_type) = 0 THEN 'by_type'
+            WHEN GROUPING(status) = 0 THEN 'by_status'
+            WHEN GROUPING(priority) = 0 THEN 'by_priority'
+            ELSE 'total'
+        END AS dimension,
+        CASE
+            WHEN GROUPING(card_type) = 0 THEN card_type
+            WHEN GROUPING(status) = 0 THEN status
+            WHEN GROUPING(priority) = 0 THEN priority::TEXT
+        END AS key,
+        COUNT(*) AS card_count
+    FROM cards
+    WHERE user_id = p_user_id AND status <> 'deleted'
+    GROUP BY GROUPING SETS ((card_type), (status), (priority), ());
+$$;
+
+COMMENT ON FUNCTION get_card_stats(UUID) IS 'Количество карт пользователя по типам, статусам и приоритетам';
+
+-- Регистрация и вход (/register, /auth/telegram) одним запросом.
+-- Создает пользователя или обновляет изменившиеся поля профиля Telegram;
+-- пустые значения не затирают сохраненные. Если профиль не изменился,
+-- строка не переписывается (WHERE в ON CONFLICT), и функция просто читает ее.
+-- Поле changed = TRUE, если строка была создана или изменена
+CREATE OR REPLACE FUNCTION upsert_user(
+    p_telegram_id BIGINT,
+    p_username TEXT DEFAULT NULL,
+    p_first_name TEXT DEFAULT NULL,
+    p_last_name TEXT DEFAULT NULL,
+    p_photo_url TEXT DEFAULT NULL
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    result users;
+BEGIN
+    INSERT INTO users AS u (telegram_id, username, first_name, last_name, photo_url)
+    VALUES (p_telegram_id, p_username, p_first_name, p_last_name, p_photo_url)
+    ON CONFLICT (telegram_id) DO UPDATE SET
+        username = COALESCE(NULLIF(EXCLUDED.username, ''), u.username),
+        first_name = COALESCE(NULLIF(EXCLUDED.first_name, ''), u.first_name),
+        last_name = COALESCE(NULLIF(EXCLUDED.last_name, ''), u.last_name),
+        photo_url = COALESCE(NULLIF(EXCLUDED.photo_url, ''), u.photo_url),
+        updated_at = NOW()
+    WHERE (u.username, u.first_name, u.last_name, u.photo_url)
+          IS DISTINCT FROM
+          (COALESCE(NULLIF(EXCLUDED.username, ''), u.username),
+           COALESCE(NULLIF(EXCLUDED.first_name, ''), u.first_name),
+           COALESCE(NULLIF(EXCLUDED.last_name, ''), u.last_name),
+           COALESCE(NULLIF(EXCLUDED.photo_url, ''), u.photo_url))
+    RETURNING * INTO result;
+
+    IF FOUND THEN
+        RETURN to_jsonb(result) || jsonb_build_object('changed', TRUE);
+    END IF;
+
+    -- Профиль не изменился
+    SELECT * INTO result FROM users WHERE telegram_id = p_telegram_id;
+    RETURN to_jsonb(result) || jsonb_build_object('changed', FALSE);
+END;
+$$;
+
+COMMENT ON FUNCTION upsert_user(BIGINT, TEXT, TEXT, TEXT, TEXT) IS 'Регистрация или обновление профиля Telegram без записи, если профиль не изменился';
+
+-- Изменения данных пользователя после метки p_since (/users/{telegram_id}/changes).
+-- Цели и карты выбираются по updated_at, действия (они не изменяются) - по created_at.
+-- Мягко удаленные и перенесенные в архив карты возвращаются только как {"id", "updated_at"}
+-- в deleted_cards (для карт из архива updated_at - время переноса).
+-- watermark - метка для следующего запроса; она отстает от текущего времени на p_overlap,
+-- чтобы не потерять строки транзакций, которые начались раньше, а зафиксировались позже.
+-- Строки из этого окна придут повторно, клиент применяет их по id
+CREATE OR REPLACE FUNCTION get_user_changes(
+    p_telegram_id BIGINT,
+    p_since TIMESTAMPTZ,
+    p_overlap INTERVAL DEFAULT '5 seconds'
+)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT jsonb_build_object(
+        'watermark', statement_timestamp() - p_overlap,
+        'user', CASE WHEN u.updated_at > p_since THEN to_jsonb(u) END,
+        'goals', COALESCE(
+            (SELECT jsonb_agg(to_jsonb(g) ORDER BY g.updated_at)
+             FROM goals g WHERE g.user_id = u.id AND g.updated_at > p_since),
+            '[]'::jsonb
+        ),
+        'cards', COALESCE(
+            (SELECT jsonb_agg(to_jsonb(c) - 'search_vector' ORDER BY c.updated_at)
+             FROM cards c WHERE c.user_id = u.id AND c.updated_at > p_since AND c.status <> 'deleted'),
+            '[]'::jsonb
+        ),
+        'deleted_cards', COALESCE(
+            (SELECT jsonb_agg(jsonb_build_object('id', t.id, 'updated_at', t.updated_at) ORDER BY t.updated_at)
+             FROM (
+                 SELECT c.id, c.updated_at
+                 FROM cards c WHERE c.user_id = u.id AND c.updated_at > p_since AND c.status = 'deleted'
+                 UNION ALL
+                 SELECT a.id, a.archived_at
+                 FROM cards_archive a WHERE a.user_id = u.id AND a.archived_at > p_since
+             ) t),
+            '[]'::jsonb
+        ),
+        'daily_actions', COALESCE(
+            (SELECT jsonb_agg(to_jsonb(a) ORDER BY a.created_at)
+             FROM daily_actions a WHERE a.user_id = u.id AND a.created_at > p_since),
+            '[]'::jsonb
+        ),
+        'counters', (SELECT to_jsonb(uc) - 'user_id' FROM user_counters uc WHERE uc.user_id = u.id)
+    )
+    FROM users u
+    WHERE u.telegram_id = p_telegram_id;
+$$;
+
+COMMENT ON FUNCTION get_user_changes(BIGINT, TIMESTAMPTZ, INTERVAL) IS 'Цели, карты (с tombstone для удаленных) и действия пользователя, измененные после метки';
+
+-- Отметка ежедневного действия (/actions/complete) одним запросом.
+-- Вставка по уникальному индексу idx_daily_actions_user_date: повторная или параллельная
+-- отметка за тот же день не создает дубликат и возвращает существующую строку.
+-- Поле created = TRUE, только если строку создал этот вызов
+CREATE OR REPLACE FUNCTION complete_daily_action(p_user_id UUID, p_action_date DATE DEFAULT CURRENT_DATE)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    action daily_actions;
+BEGIN
+    INSERT INTO daily_actions (user_id, action_date)
+    VALUES (p_user_id, p_action_date)
+    ON CONFLICT (user_id, action_date) DO NOTHING
+    RETURNING * INTO action;
+
+    IF FOUND THEN
+        RETURN to_jsonb(action) || jsonb_build_object('created', TRUE);
+    END IF;
+
+    -- Конфликт: строку уже записал другой вызов (ON CONFLICT дожидается его фиксации)
+    SELECT * INTO action
+    FROM daily_actions
+    WHERE user_id = p_user_id AND action_date = p_action_date;
+
+    RETURN to_jsonb(action) || jsonb_build_object('created', FALSE);
+END;
+$$;
+
+COMMENT ON FUNCTION complete_daily_action(UUID, DATE) IS 'Идемпотентная отметка ежедневного действия, возвращает строку и признак created';
+
+-- Пакетное изменение карт (PATCH /cards/batch) одним оператором.
+-- p_items - массив {"id": UUID, "delete": BOOLEAN, "values": {поле: значение}}.
+-- Изменяются только карты p_user_id; мягкое удаление ставит status = 'deleted'.
+-- Возвращает массив результатов в порядке элементов: {"id", "status", "card"},
+-- где status - updated, deleted или not_found
+CREATE OR REPLACE FUNCTION update_cards_batch(p_user_id UUID, p_items JSONB)
+RETURNS JSONB
+LANGUAGE sql
+AS $$
+    WITH items AS (
+        SELECT ord, (item ->> 'id')::UUID AS card_id,
+               COALESCE((item ->> 'delete')::BOOLEAN, FALSE) AS is_delete,
+               COALESCE(item -> 'values', '{}'::jsonb) AS v
+        FROM jsonb_array_elements(p_items) WITH ORDINALITY AS t(item, ord)
+    ), updated AS (
+        UPDATE cards c SET
+            title = CASE WHEN i.v ? 'title' THEN i.v ->> 'title' ELSE c.title END,
+            description = CASE WHEN i.v ? 'description' THEN i.v ->> 'description' ELSE c.description END,
+            card_type = CASE WHEN i.v ? 'card_type' THEN i.v ->> 'card_type' ELSE c.card_type END,
+            status = CASE
+                WHEN i.is_delete THEN 'deleted'
+                WHEN i.v ? 'status' THEN i.v ->> 'status'
+                ELSE c.status
+            END,
+            priority = CASE WHEN i.v ? 'priority' THEN (i.v ->> 'priority')::INTEGER ELSE c.priority END,
+            due_date = CASE WHEN i.v ? 'due_date' THEN (i.v ->> 'due_date')::DATE ELSE c.due_date END,
+            tags = CASE
+                WHEN i.v ? 'tags' THEN ARRAY(SELECT jsonb_array_elements_text(i.v -> 'tags'))
+                ELSE c.tags
+            END,
+            metadata = CASE WHEN i.v ? 'metadata' THEN i.v -> 'metadata' ELSE c.metadata END,
+            updated_at = NOW()
+        FROM items i
+        WHERE c.id = i.card_id AND c.user_id = p_user_id
+        RETURNING c.*
+    )
+    SELECT COALESCE(jsonb_agg(jsonb_build_object(
+        'id', i.card_id,
+        'status', CASE WHEN u.id IS NULL THEN 'not_found' WHEN i.is_delete THEN 'deleted' ELSE 'updated' END,
+        'card', to_jsonb(u) - 'search_vector'
+    ) ORDER BY i.ord), '[]'::jsonb)
+    FROM items i
+    LEFT JOIN updated u ON u.id = i.card_id;
+$$;
+
+COMMENT ON FUNCTION update_cards_batch(UUID, JSONB) IS 'Пакетное изменение и мягкое удаление карт пользователя с результатом по каждой карте';
+
+-- Изменение и выполнение целей (PUT /goals/{goal_id}, POST /goals/{goal_id}/complete,
+-- PATCH /goals/batch) одним оператором.
+-- p_items - массив {"id": UUID, "values": {поле: значение}}; изменяются только цели p_user_id.
+-- completed_now = TRUE, если цель стала выполненной этим вызовом (для триггера goal_completed);
+-- goals_total избавляет проверку AI-триггеров от повторного чтения списка целей
+CREATE OR REPLACE FUNCTION update_goals_batch(p_user_id UUID, p_items JSONB)
+RETURNS JSONB
+LANGUAGE sql
+AS $$
+    WITH items AS (
+        SELECT ord, (item ->> 'id')::UUID AS goal_id, COALESCE(item -> 'values', '{}'::jsonb) AS v
+        FROM jsonb_array_elements(p_items) WITH ORDINALITY AS t(item, ord)
+    ), previous AS (
+        -- Состояние до изменения: RETURNING видит только новые значения
+        SELECT g.id, g.is_completed AS was_completed
+        FROM goals g
+        JOIN items i ON i.goal_id = g.id
+        WHERE g.user_id = p_user_id
+        FOR UPDATE OF g
+    ), updated AS (
+        UPDATE goals g SET
+            goal_type = CASE WHEN i.v ? 'goal_type' THEN i.v ->> 'goal_type' ELSE g.goal_type END,
+            description = CASE WHEN i.v ? 'description' THEN i.v ->> 'description' ELSE g.description END,
+            is_completed = CASE WHEN i.v ? 'is_completed' THEN (i.v ->> 'is_completed')::BOOLEAN ELSE g.is_completed END,
+            updated_at = NOW()
+        FROM items i, previous p
+        WHERE g.id = i.goal_id AND p.id = g.id
+        RETURNING g.*, p.was_completed
+    )
+    SELECT jsonb_build_object(
+        'results', COALESCE(jsonb_agg(jsonb_build_object(
+            'id', i.goal_id,
+            'status', CASE WHEN u.id IS NULL THEN 'not_found' ELSE 'updated' END,
+            'goal', to_jsonb(u) - 'was_completed',
+            'completed_now', COALESCE(u.is_completed AND NOT u.was_completed, FALSE)
+        ) ORDER BY i.ord), '[]'::jsonb),
+        'goals_total', COALESCE(
+            (SELECT goals_total FROM user_counters WHERE user_id = p_user_id),
+            (SELECT COUNT(*) FROM goals WHERE user_id = p_user_id)
+        )
+    )
+    FROM items i
+    LEFT JOIN updated u ON u.id = i.goal_id;
+$$;
+
+COMMENT ON FUNCTION update_goals_batch(UUID, JSONB) IS 'Пакетное изменение и выполнение целей пользователя с результатом по каждой цели';
+
+-- ========== Метки изменений ==========
+
+-- updated_at ставит база: синхронизация изменений опирается на эту метку,
+-- поэтому она не должна зависеть от часов и часового пояса сервера приложения
+CREATE OR REPLACE FUNCTION set_updated_at()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    NEW.updated_at := NOW();
+    RETURN NEW;
+END;
+$$;
+
+CREATE TRIGGER trg_users_set_updated_at
+    BEFORE UPDATE ON users
+    FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+
+CREATE TRIGGER trg_goals_set_updated_at
+    BEFORE UPDATE ON goals
+    FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+
+CREATE TRIGGER trg_cards_set_updated_at
+    BEFORE UPDATE ON cards
+    FOR EACH ROW EXECUTE FUNCTION set_updated_at();
+
+-- ========== Триггеры счетчиков ==========
+
+-- Прибавляет p_delta к счетчику p_key в JSONB-объекте, нулевые счетчики удаляются
+CREATE OR REPLACE FUNCTION jsonb_counter_add(p_counters JSONB, p_key TEXT, p_delta INTEGER)
+RETURNS JSONB
+LANGUAGE sql
+IMMUTABLE
+AS $$
+    SELECT CASE
+        WHEN p_key IS NULL THEN p_counters
+        WHEN COALESCE((p_counters ->> p_key)::INTEGER, 0) + p_delta = 0 THEN p_counters - p_key
+        ELSE jsonb_set(p_counters, ARRAY[p_key], to_jsonb(COALESCE((p_counters ->> p_key)::INTEGER, 0) + p_delta))
+    END;
+$$;
+
+-- Создает строку счетчиков для нового пользователя
+CREATE OR REPLACE FUNCTION user_counters_users_trigger()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO user_counters (user_id) VALUES (NEW.id) ON CONFLICT (user_id) DO NOTHING;
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER trg_users_user_counters
+    AFTER INSERT ON users
+    FOR EACH ROW EXECUTE FUNCTION user_counters_users_trigger();
+
+-- Цели: всего и выполнено
+CREATE OR REPLACE FUNCTION user_counters_goals_trigger()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE user_counters SET
+            goals_total = goals_total - 1,
+            goals_completed = goals_completed - CASE WHEN OLD.is_completed THEN 1 ELSE 0 END,
+            updated_at = NOW()
+        WHERE user_id = OLD.user_id;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO user_counters (user_id) VALUES (NEW.user_id) ON CONFLICT (user_id) DO NOTHING;
+        UPDATE user_counters SET
+            goals_total = goals_total + 1,
+            goals_completed = goals_completed + CASE WHEN NEW.is_completed THEN 1 ELSE 0 END,
+            updated_at = NOW()
+        WHERE user_id = NEW.user_id;
+    END IF;
+
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER trg_goals_user_counters
+    AFTER INSERT OR DELETE OR UPDATE OF user_id, is_completed ON goals
+    FOR EACH ROW EXECUTE FUNCTION user_counters_goals_trigger();
+
+-- Ежедневные действия: всего
+CREATE OR REPLACE FUNCTION user_counters_daily_actions_trigger()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        UPDATE user_counters SET
+            actions_total = actions_total - 1,
+            updated_at = NOW()
+        WHERE user_id = OLD.user_id;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO user_counters (user_id) VALUES (NEW.user_id) ON CONFLICT (user_id) DO NOTHING;
+        UPDATE user_counters SET
+            actions_total = actions_total + 1,
+            updated_at = NOW()
+        WHERE user_id = NEW.user_id;
+    END IF;
+
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER trg_daily_actions_user_counters
+    AFTER INSERT OR DELETE OR UPDATE OF user_id ON daily_actions
+    FOR EACH ROW EXECUTE FUNCTION user_counters_daily_actions_trigger();
+
+-- Карты: всего и по типам, статусам, приоритетам.
+-- Мягко удаленные карты не учитываются: удаление уменьшает счетчики, восстановление увеличивает.
+-- Для уже развернутой базы после замены функции пересчитайте счетчики: SELECT repair_user_counters();
+CREATE OR REPLACE FUNCTION user_counters_cards_trigger()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        IF OLD.status IS DISTINCT FROM 'deleted' THEN
+            UPDATE user_counters SET
+                cards_total = cards_total - 1,
+                cards_by_type = jsonb_counter_add(cards_by_type, OLD.card_type, -1),
+                cards_by_status = jsonb_counter_add(cards_by_status, OLD.status, -1),
+                cards_by_priority = jsonb_counter_add(cards_by_priority, OLD.priority::TEXT, -1),
+                updated_at = NOW()
+            WHERE user_id = OLD.user_id;
+        END IF;
+    END IF;
+
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO user_counters (user_id) VALUES (NEW.user_id) ON CONFLICT (user_id) DO NOTHING;
+        IF NEW.status IS DISTINCT FROM 'deleted' THEN
+            UPDATE user_counters SET
+                cards_total = cards_total + 1,
+                cards_by_type = jsonb_counter_add(cards_by_type, NEW.card_type, 1),
+                cards_by_status = jsonb_counter_add(cards_by_status, NEW.status, 1),
+                cards_by_priority = jsonb_counter_add(cards_by_priority, NEW.priority::TEXT, 1),
+                updated_at = NOW()
+            WHERE user_id = NEW.user_id;
+        END IF;
+    END IF;
+
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER trg_cards_user_counters
+    AFTER INSERT OR DELETE OR UPDATE OF user_id, card_type, status, priority ON cards
+    FOR EACH ROW EXECUTE FUNCTION user_counters_cards_trigger();
+
+-- Версия данных пользователя для ETag (/users/{telegram_id}/data, /cards/{telegram_id}).
+-- Увеличивается при любом изменении строки пользователя, его целей, действий и карт
+CREATE OR REPLACE FUNCTION user_data_version_trigger()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    owner_id UUID;
+BEGIN
+    IF TG_TABLE_NAME = 'users' THEN
+        owner_id := NEW.id;
+    ELSIF TG_OP = 'DELETE' THEN
+        -- Строки счетчиков удаленного пользователя удаляются каскадно, вставлять нельзя
+        UPDATE user_counters SET data_version = data_version + 1 WHERE user_id = OLD.user_id;
+        RETURN NULL;
+    ELSE
+        owner_id := NEW.user_id;
+        -- Строка перенесена к другому пользователю: изменились данные обоих
+        IF TG_OP = 'UPDATE' AND OLD.user_id IS DISTINCT FROM NEW.user_id THEN
+            UPDATE user_counters SET data_version = data_version + 1 WHERE user_id = OLD.user_id;
+        END IF;
+    END IF;
+
+    INSERT INTO user_counters AS uc (user_id, data_version) VALUES (owner_id, 1)
+    ON CONFLICT (user_id) DO UPDATE SET data_version = uc.data_version + 1;
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER trg_users_data_version
+    AFTER UPDATE ON users
+    FOR EACH ROW EXECUTE FUNCTION user_data_version_trigger();
+
+CREATE TRIGGER trg_goals_data_version
+    AFTER INSERT OR UPDATE OR DELETE ON goals
+    FOR EACH ROW EXECUTE FUNCTION user_data_version_trigger();
+
+CREATE TRIGGER trg_daily_actions_data_version
+    AFTER INSERT OR UPDATE OR DELETE ON daily_actions
+    FOR EACH ROW EXECUTE FUNCTION user_data_version_trigger();
+
+CREATE TRIGGER trg_cards_data_version
+    AFTER INSERT OR UPDATE OR DELETE ON cards
+    FOR EACH ROW EXECUTE FUNCTION user_data_version_trigger();
+
+-- Проверка и восстановление счетчиков по исходным таблицам.
+-- Пересчитывает всех пользователей (или одного, если задан p_user_id),
+-- исправляет расхождения и возвращает количество исправленных строк.
+-- Запускать после миграции и периодически, например через pg_cron:
+--   SELECT cron.schedule('repair-user-counters', '30 3 * * *', 'SELECT repair_user_counters()');
+CREATE OR REPLACE FUNCTION repair_user_counters(p_user_id UUID DEFAULT NULL)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    fixed_rows INTEGER;
+BEGIN
+    INSERT INTO user_counters AS uc (
+        user_id, goals_total, goals_completed, actions_total,
+        cards_total, cards_by_type, cards_by_status, cards_by_priority
+    )
+    SELECT
+        u.id,
+        (SELECT COUNT(*) FROM goals g WHERE g.user_id = u.id)::INTEGER,
+        (SELECT COUNT(*) FROM goals g WHERE g.user_id = u.id AND g.is_completed)::INTEGER,
+        (SELECT COUNT(*) FROM daily_actions a WHERE a.user_id = u.id)::INTEGER,
+        (SELECT COUNT(*) FROM cards c WHERE c.user_id = u.id AND c.status IS DISTINCT FROM 'deleted')::INTEGER,
+        COALESCE((SELECT jsonb_object_agg(t.key, t.cnt) FROM (
+            SELECT card_type AS key, COUNT(*) AS cnt FROM cards
+            WHERE user_id = u.id AND card_type IS NOT NULL AND status IS DISTINCT FROM 'deleted' GROUP BY card_type
+        ) t), '{}'),
+        COALESCE((SELECT jsonb_object_agg(t.key, t.cnt) FROM (
+            SELECT status AS key, COUNT(*) AS cnt FROM cards
+            WHERE user_id = u.id AND status IS NOT NULL AND status <> 'deleted' GROUP BY status
+        ) t), '{}'),
+        COALESCE((SELECT jsonb_object_agg(t.key, t.cnt) FROM (
+            SELECT priority::TEXT AS key, COUNT(*) AS cnt FROM cards
+            WHERE user_id = u.id AND priority IS NOT NULL AND status IS DISTINCT FROM 'deleted' GROUP BY priority
+        ) t), '{}')
+    FROM users u
+    WHERE p_user_id IS NULL OR u.id = p_user_id
+    ON CONFLICT (user_id) DO UPDATE SET
+        goals_total = EXCLUDED.goals_total,
+        goals_completed = EXCLUDED.goals_completed,
+        actions_total = EXCLUDED.actions_total,
+        cards_total = EXCLUDED.cards_total,
+        cards_by_type = EXCLUDED.cards_by_type,
+        cards_by_status = EXCLUDED.cards_by_status,
+        cards_by_priority = EXCLUDED.cards_by_priority,
+        data_version = uc.data_version + 1,
+        updated_at = NOW()
+    WHERE (uc.goals_total, uc.goals_completed, uc.actions_total, uc.cards_total,
+           uc.cards_by_type, uc.cards_by_status, uc.cards_by_priority)
+          IS DISTINCT FROM
+          (EXCLUDED.goals_total, EXCLUDED.goals_completed, EXCLUDED.actions_total, EXCLUDED.cards_total,
+           EXCLUDED.cards_by_type, EXCLUDED.cards_by_status, EXCLUDED.cards_by_priority);
+
+    GET DIAGNOSTICS fixed_rows = ROW_COUNT;
+    RETURN fixed_rows;
+END;
+$$;
+
+COMMENT ON FUNCTION repair_user_counters(UUID) IS 'Пересчитывает user_counters по исходным таблицам и исправляет расхождения';
+
+-- ========== Серии дней ==========
+
+-- Пересчитывает серии по daily_actions (всем пользователям или одному, если задан p_user_id)
+-- и возвращает количество исправленных строк. Используется для заполнения существующих
+-- пользователей (scripts/backfill_streaks.py) и при удалении или правке действий задним числом.
+-- Для уже развернутой базы сначала добавьте колонки:
+--   ALTER TABLE users ADD COLUMN IF NOT EXISTS current_streak INTEGER NOT NULL DEFAULT 0;
+--   ALTER TABLE users ADD COLUMN IF NOT EXISTS longest_streak INTEGER NOT NULL DEFAULT 0;
+--   ALTER TABLE users ADD COLUMN IF NOT EXISTS last_action_date DATE;
+CREATE OR REPLACE FUNCTION recalculate_user_streaks(p_user_id UUID DEFAULT NULL)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    fixed_rows INTEGER;
+BEGIN
+    WITH islands AS (
+        -- У дней одной серии разность даты и номера по порядку одинакова
+        SELECT user_id, action_date,
+               action_date - (ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY action_date))::INTEGER AS grp
+        FROM daily_actions
+        WHERE p_user_id IS NULL OR user_id = p_user_id
+    ), runs AS (
+        SELECT user_id, COUNT(*)::INTEGER AS run_length, MAX(action_date) AS run_end
+        FROM islands
+        GROUP BY user_id, grp
+    ), streaks AS (
+        SELECT user_id,
+               (ARRAY_AGG(run_length ORDER BY run_end DESC))[1] AS current_streak,
+               MAX(run_length) AS longest_streak,
+               MAX(run_end) AS last_action_date
+        FROM runs
+        GROUP BY user_id
+    )
+    UPDATE users u SET
+        current_streak = COALESCE(s.current_streak, 0),
+        longest_streak = COALESCE(s.longest_streak, 0),
+        last_action_date = s.last_action_date
+    FROM users target
+    LEFT JOIN streaks s ON s.user_id = target.id
+    WHERE u.id = target.id
+      AND (p_user_id IS NULL OR target.id = p_user_id)
+      AND (u.current_streak, u.longest_streak, u.last_action_date)
+          IS DISTINCT FROM
+          (COALESCE(s.current_streak, 0), COALESCE(s.longest_streak, 0), s.last_action_date);
+
+    GET DIAGNOSTICS fixed_rows = ROW_COUNT;
+    RETURN fixed_rows;
+END;
+$$;
+
+COMMENT ON FUNCTION recalculate_user_streaks(UUID) IS 'Пересчитывает current_streak, longest_streak и last_action_date по daily_actions';
+
+-- Обновляет серию при записи действия (/actions/complete).
+-- Новое действие за день после last_action_date меняет серию за O(1);
+-- действие задним числом, удаление или перенос пересчитывают серию пользователя целиком.
+CREATE OR REPLACE FUNCTION user_streak_daily_actions_trigger()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        UPDATE users SET
+            current_streak = CASE WHEN last_action_date = NEW.action_date - 1 THEN current_streak + 1 ELSE 1 END,
+            longest_streak = GREATEST(
+                longest_streak,
+                CASE WHEN last_action_date = NEW.action_date - 1 THEN current_streak + 1 ELSE 1 END
+            ),
+            last_action_date = NEW.action_date
+        WHERE id = NEW.user_id
+          AND (last_action_date IS NULL OR last_action_date < NEW.action_date);
+
+        IF NOT FOUND THEN
+            PERFORM recalculate_user_streaks(NEW.user_id);
+        END IF;
+        RETURN NULL;
+    END IF;
+
+    PERFORM recalculate_user_streaks(OLD.user_id);
+    IF TG_OP = 'UPDATE' AND NEW.user_id IS DISTINCT FROM OLD.user_id THEN
+        PERFORM recalculate_user_streaks(NEW.user_id);
+    END IF;
+    RETURN NULL;
+END;
+$$;
+
+CREATE TRIGGER trg_daily_actions_user_streak
+    AFTER INSERT OR DELETE OR UPDATE OF user_id, action_date ON daily_actions
+    FOR EACH ROW EXECUTE FUNCTION user_streak_daily_actions_trigger();
+
+-- ========== Архив карт ==========
+
+-- Перенос мягко удаленных карт старше p_deleted_after и архивных карт старше p_archived_after
+-- (по updated_at) из cards в cards_archive. Одна партия - не больше p_batch_size карт;
+-- возвращает количество перенесенных карт, фоновая задача вызывает функцию, пока оно
+-- не станет меньше p_batch_size (scripts/archive_cards.py). Строки, заблокированные
+-- другими транзакциями, пропускаются и будут перенесены следующим запуском.
+-- Можно запускать через pg_cron:
+--   SELECT cron.schedule('archive-cards', '15 4 * * *', 'SELECT archive_cards()');
+CREATE OR REPLACE FUNCTION archive_cards(
+    p_deleted_after INTERVAL DEFAULT '30 days',
+    p_archived_after INTERVAL DEFAULT '180 days',
+    p_batch_size INTEGER DEFAULT 1000
+)
+RETURNS INTEGER
+LANGUAGE sql
+AS $$
+    WITH batch AS (
+        SELECT id FROM cards
+        WHERE (status = 'deleted' AND updated_at < NOW() - p_deleted_after)
+           OR (status = 'archived' AND updated_at < NOW() - p_archived_after)
+        ORDER BY updated_at
+        LIMIT p_batch_size
+        FOR UPDATE SKIP LOCKED
+    ), moved AS (
+        DELETE FROM cards c USING batch b
+        WHERE c.id = b.id
+        RETURNING c.id, c.user_id, c.title, c.description, c.card_type, c.status, c.priority,
+                  c.due_date, c.tags, c.metadata, c.created_at, c.updated_at
+    ), archived AS (
+        INSERT INTO cards_archive (
+            id, user_id, title, description, card_type, status, priority,
+            due_date, tags, metadata, created_at, updated_at, archived_at
+        )
+        SELECT id, user_id, title, description, card_type, status, priority,
+               due_date, tags, metadata, created_at, updated_at, NOW()
+        FROM moved
+        -- Карта, уже побывавшая в архиве, перезаписывается последней версией
+        ON CONFLICT (id) DO UPDATE SET
+            title = EXCLUDED.title, description = EXCLUDED.description,
+            card_type = EXCLUDED.card_type, status = EXCLUDED.status, priority = EXCLUDED.priority,
+            due_date = EXCLUDED.due_date, tags = EXCLUDED.tags, metadata = EXCLUDED.metadata,
+            updated_at = EXCLUDED.updated_at, archived_at = EXCLUDED.archived_at
+        RETURNING id
+    )
+    SELECT COUNT(*)::INTEGER FROM archived;
+$$;
+
+COMMENT ON FUNCTION archive_cards(INTERVAL, INTERVAL, INTEGER) IS 'Переносит партию удаленных и давно архивных карт в cards_archive';
+
+-- Восстановление карты (POST /cards/{card_id}/restore): карта из архива возвращается
+-- в cards, мягко удаленная или архивная карта в cards снова становится активной.
+-- Повторный вызов возвращает уже восстановленную карту; NULL - карты пользователя нет
+CREATE OR REPLACE FUNCTION restore_card(p_user_id UUID, p_card_id UUID)
+RETURNS JSONB
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    restored cards;
+BEGIN
+    UPDATE cards SET status = 'active', updated_at = NOW()
+    WHERE id = p_card_id AND user_id = p_user_id AND status IN ('deleted', 'archived')
+    RETURNING * INTO restored;
+
+    IF NOT FOUND THEN
+        WITH moved AS (
+            DELETE FROM cards_archive
+            WHERE id = p_card_id AND user_id = p_user_id
+            RETURNING id, user_id, title, description, card_type, priority,
+                      due_date, tags, metadata, created_at
+        )
+        INSERT INTO cards (
+            id, user_id, title, description, card_type, status, priority,
+            due_date, tags, metadata, created_at, updated_at
+        )
+        SELECT id, user_id, title, description, card_type, 'active', priority,
+               due_date, tags, metadata, created_at, NOW()
+        FROM moved
+        RETURNING * INTO restored;
+    END IF;
+
+    IF restored.id IS NULL THEN
+        SELECT * INTO restored FROM cards WHERE id = p_card_id AND user_id = p_user_id;
+    END IF;
+
+    RETURN CASE WHEN restored.id IS NULL THEN NULL ELSE to_jsonb(restored) - 'search_vector' END;
+END;
+$$;
+
+COMMENT ON FUNCTION restore_card(UUID, UUID) IS 'Возвращает удаленную или перенесенную в архив карту в активные';
+
+-- Поиск по заголовкам и описаниям карт пользователя (/cards/{telegram_id}/search).
+-- Запрос разбирается websearch_to_tsquery с русской морфологией: слова в любой форме,
+-- "точная фраза", or, -исключение; каждое слово ищется и как начало слова, чтобы
+-- карты находились по мере набора ("бег" находит "бегать"). Самые релевантные карты
+-- первыми (совпадение в заголовке весит больше, чем в описании); страницы по курсору
+-- (rank, id) последней карты предыдущей страницы. Удаленные карты не ищутся
+CREATE OR REPLACE FUNCTION search_cards(
+    p_user_id UUID,
+    p_query TEXT,
+    p_limit INTEGER DEFAULT NULL,
+    p_after_rank REAL DEFAULT NULL,
+    p_after_id UUID DEFAULT NULL
+)
+RETURNS JSONB
+LANGUAGE sql
+STABLE
+AS $$
+    SELECT COALESCE(jsonb_agg(to_jsonb(r) - 'search_vector' ORDER BY r.rank DESC, r.id DESC), '[]'::jsonb)
+    FROM (
+        SELECT *
+        FROM (
+            SELECT c.*, ts_rank(c.search_vector, q.query) AS rank
+            FROM cards c,
+                 CAST(regexp_replace(websearch_to_tsquery('russian', p_query)::TEXT,
+                                     '(''(?:[^'']|'''')+'')', '\1:*', 'g') AS TSQUERY) AS q(query)
+            WHERE c.user_id = p_user_id
+              AND c.status <> 'deleted'
+              AND c.search_vector @@ q.query
+        ) ranked
+        WHERE p_after_rank IS NULL OR (rank, id) < (p_after_rank, p_after_id)
+        ORDER BY rank DESC, id DESC
+        LIMIT p_limit
+    ) r;
+$$;
+
+COMMENT ON FUNCTION search_cards(UUID, TEXT, INTEGER, REAL, UUID) IS 'Полнотекстовый поиск по картам пользователя, самые релевантные первыми';
+
+-- ========== Секции daily_actions ==========
+
+-- Создает годовые секции daily_actions с p_from_year по p_to_year включительно, если их нет,
+-- и возвращает количество созданных секций. Строки этих лет, уже попавшие в
+-- daily_actions_default, переносятся в новую секцию: функция убирает их во временную
+-- таблицу, создает секцию и вставляет их обратно через daily_actions. Триггеры при
+-- этом срабатывают как при обычных удалении и вставке (отключать их без прав
+-- суперпользователя нельзя): счетчики возвращаются к прежним значениям, серии
+-- пересчитываются, data_version пользователей увеличивается. Если таких строк нет,
+-- перенос пропускается.
+-- Функция должна выполняться одной транзакцией (один SELECT, без COMMIT между
+-- секциями): при ошибке созданные секции и перенос откатываются вместе.
+-- Создание секции проверяет секцию по умолчанию и держит на ней ACCESS EXCLUSIVE
+-- до конца транзакции - запускайте в часы низкой нагрузки.
+-- Секцию следующего года нужно создать заранее, например через pg_cron:
+--   SELECT cron.schedule('daily-actions-partitions', '0 3 1 12 *', 'SELECT ensure_daily_actions_partitions()');
+CREATE OR REPLACE FUNCTION ensure_daily_actions_partitions(
+    p_from_year INTEGER DEFAULT EXTRACT(YEAR FROM CURRENT_DATE)::INTEGER,
+    p_to_year INTEGER DEFAULT EXTRACT(YEAR FROM CURRENT_DATE)::INTEGER + 1
+)
+RETURNS INTEGER
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    partition_year INTEGER;
+    partition_name TEXT;
+    range_start DATE;
+    range_end DATE;
+    has_rows BOOLEAN;
+    created_count INTEGER := 0;
+BEGIN
+    FOR partition_year IN p_from_year..p_to_year LOOP
+        partition_name := format('daily_actions_%s', partition_year);
+        CONTINUE WHEN to_regclass(partition_name) IS NOT NULL;
+        range_start := make_date(partition_year, 1, 1);
+        range_end := make_date(partition_year + 1, 1, 1);
+
+        -- Пока в секции по умолчанию есть строки этого года, секцию для него создать нельзя
+        has_rows := EXISTS (
+            SELECT 1 FROM daily_actions_default WHERE action_date >= range_start AND action_date < range_end
+        );
+        IF has_rows THEN
+            IF to_regclass('pg_temp.daily_actions_moving') IS NULL THEN
+                CREATE TEMP TABLE daily_actions_moving (LIKE daily_actions) ON COMMIT DROP;
+            END IF;
+            WITH moved AS (
+                DELETE FROM daily_actions_default
+                WHERE action_date >= range_start AND action_date < range_end
+                RETURNING *
+            )
+            INSERT INTO daily_actions_moving SELECT * FROM moved;
+        END IF;
+
+        -- Индексы, внешний ключ и триггеры секция получает от daily_actions
+        EXECUTE format(
+            'CREATE TABLE %I PARTITION OF daily_actions FOR VALUES FROM (%L) TO (%L)',
+            partition_name, range_start, range_end
+        );
+
+        IF has_rows THEN
+            INSERT INTO daily_actions SELECT * FROM daily_actions_moving ORDER BY action_date;
+            DELETE FROM daily_actions_moving;
+        END IF;
+        created_count := created_count + 1;
+    END LOOP;
+    RETURN created_count;
+END;
+$$;
+
+COMMENT ON FUNCTION ensure_daily_actions_partitions(INTEGER, INTEGER) IS 'Создает годовые секции daily_actions и переносит в них строки из секции по умолчанию';
+
+SELECT ensure_daily_actions_partitions(2024, EXTRACT(YEAR FROM CURRENT_DATE)::INTEGER + 1);
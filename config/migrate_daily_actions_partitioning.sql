@@ -0,0 +1,72 @@
+-- Переход существующей таблицы daily_actions на секционирование по годам action_date
+-- (таблица и функции - config/database_schema.sql).
+--
+-- Порядок:
+--   1. Выполните из config/database_schema.sql раздел "Секции daily_actions" без последнего
+--      SELECT (функция ensure_daily_actions_partitions) и новую версию get_user_snapshot.
+--   2. Выполните этот файл. Строки копируются в новую таблицу одной транзакцией; до COMMIT
+--      таблица заблокирована для чтения и записи (scripts/bench_partition_pruning.py
+--      показывает время копирования на синтетических данных - оцените окно заранее).
+--      Счетчики и серии не меняются: триггеры создаются после копирования.
+--   3. Повторно выполните функции раздела "Функции для API" (CREATE OR REPLACE):
+--      это сбрасывает закэшированный в сессиях тип строки daily_actions у plpgsql-функций.
+--   4. Проверьте данные и удалите старую таблицу: DROP TABLE daily_actions_unpartitioned;
+
+BEGIN;
+
+LOCK TABLE daily_actions IN ACCESS EXCLUSIVE MODE;
+
+-- Старая таблица остается рядом до проверки; имена индексов освобождаются для новой
+ALTER TABLE daily_actions RENAME TO daily_actions_unpartitioned;
+ALTER INDEX daily_actions_pkey RENAME TO daily_actions_unpartitioned_pkey;
+ALTER INDEX IF EXISTS idx_daily_actions_user_date RENAME TO idx_daily_actions_unpartitioned_user_date;
+ALTER INDEX IF EXISTS idx_daily_actions_user_created RENAME TO idx_daily_actions_unpartitioned_user_created;
+DROP TRIGGER IF EXISTS trg_daily_actions_user_counters ON daily_actions_unpartitioned;
+DROP TRIGGER IF EXISTS trg_daily_actions_data_version ON daily_actions_unpartitioned;
+DROP TRIGGER IF EXISTS trg_daily_actions_user_streak ON daily_actions_unpartitioned;
+
+CREATE TABLE daily_actions (
+    id UUID NOT NULL DEFAULT uuid_generate_v4(),
+    user_id UUID NOT NULL,
+    action_date DATE NOT NULL,
+    created_at TIMESTAMPTZ DEFAULT NOW(),
+    PRIMARY KEY (id, action_date),
+    FOREIGN KEY (user_id) REFERENCES users(id) ON DELETE CASCADE
+) PARTITION BY RANGE (action_date);
+
+CREATE TABLE daily_actions_default PARTITION OF daily_actions DEFAULT;
+
+-- Секции на все годы, за которые есть действия, и на следующий год
+SELECT ensure_daily_actions_partitions(
+    LEAST(
+        EXTRACT(YEAR FROM CURRENT_DATE)::INTEGER,
+        (SELECT EXTRACT(YEAR FROM MIN(action_date))::INTEGER FROM daily_actions_unpartitioned)
+    ),
+    EXTRACT(YEAR FROM CURRENT_DATE)::INTEGER + 1
+);
+
+INSERT INTO daily_actions (id, user_id, action_date, created_at)
+SELECT id, user_id, action_date, created_at FROM daily_actions_unpartitioned;
+
+-- Индексы строятся по заполненным секциям, как в config/database_schema.sql
+CREATE UNIQUE INDEX idx_daily_actions_user_date ON daily_actions(user_id, action_date);
+CREATE INDEX idx_daily_actions_user_created ON daily_actions(user_id, created_at);
+
+CREATE TRIGGER trg_daily_actions_user_counters
+    AFTER INSERT OR DELETE OR UPDATE OF user_id ON daily_actions
+    FOR EACH ROW EXECUTE FUNCTION user_counters_daily_actions_trigger();
+
+CREATE TRIGGER trg_daily_actions_data_version
+    AFTER INSERT OR UPDATE OR DELETE ON daily_actions
+    FOR EACH ROW EXECUTE FUNCTION user_data_version_trigger();
+
+CREATE TRIGGER trg_daily_actions_user_streak
+    AFTER INSERT OR DELETE OR UPDATE OF user_id, action_date ON daily_actions
+    FOR EACH ROW EXECUTE FUNCTION user_streak_daily_actions_trigger();
+
+COMMENT ON TABLE daily_actions IS 'Таблица ежедневных действий пользователей';
+COMMENT ON COLUMN daily_actions.action_date IS 'Дата выполнения действия';
+
+ANALYZE daily_actions;
+
+COMMIT;
@@ -57,6 +57,11 @@ class APIIntegration {
             
             if (response.ok) {
                 const userData = await response.json();
+                // Сервер отдал сохраненную копию, пока база недоступна
+                userData.stale = response.headers.get('X-Data-Stale') === '1';
+                if (userData.stale) {
+                    console.warn('⚠️ Данные устарели на', response.headers.get('Age'), 'с');
+                }
                 console.log('📊 Данные пользователя получены:', userData);
                 return userData;
             } else {
@@ -263,6 +268,156 @@ class APIIntegration {
             return null;
         }
     }
+
+    // 10. Пакетное изменение карт одним запросом
+    // items: [{ id, ...поля для обновления }] или [{ id, delete: true }]
+    async updateCardsBatch(telegramId, items) {
+        try {
+            const response = await fetch(`${this.baseURL}/cards/batch`, {
+                method: 'PATCH',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({
+                    telegram_id: telegramId,
+                    items
+                })
+            });
+
+            if (response.ok) {
+                const result = await response.json();
+                console.log('🃏 Карты обновлены:', result);
+                return result;
+            } else {
+                console.error('❌ Ошибка пакетного обновления карт:', response.status);
+                return null;
+            }
+        } catch (error) {
+            console.error('❌ Ошибка при пакетном обновлении карт:', error);
+            return null;
+        }
+    }
+
+    // 11. Пакетное изменение целей одним запросом
+    // items: [{ id, is_completed?, goal_type?, description? }]
+    async updateGoalsBatch(telegramId, items) {
+        try {
+            const response = await fetch(`${this.baseURL}/goals/batch`, {
+                method: 'PATCH',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({
+                    telegram_id: telegramId,
+                    items
+                })
+            });
+
+            if (response.ok) {
+                const result = await response.json();
+                console.log('🎯 Цели обновлены:', result);
+                return result;
+            } else {
+                console.error('❌ Ошибка пакетного обновления целей:', response.status);
+                return null;
+            }
+        } catch (error) {
+            console.error('❌ Ошибка при пакетном обновлении целей:', error);
+            return null;
+        }
+    }
+
+    // 12. Изменения данных пользователя после метки since (watermark из прошлого ответа)
+    async getUserChanges(telegramId, since) {
+        try {
+            const params = new URLSearchParams({ since });
+            const response = await fetch(`${this.baseURL}/users/${telegramId}/changes?${params}`);
+
+            if (response.ok) {
+                const changes = await response.json();
+                console.log('🔄 Изменения получены:', changes);
+                return changes;
+            } else {
+                console.error('❌ Ошибка получения изменений:', response.status);
+                return null;
+            }
+        } catch (error) {
+            console.error('❌ Ошибка при получении изменений:', error);
+            return null;
+        }
+    }
+
+    // 13. Карты, перенесенные в архив (cursor - заголовок X-Next-Cursor прошлого ответа)
+    async getArchivedCards(telegramId, limit = null, cursor = null) {
+        try {
+            const params = new URLSearchParams();
+            if (limit) params.append('limit', limit);
+            if (cursor) params.append('cursor', cursor);
+
+            const query = params.toString() ? `?${params}` : '';
+            const response = await fetch(`${this.baseURL}/cards/${telegramId}/archive${query}`);
+
+            if (response.ok) {
+                const cards = await response.json();
+                console.log('🗄️ Архив карт получен:', cards);
+                return { cards, nextCursor: response.headers.get('X-Next-Cursor') };
+            } else {
+                console.error('❌ Ошибка получения архива карт:', response.status);
+                return null;
+            }
+        } catch (error) {
+            console.error('❌ Ошибка при получении архива карт:', error);
+            return null;
+        }
+    }
+
+    // 14. Восстановление удаленной или перенесенной в архив карты
+    async restoreCard(telegramId, cardId) {
+        try {
+            const response = await fetch(`${this.baseURL}/cards/${cardId}/restore`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({ telegram_id: telegramId })
+            });
+
+            if (response.ok) {
+                const result = await response.json();
+                console.log('🃏 Карта восстановлена:', result);
+                return result;
+            } else {
+                console.error('❌ Ошибка восстановления карты:', response.status);
+                return null;
+            }
+        } catch (error) {
+            console.error('❌ Ошибка при восстановлении карты:', error);
+            return null;
+        }
+    }
+
+    // 15. Поиск по заголовкам и описаниям карт (cursor - заголовок X-Next-Cursor прошлого ответа)
+    async searchCards(telegramId, query, limit = null, cursor = null) {
+        try {
+            const params = new URLSearchParams({ q: query });
+            if (limit) params.append('limit', limit);
+            if (cursor) params.append('cursor', cursor);
+
+            const response = await fetch(`${this.baseURL}/cards/${telegramId}/search?${params}`);
+
+            if (response.ok) {
+                const cards = await response.json();
+                console.log('🔍 Карты найдены:', cards);
+                return { cards, nextCursor: response.headers.get('X-Next-Cursor') };
+            } else {
+                console.error('❌ Ошибка поиска карт:', response.status);
+                return null;
+            }
+        } catch (error) {
+            console.error('❌ Ошибка при поиске карт:', error);
+            return null;
+        }
+    }
 }
 
 // Глобальный экземпляр API
@@ -424,12 +424,15 @@ class GarageModule {
         const goals = userData.goals || [];
         const dailyActions = userData.daily_actions || [];
         const cards = userData.cards || [];
+        // Счетчики с сервера точнее длины списков, если списки пришли постранично
+        const counters = userData.counters || {};
         
         // Количество завершенных целей
-        const completedGoals = goals.filter(g => g.is_completed).length;
+        const completedGoals = counters.goals_completed ?? goals.filter(g => g.is_completed).length;
+        const totalActions = counters.actions_total ?? dailyActions.length;
         
         // Вычисляем streak (серию дней подряд)
-        const currentStreak = this.calculateStreak(dailyActions);
+        const currentStreak = this.calculateStreak(dailyActions, userData.user);
         
         // Общее количество шагов (из карт или целей)
         const totalSteps = this.calculateTotalSteps(cards, goals);
@@ -437,7 +440,7 @@ class GarageModule {
         // Вычисляем уровень и опыт на основе активности
         const { level, currentExp, nextLevelExp } = this.calculateLevelAndExp(
             completedGoals,
-            dailyActions.length,
+            totalActions,
             currentStreak
         );
         
@@ -453,8 +456,22 @@ class GarageModule {
         };
     }
     
+    // Локальная дата в формате YYYY-MM-DD (toISOString дает дату по UTC)
+    formatLocalDate(date) {
+        const month = String(date.getMonth() + 1).padStart(2, '0');
+        const day = String(date.getDate()).padStart(2, '0');
+        return `${date.getFullYear()}-${month}-${day}`;
+    }
+    
     // Вычисление streak (серии дней подряд)
-    calculateStreak(dailyActions) {
+    calculateStreak(dailyActions, user = null) {
+        // Сервер хранит серию в профиле пользователя: она засчитывается, если последнее действие
+        // сегодня по локальной дате (так же серию считают check_ai_triggers и analyze_progress)
+        if (user && user.current_streak !== undefined) {
+            const today = this.formatLocalDate(new Date());
+            return user.last_action_date === today ? user.current_streak : 0;
+        }
+        
         if (!dailyActions || dailyActions.length === 0) return 0;
         
         // Сортируем действия по дате (от новых к старым)
@@ -594,9 +611,12 @@ class GarageModule {
         
         const goals = userData.goals || [];
         const dailyActions = userData.daily_actions || [];
-        const completedGoals = goals.filter(g => g.is_completed).length;
-        const streak = this.calculateStreak(dailyActions);
-        const { level } = this.calculateLevelAndExp(completedGoals, dailyActions.length, streak);
+        // Те же счетчики с сервера, что и в статистике: списки могут прийти не целиком
+        const counters = userData.counters || {};
+        const completedGoals = counters.goals_completed ?? goals.filter(g => g.is_completed).length;
+        const totalActions = counters.actions_total ?? dailyActions.length;
+        const streak = this.calculateStreak(dailyActions, userData.user);
+        const { level } = this.calculateLevelAndExp(completedGoals, totalActions, streak);
         
         // Обновляем достижения
         const achievements = [
@@ -0,0 +1,73 @@
+"""
+Перенос удаленных и давно архивных карт из cards в cards_archive
+
+Мягкое удаление только меняет статус карты, поэтому строки копятся в горячей
+таблице. Задача вызывает функцию archive_cards из config/database_schema.sql
+партиями по ARCHIVE_BATCH_SIZE карт (каждая партия - отдельная короткая
+транзакция), пока не перенесет все подходящие карты. Перенесенную карту
+возвращает POST /cards/{card_id}/restore. Повторный запуск безопасен.
+
+Запускать периодически, например из cron раз в сутки, или через pg_cron
+(см. комментарий к archive_cards в схеме).
+
+Запуск:
+    SUPABASE_URL=... SUPABASE_KEY=... python scripts/archive_cards.py
+    DATABASE_URL=postgresql://... python scripts/archive_cards.py
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from dotenv import load_dotenv
+
+from repository import SupabaseRepository, PostgresRepository, RepositoryError
+
+load_dotenv()
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+DATABASE_URL = os.getenv("DATABASE_URL")
+DELETED_AFTER_DAYS = int(os.getenv("ARCHIVE_DELETED_AFTER_DAYS", "30"))
+ARCHIVED_AFTER_DAYS = int(os.getenv("ARCHIVE_ARCHIVED_AFTER_DAYS", "180"))
+BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+# Пауза между партиями в секундах, чтобы не нагружать базу
+PAUSE = float(os.getenv("ARCHIVE_PAUSE", "0.1"))
+
+
+async def main():
+    if DATABASE_URL:
+        repository = PostgresRepository(DATABASE_URL, timeout=300.0, max_connections=1)
+    elif SUPABASE_URL and SUPABASE_KEY:
+        repository = SupabaseRepository(SUPABASE_URL, SUPABASE_KEY, timeout=300.0)
+    else:
+        raise SystemExit("Нужен DATABASE_URL или SUPABASE_URL и SUPABASE_KEY")
+
+    print(
+        f"Переносим удаленные карты старше {DELETED_AFTER_DAYS} дн. и архивные "
+        f"старше {ARCHIVED_AFTER_DAYS} дн. партиями по {BATCH_SIZE}"
+    )
+    total = 0
+    try:
+        while True:
+            moved = await repository.archive_cards(DELETED_AFTER_DAYS, ARCHIVED_AFTER_DAYS, BATCH_SIZE)
+            total += moved
+            if moved:
+                print(f"Перенесено: {total}")
+            if moved < BATCH_SIZE:
+                break
+            await asyncio.sleep(PAUSE)
+    except RepositoryError as e:
+        if e.is_missing_function:
+            raise SystemExit("Функция archive_cards не найдена: примените config/database_schema.sql")
+        raise
+    finally:
+        await repository.close()
+
+    print(f"Готово, перенесено карт: {total}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,62 @@
+"""
+Заполнение серий дней (current_streak, longest_streak, last_action_date) для существующих пользователей
+
+Серии новых действий обновляет триггер на daily_actions, а строки, созданные до
+появления колонок, нужно один раз пересчитать функцией recalculate_user_streaks
+из config/database_schema.sql. Повторный запуск безопасен: изменяются только
+строки с расхождениями.
+
+Запуск:
+    SUPABASE_URL=... SUPABASE_KEY=... python scripts/backfill_streaks.py [telegram_id ...]
+"""
+
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from dotenv import load_dotenv
+
+from repository import SupabaseRepository, RepositoryError
+
+load_dotenv()
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+
+
+async def main():
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        raise SystemExit("Нужны SUPABASE_URL и SUPABASE_KEY")
+
+    telegram_ids = [int(arg) for arg in sys.argv[1:]]
+    repository = SupabaseRepository(SUPABASE_URL, SUPABASE_KEY, timeout=300.0)
+    try:
+        if not telegram_ids:
+            fixed = await repository.rpc("recalculate_user_streaks", {"p_user_id": None})
+            print(f"Исправлено пользователей: {fixed}")
+            return
+
+        for telegram_id in telegram_ids:
+            user_id = await repository.get_user_id(telegram_id)
+            if not user_id:
+                print(f"{telegram_id}: пользователь не найден")
+                continue
+            fixed = await repository.rpc("recalculate_user_streaks", {"p_user_id": user_id})
+            streak = await repository.get_user_streak(user_id)
+            print(
+                f"{telegram_id}: {'исправлено' if fixed else 'без изменений'}, "
+                f"серия {streak['current_streak']}, лучшая {streak['longest_streak']}, "
+                f"последнее действие {streak['last_action_date']}"
+            )
+    except RepositoryError as e:
+        if e.is_missing_function:
+            raise SystemExit("Функция recalculate_user_streaks не найдена: примените config/database_schema.sql")
+        raise
+    finally:
+        await repository.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,126 @@
+"""
+Бенчмарк задержек: PostgREST (SupabaseRepository) против asyncpg (PostgresRepository)
+
+Выполняет одни и те же методы репозитория через оба пути к одной базе и печатает
+p50/p95 по каждой операции. Для честного сравнения PostgREST должен смотреть
+в ту же локальную базу, что и DATABASE_URL, например:
+
+    docker run --rm -p 3000:3000 -e PGRST_DB_URI=postgresql://... \
+        -e PGRST_DB_ANON_ROLE=postgres postgrest/postgrest
+
+Если SUPABASE_URL не задан, измеряется только asyncpg.
+
+Создает пользователя с telegram_id BENCH_TELEGRAM_ID и BENCH_CARDS карт, если их
+еще нет: используйте тестовую базу.
+
+Запуск:
+    DATABASE_URL=postgresql://... SUPABASE_URL=http://localhost:3000 SUPABASE_KEY=... \
+        python scripts/bench_backends.py
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import time
+from datetime import date
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from dotenv import load_dotenv
+
+from repository import SupabaseRepository, PostgresRepository
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+# Локальному PostgREST ключ не нужен, но заголовки он принимает
+SUPABASE_KEY = os.getenv("SUPABASE_KEY", "local")
+TELEGRAM_ID = int(os.getenv("BENCH_TELEGRAM_ID", "900000001"))
+CARDS = int(os.getenv("BENCH_CARDS", "200"))
+ITERATIONS = int(os.getenv("BENCH_ITERATIONS", "300"))
+CONCURRENCY = int(os.getenv("BENCH_CONCURRENCY", "1"))
+
+
+async def seed(repository) -> str:
+    """Создает пользователя и карты для замеров, возвращает id пользователя"""
+    user, _ = await repository.upsert_user({"telegram_id": TELEGRAM_ID, "username": "bench"})
+    existing = await repository.list_cards(user["id"], projection='user_id')
+    missing = CARDS - len(existing)
+    if missing > 0:
+        await repository.create_cards([
+            {"user_id": user["id"], "title": f"Карта {index}", "card_type": "task", "priority": index % 5 + 1}
+            for index in range(missing)
+        ])
+    return user["id"]
+
+
+def operations(repository, user_id: str) -> dict:
+    """Операции, которые выполняют горячие эндпоинты"""
+    return {
+        "get_user_id": lambda: repository.get_user_id(TELEGRAM_ID),
+        "get_user_counters": lambda: repository.get_user_counters(user_id),
+        "list_cards(50)": lambda: repository.list_cards(user_id, limit=50),
+        "list_cards(все)": lambda: repository.list_cards(user_id),
+        "get_user_snapshot(50)": lambda: repository.get_user_snapshot(TELEGRAM_ID, limit=50),
+        "complete_daily_action": lambda: repository.complete_daily_action(user_id, date.today()),
+    }
+
+
+async def measure(call) -> list:
+    """Выполняет ITERATIONS вызовов по CONCURRENCY одновременно, возвращает задержки"""
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            await call()
+            latencies.append(time.perf_counter() - started)
+
+    await asyncio.gather(*(one() for _ in range(ITERATIONS)))
+    latencies.sort()
+    return latencies
+
+
+def summary(latencies: list) -> str:
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    return f"p50 {statistics.median(latencies) * 1000:6.2f} мс  p95 {p95 * 1000:6.2f} мс"
+
+
+async def main():
+    if not DATABASE_URL:
+        raise SystemExit("Нужен DATABASE_URL (и SUPABASE_URL для сравнения с PostgREST)")
+
+    backends = {"asyncpg": PostgresRepository(DATABASE_URL, max_connections=max(CONCURRENCY, 2))}
+    if SUPABASE_URL:
+        backends["postgrest"] = SupabaseRepository(SUPABASE_URL, SUPABASE_KEY, max_connections=max(CONCURRENCY, 2))
+
+    print(f"Вызовов на операцию: {ITERATIONS}, конкурентность: {CONCURRENCY}, карт: {CARDS}")
+    try:
+        user_id = await seed(backends["asyncpg"])
+        results = {}
+        for name, repository in backends.items():
+            ops = operations(repository, user_id)
+            # Прогрев: соединения, подготовленные запросы, кэш схемы
+            for call in ops.values():
+                await call()
+            for operation, call in ops.items():
+                results[(operation, name)] = await measure(call)
+
+        for operation in operations(backends["asyncpg"], user_id):
+            row = f"{operation:<24}"
+            for name in backends:
+                row += f"  {name}: {summary(results[(operation, name)])}"
+            if "postgrest" in backends:
+                ratio = statistics.median(results[(operation, "postgrest")]) / statistics.median(results[(operation, "asyncpg")])
+                row += f"  x{ratio:4.1f}"
+            print(row)
+    finally:
+        for repository in backends.values():
+            await repository.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
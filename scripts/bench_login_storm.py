@@ -0,0 +1,118 @@
+"""
+Бенчмарк входа при всплеске открытий Mini App (например, после рассылки)
+
+BENCH_USERS пользователей одновременно открывают приложение, у BENCH_CHANGED_PERCENT
+процентов из них изменилась аватарка. Сравнивает старую регистрацию (SELECT по
+telegram_id, сравнение в Python, затем UPDATE или INSERT) с функцией upsert_user.
+
+Создает и изменяет пользователей с telegram_id начиная с BENCH_TELEGRAM_ID_BASE:
+используйте тестовую базу.
+
+Запуск:
+    SUPABASE_URL=... SUPABASE_KEY=... python scripts/bench_login_storm.py
+"""
+
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from dotenv import load_dotenv
+
+from repository import SupabaseRepository
+
+load_dotenv()
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+TELEGRAM_ID_BASE = int(os.getenv("BENCH_TELEGRAM_ID_BASE", "900000000"))
+USERS = int(os.getenv("BENCH_USERS", "500"))
+CONCURRENCY = int(os.getenv("BENCH_CONCURRENCY", "100"))
+CHANGED_PERCENT = int(os.getenv("BENCH_CHANGED_PERCENT", "10"))
+
+
+def make_profiles(round_number: int) -> list:
+    """Профили Telegram для одного всплеска входов"""
+    profiles = []
+    for index in range(USERS):
+        changed = random.randrange(100) < CHANGED_PERCENT
+        profiles.append({
+            "telegram_id": TELEGRAM_ID_BASE + index,
+            "username": f"bench_{index}",
+            "first_name": "Bench",
+            "last_name": None,
+            "photo_url": f"https://t.me/i/{index}-{round_number if changed else 0}.jpg"
+        })
+    return profiles
+
+
+async def login_in_steps(repository, profile):
+    """Старая реализация /register: до трех запросов"""
+    user = await repository.get_user_by_telegram_id(profile["telegram_id"])
+    if not user:
+        return await repository.create_user(profile)
+
+    update_data = {
+        column: value for column, value in profile.items()
+        if column != "telegram_id" and value and value != user.get(column)
+    }
+    if update_data:
+        update_data["updated_at"] = datetime.now().isoformat()
+        user = await repository.update_user(user["id"], update_data)
+    return user
+
+
+async def login_upsert(repository, profile):
+    """Новая реализация /register: один запрос"""
+    return await repository.upsert_user(profile)
+
+
+async def run(name, repository, login, profiles):
+    """Запускает вход всех профилей с ограничением CONCURRENCY и печатает результат"""
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    latencies = []
+
+    async def one(profile):
+        async with semaphore:
+            started = time.perf_counter()
+            await login(repository, profile)
+            latencies.append(time.perf_counter() - started)
+
+    requests_before = repository.stats['requests']
+    started = time.perf_counter()
+    await asyncio.gather(*(one(profile) for profile in profiles))
+    elapsed = time.perf_counter() - started
+    requests_made = repository.stats['requests'] - requests_before
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(
+        f"{name:<14} {len(profiles) / elapsed:8.1f} входов/с   "
+        f"p50 {statistics.median(latencies) * 1000:7.1f} мс   p95 {p95 * 1000:7.1f} мс   "
+        f"запросов к базе {requests_made / len(profiles):4.2f} на вход"
+    )
+
+
+async def main():
+    if not SUPABASE_URL or not SUPABASE_KEY:
+        raise SystemExit("Нужны SUPABASE_URL и SUPABASE_KEY")
+
+    print(f"Пользователей: {USERS}, конкурентность: {CONCURRENCY}, изменили профиль: {CHANGED_PERCENT}%")
+
+    repository = SupabaseRepository(SUPABASE_URL, SUPABASE_KEY, max_connections=CONCURRENCY)
+    try:
+        # Первый проход создает пользователей, чтобы дальше сравнивать повторные входы
+        await run("первый вход", repository, login_upsert, make_profiles(0))
+        await run("до (3 шага)", repository, login_in_steps, make_profiles(1))
+        await run("после (upsert)", repository, login_upsert, make_profiles(2))
+    finally:
+        await repository.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
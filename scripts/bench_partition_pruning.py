@@ -0,0 +1,182 @@
+"""
+Бенчмарк секционирования daily_actions: обычная таблица против секций по годам
+
+Создает во временной схеме bench_partitioning две таблицы с одинаковыми данными
+(BENCH_USERS пользователей по одному действию в день за BENCH_DAYS дней, по умолчанию
+5000 x 2000 = 10 млн строк): обычную, как daily_actions до секционирования, и
+секционированную по годам action_date, как в config/database_schema.sql. Для запросов
+за последние N дней (их делает личный менеджер, /ai/manager/*) и постраничной выдачи
+печатает p50, число прочитанных буферов и секций: в секционированной таблице Postgres
+читает только секции нужных лет. Время копирования в секционированную таблицу дает
+оценку окна для config/migrate_daily_actions_partitioning.sql.
+
+Схема удаляется после замеров (BENCH_KEEP=1 - оставить). Нужны пакет asyncpg
+и несколько гигабайт свободного места; используйте тестовую базу.
+
+Запуск:
+    DATABASE_URL=postgresql://... python scripts/bench_partition_pruning.py
+"""
+
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from datetime import date, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from dotenv import load_dotenv
+
+from repository import PROJECTIONS
+
+load_dotenv()
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+USERS = int(os.getenv("BENCH_USERS", "5000"))
+DAYS = int(os.getenv("BENCH_DAYS", "2000"))
+ITERATIONS = int(os.getenv("BENCH_ITERATIONS", "200"))
+KEEP = os.getenv("BENCH_KEEP") == "1"
+
+SCHEMA = "bench_partitioning"
+COLUMNS = PROJECTIONS['daily_action']
+TABLES = ("plain", "partitioned")
+
+# (название, запрос с {table}, параметры: "user_id" или число дней назад для даты).
+# Последние N дней ограничены с двух сторон (до завтрашнего дня), как в get_user_data_internal:
+# с открытой верхней границей Postgres читал бы еще секцию следующего года и секцию по умолчанию
+QUERIES = [
+    ("последние 7 дней",
+     f"SELECT {COLUMNS} FROM {SCHEMA}.{{table}} WHERE user_id = $1 AND action_date >= $2 AND action_date < $3 "
+     "ORDER BY action_date DESC",
+     ("user_id", 7, -1)),
+    ("последние 30 дней",
+     f"SELECT {COLUMNS} FROM {SCHEMA}.{{table}} WHERE user_id = $1 AND action_date >= $2 AND action_date < $3 "
+     "ORDER BY action_date DESC",
+     ("user_id", 30, -1)),
+    ("страница по курсору",
+     f"SELECT {COLUMNS} FROM {SCHEMA}.{{table}} WHERE user_id = $1 AND action_date < $2 "
+     "ORDER BY action_date DESC LIMIT 21",
+     ("user_id", 400)),
+    ("активность всех за 30 дней",
+     f"SELECT count(*) FROM {SCHEMA}.{{table}} WHERE action_date >= $1 AND action_date < $2",
+     (30, -1)),
+]
+
+
+def plan_nodes(node: dict):
+    """Все узлы плана EXPLAIN (FORMAT JSON)"""
+    yield node
+    for child in node.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+async def create_tables(connection, first_year: int, last_year: int):
+    """Обычная и секционированная таблицы; индексы создаются после загрузки данных"""
+    await connection.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+    await connection.execute(f"CREATE SCHEMA {SCHEMA}")
+    await connection.execute(
+        f"CREATE TABLE {SCHEMA}.plain (id UUID NOT NULL, user_id UUID NOT NULL, "
+        "action_date DATE NOT NULL, created_at TIMESTAMPTZ)"
+    )
+    await connection.execute(
+        f"CREATE TABLE {SCHEMA}.partitioned (id UUID NOT NULL, user_id UUID NOT NULL, "
+        "action_date DATE NOT NULL, created_at TIMESTAMPTZ) PARTITION BY RANGE (action_date)"
+    )
+    for year in range(first_year, last_year + 1):
+        await connection.execute(
+            f"CREATE TABLE {SCHEMA}.partitioned_{year} PARTITION OF {SCHEMA}.partitioned "
+            f"FOR VALUES FROM ('{year}-01-01') TO ('{year + 1}-01-01')"
+        )
+    await connection.execute(f"CREATE TABLE {SCHEMA}.partitioned_default PARTITION OF {SCHEMA}.partitioned DEFAULT")
+
+
+async def create_indexes(connection, table: str):
+    """Первичный ключ и idx_daily_actions_user_date, как в схеме"""
+    await connection.execute(f"ALTER TABLE {SCHEMA}.{table} ADD PRIMARY KEY (id, action_date)")
+    await connection.execute(f"CREATE UNIQUE INDEX ON {SCHEMA}.{table} (user_id, action_date)")
+
+
+async def load(connection) -> float:
+    """Заполняет таблицы, возвращает время копирования в секционированную таблицу"""
+    started = time.perf_counter()
+    await connection.execute(
+        f"INSERT INTO {SCHEMA}.plain "
+        "SELECT gen_random_uuid(), u.id, current_date - d, now() - d * interval '1 day' "
+        "FROM (SELECT gen_random_uuid() AS id FROM generate_series(1, $1::integer)) u, "
+        "generate_series(0, $2::integer - 1) d",
+        USERS, DAYS
+    )
+    await create_indexes(connection, "plain")
+    print(f"Обычная таблица: {USERS * DAYS:,} строк за {time.perf_counter() - started:.1f} с")
+
+    # Как в миграции: копирование, затем индексы
+    started = time.perf_counter()
+    await connection.execute(f"INSERT INTO {SCHEMA}.partitioned SELECT * FROM {SCHEMA}.plain")
+    await create_indexes(connection, "partitioned")
+    copy_seconds = time.perf_counter() - started
+
+    for table in TABLES:
+        await connection.execute(f"VACUUM ANALYZE {SCHEMA}.{table}")
+    return copy_seconds
+
+
+def arguments(params: tuple, user_id) -> list:
+    return [user_id if param == "user_id" else date.today() - timedelta(days=param) for param in params]
+
+
+async def explain(connection, query: str, args: list) -> dict:
+    """Буферы и секции по EXPLAIN (ANALYZE, BUFFERS)"""
+    plan = json.loads(await connection.fetchval(f"EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) {query}", *args))[0]["Plan"]
+    nodes = list(plan_nodes(plan))
+    return {
+        "buffers": plan.get("Shared Hit Blocks", 0) + plan.get("Shared Read Blocks", 0),
+        "relations": len({node["Relation Name"] for node in nodes if "Relation Name" in node}),
+    }
+
+
+async def measure(connection, query: str, args: list) -> float:
+    """p50 подготовленного запроса: после пяти выполнений Postgres может перейти на общий план,
+    в котором лишние секции отсекаются во время выполнения"""
+    statement = await connection.prepare(query)
+    latencies = []
+    for _ in range(ITERATIONS):
+        started = time.perf_counter()
+        await statement.fetch(*args)
+        latencies.append(time.perf_counter() - started)
+    return statistics.median(latencies)
+
+
+async def main():
+    if not DATABASE_URL:
+        raise SystemExit("Нужен DATABASE_URL")
+    try:
+        import asyncpg
+    except ImportError:
+        raise SystemExit("Нужен пакет asyncpg: pip install asyncpg")
+
+    connection = await asyncpg.connect(DATABASE_URL, command_timeout=3600)
+    try:
+        first_day = date.today() - timedelta(days=DAYS - 1)
+        await create_tables(connection, first_day.year, date.today().year + 1)
+        copy_seconds = await load(connection)
+        print(f"Копирование в секции с индексами: {copy_seconds:.1f} с")
+
+        user_id = await connection.fetchval(f"SELECT user_id FROM {SCHEMA}.plain LIMIT 1")
+        print(f"{'запрос':<28}{'таблица':<14}{'p50':>10}{'буферов':>10}{'таблиц/секций':>15}")
+        for name, query, params in QUERIES:
+            args = arguments(params, user_id)
+            for table in TABLES:
+                sql = query.format(table=table)
+                plan = await explain(connection, sql, args)
+                p50 = await measure(connection, sql, args)
+                print(f"{name:<28}{table:<14}{p50 * 1000:>8.2f}мс{plan['buffers']:>10}{plan['relations']:>15}")
+    finally:
+        if not KEEP:
+            await connection.execute(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE")
+        await connection.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+"""
+Бенчмарк проекций колонок: объем ответа и время разбора JSON
+
+Генерирует карты пользователя с тегами и metadata, как их возвращает PostgREST,
+и сравнивает полную строку (select="*") с узкими проекциями из repository.PROJECTIONS.
+
+Запуск:
+    python scripts/bench_projections.py [количество_карт ...]
+"""
+
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from repository import PROJECTIONS
+
+REPEATS = 20
+
+
+def make_card(user_id: str, index: int) -> dict:
+    """Создает карту, похожую на реальные данные приложения"""
+    created = datetime.now(timezone.utc) - timedelta(minutes=index)
+    return {
+        "id": str(uuid.uuid4()),
+        "user_id": user_id,
+        "title": f"Шаг {index}: прочитать главу и сделать конспект",
+        "description": "Описание шага с подробностями о том, что нужно сделать и зачем. " * 3,
+        "card_type": random.choice(["goal", "habit", "task", "note", "milestone"]),
+        "status": random.choice(["active", "completed", "archived", "deleted"]),
+        "priority": random.randint(1, 5),
+        "due_date": (created.date() + timedelta(days=30)).isoformat(),
+        "tags": ["учеба", "чтение", f"неделя-{index % 52}"],
+        "metadata": {
+            "period": index % 12,
+            "step_index": index,
+            "map_position": {"x": random.random(), "y": random.random()},
+            "ai_advice": "Совет личного менеджера по этому этапу пути. " * 4,
+            "subtasks": [{"title": f"Подзадача {i}", "done": bool(i % 2)} for i in range(5)]
+        },
+        "created_at": created.isoformat(),
+        "updated_at": created.isoformat()
+    }
+
+
+def project(rows: list, projection: str) -> list:
+    """Оставляет в строках только колонки проекции, как это сделал бы PostgREST"""
+    columns = PROJECTIONS[projection].split(",")
+    return [{column: row[column] for column in columns} for row in rows]
+
+
+def measure(payload: bytes) -> float:
+    """Среднее время json.loads в миллисекундах"""
+    started = time.perf_counter()
+    for _ in range(REPEATS):
+        json.loads(payload)
+    return (time.perf_counter() - started) / REPEATS * 1000
+
+
+def main():
+    sizes = [int(arg) for arg in sys.argv[1:]] or [1000, 5000, 10000]
+    user_id = str(uuid.uuid4())
+
+    print(f"{'карт':>7}  {'проекция':<12} {'байт':>12} {'разбор, мс':>11} {'экономия':>9}")
+    for size in sizes:
+        rows = [make_card(user_id, i) for i in range(size)]
+        full = json.dumps(rows, ensure_ascii=False).encode()
+        full_time = measure(full)
+        print(f"{size:>7}  {'*':<12} {len(full):>12,} {full_time:>11.2f} {'':>9}")
+
+        for projection in ("card_stats", "card_owner"):
+            payload = json.dumps(project(rows, projection), ensure_ascii=False).encode()
+            saved = (1 - len(payload) / len(full)) * 100
+            print(f"{'':>7}  {projection:<12} {len(payload):>12,} {measure(payload):>11.2f} {saved:>8.1f}%")
+
+
+if __name__ == "__main__":
+    main()
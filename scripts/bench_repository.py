@@ -0,0 +1,100 @@
+"""
+Бенчмарк пропускной способности при конкурентных запросах
+
+Сравнивает старый путь (синхронный клиент supabase внутри async-обработчика,
+блокирующий event loop) с асинхронным репозиторием на общем пуле соединений.
+Каждый "запрос" повторяет работу /users/{telegram_id}/data: users, goals,
+daily_actions и cards.
+
+Запуск:
+    SUPABASE_URL=... SUPABASE_KEY=... BENCH_TELEGRAM_ID=123 python scripts/bench_repository.py
+"""
+
+import asyncio
+import os
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "backend"))
+
+from dotenv import load_dotenv
+
+from repository import SupabaseRepository
+
+load_dotenv()
+
+SUPABASE_URL = os.getenv("SUPABASE_URL")
+SUPABASE_KEY = os.getenv("SUPABASE_KEY")
+TELEGRAM_ID = int(os.getenv("BENCH_TELEGRAM_ID", "0"))
+CONCURRENCY = int(os.getenv("BENCH_CONCURRENCY", "50"))
+REQUESTS = int(os.getenv("BENCH_REQUESTS", "200"))
+
+
+async def blocking_user_data(client):
+    """Старая реализация: синхронные вызовы прямо в корутине"""
+    user = client.table("users").select("*").eq("telegram_id", TELEGRAM_ID).execute()
+    if not user.data:
+        return
+    user_id = user.data[0]["id"]
+    client.table("goals").select("*").eq("user_id", user_id).execute()
+    client.table("daily_actions").select("*").eq("user_id", user_id).order("action_date", desc=True).execute()
+    client.table("cards").select("*").eq("user_id", user_id).execute()
+
+
+async def async_user_data(repository):
+    """Новая реализация: неблокирующие запросы через репозиторий"""
+    user = await repository.get_user_by_telegram_id(TELEGRAM_ID)
+    if not user:
+        return
+    user_id = user["id"]
+    await repository.list_goals(user_id)
+    await repository.list_daily_actions(user_id)
+    await repository.list_cards(user_id)
+
+
+async def run(name, make_request):
+    """Запускает REQUESTS запросов с ограничением CONCURRENCY и печатает результат"""
+    semaphore = asyncio.Semaphore(CONCURRENCY)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            started = time.perf_counter()
+            await make_request()
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(REQUESTS)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    p95 = latencies[int(len(latencies) * 0.95) - 1]
+    print(
+        f"{name:<12} {REQUESTS / elapsed:8.1f} req/s   "
+        f"p50 {statistics.median(latencies) * 1000:7.1f} мс   p95 {p95 * 1000:7.1f} мс   "
+        f"всего {elapsed:6.2f} с"
+    )
+
+
+async def main():
+    if not SUPABASE_URL or not SUPABASE_KEY or not TELEGRAM_ID:
+        raise SystemExit("Нужны SUPABASE_URL, SUPABASE_KEY и BENCH_TELEGRAM_ID")
+
+    print(f"Запросов: {REQUESTS}, конкурентность: {CONCURRENCY}")
+
+    from supabase import create_client
+    client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    await run("до (sync)", lambda: blocking_user_data(client))
+
+    repository = SupabaseRepository(SUPABASE_URL, SUPABASE_KEY, max_connections=CONCURRENCY)
+    try:
+        # Прогреваем пул, чтобы не учитывать установку TLS-соединений
+        await async_user_data(repository)
+        await run("после (async)", lambda: async_user_data(repository))
+    finally:
+        await repository.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,10 @@
+"""
+Общие настройки тестов
+
+Модули бэкенда импортируются так же, как при запуске сервера из backend/.
+"""
+
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "backend"))
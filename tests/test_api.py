@@ -0,0 +1,201 @@
+"""
+Тесты HTTP API на хранилище в памяти
+
+Сервер запускается через TestClient с DATA_BACKEND=memory и CACHE_BACKEND=memory,
+база и внешние сервисы не нужны. Проверяются условные запросы (ETag и 304),
+синхронизация изменений (/changes), страницы по курсорам, поиск по картам и
+проверка пакетных запросов. У каждого теста свой telegram_id.
+"""
+
+import os
+import uuid
+
+import pytest
+
+os.environ["DATA_BACKEND"] = "memory"
+os.environ["CACHE_BACKEND"] = "memory"
+
+from fastapi.testclient import TestClient
+
+import main
+
+
+@pytest.fixture(scope="module")
+def client():
+    with TestClient(main.app) as client:
+        yield client
+
+
+def create_user(client, telegram_id: int, cards=None) -> dict:
+    """Регистрирует пользователя и создает ему карты; возвращает данные пользователя"""
+    response = client.post("/register", json={"telegram_id": telegram_id, "username": f"user{telegram_id}"})
+    assert response.status_code == 200
+    if cards:
+        response = client.post("/cards", json={"telegram_id": telegram_id, "cards": cards})
+        assert response.status_code == 200
+    return client.get(f"/users/{telegram_id}/data").json()
+
+
+def test_user_data_not_modified(client):
+    create_user(client, 1001, cards=[{"title": "Карта", "card_type": "task"}])
+
+    first = client.get("/users/1001/data")
+    etag = first.headers["etag"]
+    assert first.status_code == 200
+
+    again = client.get("/users/1001/data", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+    assert again.headers["etag"] == etag
+    assert again.content == b""
+
+    # После записи данные изменились: старый ETag больше не совпадает
+    assert client.post("/actions/complete", json={"telegram_id": 1001}).status_code == 200
+    changed = client.get("/users/1001/data", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert len(changed.json()["daily_actions"]) == 1
+
+
+def test_cards_not_modified(client):
+    create_user(client, 1002, cards=[{"title": "Карта", "card_type": "task"}])
+
+    first = client.get("/cards/1002")
+    again = client.get("/cards/1002", headers={"If-None-Match": first.headers["etag"]})
+    assert again.status_code == 304
+
+
+def test_changes_since_watermark(client):
+    data = create_user(client, 1003, cards=[{"title": "Старая", "card_type": "task"}])
+    old_card = data["cards"][0]["id"]
+
+    initial = client.get("/users/1003/changes", params={"since": "2000-01-01T00:00:00Z"})
+    assert initial.status_code == 200
+    assert [card["id"] for card in initial.json()["cards"]] == [old_card]
+    watermark = initial.json()["watermark"]
+
+    client.post("/cards", json={"telegram_id": 1003, "cards": [{"title": "Новая", "card_type": "task"}]})
+    assert client.delete(f"/cards/{old_card}").status_code == 200
+
+    changes = client.get("/users/1003/changes", params={"since": watermark}).json()
+    assert "Новая" in [card["title"] for card in changes["cards"]]
+    assert old_card in [tombstone["id"] for tombstone in changes["deleted_cards"]]
+    assert old_card not in [card["id"] for card in changes["cards"]]
+
+
+def test_changes_validation(client):
+    assert client.get("/users/1004/changes", params={"since": "вчера"}).status_code == 400
+    assert client.get("/users/1004/changes", params={"since": "2000-01-01T00:00:00Z"}).status_code == 404
+
+
+def test_cards_keyset_pages(client):
+    create_user(client, 1005, cards=[{"title": f"Карта {i}", "card_type": "task"} for i in range(5)])
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 2}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/cards/1005", params=params)
+        assert response.status_code == 200
+        assert len(response.json()) <= 2
+        seen += [card["id"] for card in response.json()]
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            break
+
+    all_cards = [card["id"] for card in client.get("/cards/1005").json()]
+    assert seen == all_cards
+    assert len(set(seen)) == 5
+
+    assert client.get("/cards/1005", params={"limit": 2, "cursor": "не-курсор"}).status_code == 400
+
+
+def test_user_data_keyset_pages(client):
+    create_user(client, 1006, cards=[{"title": f"Карта {i}", "card_type": "task"} for i in range(3)])
+
+    first = client.get("/users/1006/data", params={"limit": 2}).json()
+    assert len(first["cards"]) == 2
+    cursor = first["next_cursors"]["cards"]
+    assert cursor
+
+    second = client.get("/users/1006/data", params={"limit": 2, "cards_cursor": cursor}).json()
+    assert len(second["cards"]) == 1
+    assert "cards" not in second["next_cursors"]
+    assert not {card["id"] for card in first["cards"]} & {card["id"] for card in second["cards"]}
+
+
+def test_search_cards(client):
+    cards = [
+        {"title": "Бегать по утрам", "description": "Пробежка 5 км", "card_type": "habit"},
+        {"title": "Выучить английский", "card_type": "goal"},
+        {"title": "Бег в парке", "description": "бегаем вместе", "card_type": "task"},
+    ] + [{"title": f"Бег {i}", "card_type": "task"} for i in range(4)]
+    create_user(client, 1007, cards=cards)
+
+    found = client.get("/cards/1007/search", params={"q": "бег"})
+    assert found.status_code == 200
+    titles = [card["title"] for card in found.json()]
+    assert "Выучить английский" not in titles
+    assert len(titles) == 6
+
+    seen, cursor = [], None
+    while True:
+        params = {"q": "бег", "limit": 4}
+        if cursor:
+            params["cursor"] = cursor
+        response = client.get("/cards/1007/search", params=params)
+        seen += [card["id"] for card in response.json()]
+        cursor = response.headers.get("x-next-cursor")
+        if not cursor:
+            break
+    assert len(seen) == len(set(seen)) == 6
+
+    # Удаленные карты не ищутся
+    assert client.delete(f"/cards/{seen[0]}").status_code == 200
+    found = client.get("/cards/1007/search", params={"q": "бег"}).json()
+    assert seen[0] not in [card["id"] for card in found]
+
+    assert client.get("/cards/1007/search", params={"q": "  "}).status_code == 400
+    assert client.get("/cards/1007/search", params={"q": "бег", "cursor": "xx"}).status_code == 400
+    assert client.get("/cards/1999/search", params={"q": "бег"}).status_code == 404
+
+
+def test_cards_batch_validation(client):
+    data = create_user(client, 1008, cards=[{"title": "Карта", "card_type": "task"}])
+    card_id = data["cards"][0]["id"]
+
+    def batch(items):
+        return client.patch("/cards/batch", json={"telegram_id": 1008, "items": items})
+
+    assert batch([]).status_code == 400
+    assert batch([{"id": "not-a-uuid", "priority": 1}]).status_code == 400
+    assert batch([{"id": card_id}]).status_code == 400
+    assert batch([{"id": card_id, "priority": 1}, {"id": card_id.upper(), "priority": 2}]).status_code == 400
+
+    missing = str(uuid.uuid4())
+    response = batch([{"id": card_id, "priority": 2}, {"id": missing, "delete": True}])
+    assert response.status_code == 200
+    assert [result["status"] for result in response.json()["results"]] == ["updated", "not_found"]
+
+
+def test_goals_batch_validation(client):
+    create_user(client, 1009)
+    client.post("/goals", json={"telegram_id": 1009, "goals": [{"goal_type": "health", "description": "Бег"}]})
+    goal_id = client.get("/users/1009/data").json()["goals"][0]["id"]
+
+    def batch(items):
+        return client.patch("/goals/batch", json={"telegram_id": 1009, "items": items})
+
+    assert batch([]).status_code == 400
+    assert batch([{"id": "not-a-uuid", "is_completed": True}]).status_code == 400
+
+    response = batch([{"id": goal_id, "is_completed": True}, {"id": str(uuid.uuid4()), "description": "x"}])
+    assert response.status_code == 200
+    assert response.json()["completed"] == 1
+    assert [result["status"] for result in response.json()["results"]] == ["updated", "not_found"]
+
+
+def test_card_id_validation(client):
+    assert client.put("/cards/not-a-uuid", json={"title": "x"}).status_code == 400
+    assert client.delete("/cards/not-a-uuid").status_code == 400
+    assert client.delete(f"/cards/{uuid.uuid4()}").status_code == 404
@@ -0,0 +1,155 @@
+"""
+Тесты общего кэша на хранилище SQLite
+
+Работают без сети и внешних сервисов: файл базы создается во временной папке.
+"""
+
+import asyncio
+import time
+
+import pytest
+
+from cache import SQLiteBackend, TTLCache, Counters, ResponseCache
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = SQLiteBackend(str(tmp_path / "cache.sqlite3"))
+    yield backend
+    asyncio.run(backend.close())
+
+
+def test_set_get_and_get_many(backend):
+    async def scenario():
+        await backend.set("a", b"1")
+        await backend.set("b", b"2", ttl=60)
+        assert await backend.get("a") == b"1"
+        assert await backend.get("missing") is None
+        assert await backend.get_many(["a", "missing", "b"]) == [b"1", None, b"2"]
+        assert await backend.get_many([]) == []
+
+    asyncio.run(scenario())
+    assert backend.get_stats()['errors'] == 0
+
+
+def test_ttl_expiry(backend):
+    async def scenario():
+        await backend.set("short", b"x", ttl=0.1)
+        assert await backend.get("short") == b"x"
+        await asyncio.sleep(0.2)
+        assert await backend.get("short") is None
+
+    asyncio.run(scenario())
+
+
+def test_incr_with_window(backend):
+    async def scenario():
+        assert await backend.incr("plain") == 1
+        assert await backend.incr("plain", 5) == 6
+
+        # Окно счетчика начинается с первого увеличения и не продлевается следующими
+        assert await backend.incr("window", ttl=0.2) == 1
+        assert await backend.incr("window", ttl=0.2) == 2
+        await asyncio.sleep(0.3)
+        assert await backend.incr("window", ttl=0.2) == 1
+
+    asyncio.run(scenario())
+
+
+def test_delete_and_clear_by_prefix(backend):
+    async def scenario():
+        for key in ("x:1", "x:2", "y:1"):
+            await backend.set(key, b"v")
+        await backend.delete("x:1")
+        assert await backend.get("x:1") is None
+
+        await backend.clear("x:")
+        assert await backend.get_many(["x:2", "y:1"]) == [None, b"v"]
+
+        await backend.clear()
+        assert await backend.get("y:1") is None
+
+    asyncio.run(scenario())
+
+
+def test_shared_between_connections(tmp_path):
+    """Запись через одно подключение видна другому, как другому процессу сервиса"""
+    path = str(tmp_path / "shared.sqlite3")
+    first, second = SQLiteBackend(path), SQLiteBackend(path)
+
+    async def scenario():
+        await first.set("k", b"v")
+        await first.incr("n", 2)
+        assert await second.get("k") == b"v"
+        assert await second.incr("n") == 3
+        await first.close()
+        await second.close()
+
+    asyncio.run(scenario())
+
+
+def test_concurrent_incr(backend):
+    """Параллельные увеличения из event loop не теряются и не блокируют друг друга"""
+    async def scenario():
+        await asyncio.gather(*(backend.incr("hits") for _ in range(200)))
+        return await backend.get("hits")
+
+    assert int(asyncio.run(scenario())) == 200
+
+
+def test_ttl_cache(backend):
+    cache = TTLCache(ttl=0.1, namespace="id", backend=backend)
+
+    async def scenario():
+        await cache.set(42, {"user_id": "u1"})
+        assert await cache.get(42) == {"user_id": "u1"}
+        await asyncio.sleep(0.2)
+        assert await cache.get(42) is None
+
+        await cache.set(7, "u7")
+        await cache.invalidate(7)
+        assert await cache.get(7) is None
+
+    asyncio.run(scenario())
+    assert cache.get_stats()['hits'] == 1
+    assert cache.get_stats()['misses'] == 2
+
+
+def test_counters(backend):
+    counters = Counters(['ok', 'failed'], namespace="stats", backend=backend)
+
+    async def scenario():
+        await counters.incr('ok')
+        await counters.incr('ok', 2)
+        assert await counters.get('ok') == 3
+        assert await counters.copy() == {'ok': 3, 'failed': 0}
+        await counters.reset()
+        assert await counters.copy() == {'ok': 0, 'failed': 0}
+
+    asyncio.run(scenario())
+
+
+def test_response_cache_invalidation(backend):
+    responses = ResponseCache(ttl=60, max_stale=60, backend=backend)
+
+    async def scenario():
+        started = responses.start_read()
+        await responses.set("u1", "page", b"body", {"ETag": '"1"'}, read_started=started, alias=5)
+        assert await responses.get("u1", "page") == (b"body", {"ETag": '"1"'})
+        assert await responses.has("u1", "page")
+        assert await responses.owner_of(5) == "u1"
+
+        await responses.invalidate("u1")
+        assert await responses.get("u1", "page") is None
+        stale = await responses.get_stale("u1", "page", 60, include_invalidated=True)
+        assert stale[:2] == (b"body", {"ETag": '"1"'})
+
+        # Ответ, прочитанный до инвалидации, не становится свежим
+        late = time.time() - 1
+        await responses.set("u1", "page", b"old", read_started=late)
+        assert await responses.get("u1", "page") is None
+
+        await responses.clear()
+        assert not await responses.has("u1", "page")
+
+    asyncio.run(scenario())
@@ -0,0 +1,114 @@
+"""
+Идемпотентность отметки ежедневного действия под конкурентной нагрузкой
+
+CALLS параллельных complete_daily_action для одного пользователя и одной даты
+(как при двойном нажатии в Mini App) должны оставить в daily_actions ровно одну
+строку за эту дату, вернуть created = True ровно одному вызову и сделать ровно
+один запрос к базе на вызов.
+
+По умолчанию проверяется MemoryRepository: его запросы ждут случайную задержку
+и перемешиваются, как параллельные запросы к базе. Вариант с Postgres запускается,
+если задан DATABASE_URL (нужен пакет asyncpg и база со схемой
+config/database_schema.sql); он создает тестового пользователя и удаляет его
+после проверки:
+    DATABASE_URL=postgresql://... python -m pytest tests/test_complete_action.py
+"""
+
+import asyncio
+import os
+from datetime import date, timedelta
+
+import pytest
+
+from memory_repository import MemoryRepository
+from repository import PostgresRepository
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+CALLS = 100
+TELEGRAM_ID = -424242
+
+
+async def cleanup_postgres():
+    """Удаляет тестового пользователя вместе с его данными (ON DELETE CASCADE)"""
+    import asyncpg
+
+    connection = await asyncpg.connect(DATABASE_URL)
+    try:
+        await connection.execute("DELETE FROM users WHERE telegram_id = $1", TELEGRAM_ID)
+    finally:
+        await connection.close()
+
+
+@pytest.fixture(params=["memory", "postgres"])
+def backend(request):
+    """Название хранилища; postgres пропускается без DATABASE_URL"""
+    if request.param == "postgres":
+        if not DATABASE_URL:
+            pytest.skip("Нужен DATABASE_URL с базой по схеме config/database_schema.sql")
+        pytest.importorskip("asyncpg")
+        asyncio.run(cleanup_postgres())
+        yield request.param
+        asyncio.run(cleanup_postgres())
+    else:
+        yield request.param
+
+
+def make_repository(backend: str):
+    if backend == "postgres":
+        return PostgresRepository(DATABASE_URL, max_connections=CALLS)
+    return MemoryRepository(latency=0.001, jitter=0.005)
+
+
+async def complete_in_parallel(repository, action_date: date):
+    """Создает пользователя и отмечает действие CALLS параллельными вызовами"""
+    user = await repository.create_user({"telegram_id": TELEGRAM_ID, "username": "complete_action_test"})
+    user_id = user["id"]
+
+    # Первый вызов за другую дату прогревает кэши (сигнатура функции в PostgresRepository),
+    # чтобы дальше считались только запросы самих отметок
+    await repository.complete_daily_action(user_id, action_date - timedelta(days=2))
+
+    requests_before = repository.stats['requests']
+    results = await asyncio.gather(*(
+        repository.complete_daily_action(user_id, action_date) for _ in range(CALLS)
+    ))
+    requests_made = repository.stats['requests'] - requests_before
+
+    rows = [
+        action for action in await repository.list_daily_actions(user_id)
+        if action['action_date'] == action_date.isoformat()
+    ]
+    return results, requests_made, rows
+
+
+def test_parallel_completions_create_one_row(backend):
+    async def scenario():
+        repository = make_repository(backend)
+        try:
+            return await complete_in_parallel(repository, date.today())
+        finally:
+            await repository.close()
+
+    results, requests_made, rows = asyncio.run(scenario())
+
+    assert len(rows) == 1
+    assert sum(1 for _, created in results if created) == 1
+    assert {action['id'] for action, _ in results} == {rows[0]['id']}
+    assert requests_made == CALLS
+
+
+def test_repeated_completion_is_not_created(backend):
+    async def scenario():
+        repository = make_repository(backend)
+        try:
+            user = await repository.create_user({"telegram_id": TELEGRAM_ID})
+            first, created = await repository.complete_daily_action(user["id"], date.today())
+            again, created_again = await repository.complete_daily_action(user["id"], date.today())
+            return first, created, again, created_again
+        finally:
+            await repository.close()
+
+    first, created, again, created_again = asyncio.run(scenario())
+
+    assert created and not created_again
+    assert again['id'] == first['id']
@@ -0,0 +1,268 @@
+"""
+Планы горячих запросов
+
+Для запросов, которые делают эндпоинты (в тех же формах фильтров и сортировок,
+что строит repository.py), проверяет, что план не читает таблицу целиком
+(Seq Scan) и использует ожидаемый индекс, а страница (LIMIT) в плане для
+конкретного пользователя читается в порядке индекса, без сортировки (Sort)
+всех его строк.
+
+Тест в одной транзакции создает тестовых пользователей с целями, действиями и
+картами в объеме, при котором планировщик сам выбирает индексы, выполняет ANALYZE
+и откатывает транзакцию: база после проверки не меняется. Настройки планировщика
+не меняются. Каждый запрос проверяется дважды через PREPARE / EXPLAIN EXECUTE:
+с планом для конкретных значений (custom) и с общим планом подготовленного запроса
+(generic), который asyncpg и PostgREST получают после нескольких выполнений.
+В секционированной таблице (daily_actions) план читает индексы секций: они считаются
+индексом родительской таблицы, из которого созданы.
+
+Запуск (нужен пакет asyncpg и база со схемой config/database_schema.sql);
+без DATABASE_URL тест пропускается:
+    DATABASE_URL=postgresql://... python -m pytest tests/test_query_plans.py
+"""
+
+import asyncio
+import json
+import os
+from datetime import date
+
+import pytest
+
+from repository import PROJECTIONS
+
+DATABASE_URL = os.getenv("DATABASE_URL")
+USERS = int(os.getenv("PLAN_CHECK_USERS", "200"))
+ROWS_PER_USER = int(os.getenv("PLAN_CHECK_ROWS_PER_USER", "300"))
+PAGE_SIZE = 21  # limit + 1, как в /users/{telegram_id}/data и /cards/{telegram_id}
+
+CARD_PAGE = f"SELECT {PROJECTIONS['card']} FROM cards WHERE user_id = $1 {{}} ORDER BY created_at DESC, id DESC"
+# Без фильтра по статусу list_cards не читает мягко удаленные карты
+LIVE = "AND status <> 'deleted'"
+
+
+def card_cursor(param: int) -> str:
+    """Условие keyset-курсора (created_at, id) с параметрами $param и $param+1, как в list_cards"""
+    return f"AND created_at <= ${param} AND (created_at < ${param} OR (created_at = ${param} AND id < ${param + 1}))"
+
+
+# (название, запрос, параметры, ожидаемый индекс)
+# Параметры - имена значений из sample(). Запросам, которые читают все строки
+# пользователя, подходит любой индекс по user_id: планировщик выбирает Bitmap Scan
+# по самому компактному из них и сортирует результат, это дешевле чтения
+# в порядке индекса, поэтому ожидаемого индекса у них нет.
+HOT_QUERIES = [
+    ("пользователь по telegram_id",
+     f"SELECT {PROJECTIONS['user_id']} FROM users WHERE telegram_id = $1",
+     ("telegram_id",), "users_telegram_id_key"),
+    ("версия данных (ETag)",
+     f"SELECT {PROJECTIONS['data_version']} FROM user_counters WHERE user_id = $1",
+     ("user_id",), "user_counters_pkey"),
+    ("цели пользователя",
+     f"SELECT {PROJECTIONS['goal']} FROM goals WHERE user_id = $1 ORDER BY created_at",
+     ("user_id",), None),
+    ("действия: страница",
+     f"SELECT {PROJECTIONS['daily_action']} FROM daily_actions WHERE user_id = $1 "
+     f"ORDER BY action_date DESC LIMIT {PAGE_SIZE}",
+     ("user_id",), "idx_daily_actions_user_date"),
+    ("действия: за дату",
+     f"SELECT {PROJECTIONS['daily_action']} FROM daily_actions WHERE user_id = $1 AND action_date = $2",
+     ("user_id", "today"), "idx_daily_actions_user_date"),
+    ("карты: все",
+     CARD_PAGE.format(LIVE),
+     ("user_id",), None),
+    ("карты: первая страница",
+     CARD_PAGE.format(LIVE) + f" LIMIT {PAGE_SIZE}",
+     ("user_id",), "idx_cards_user_created"),
+    ("карты: страница по курсору",
+     CARD_PAGE.format(f"{LIVE} {card_cursor(2)}") + f" LIMIT {PAGE_SIZE}",
+     ("user_id", "created_at", "card_id"), "idx_cards_user_created"),
+    ("карты: по статусу",
+     CARD_PAGE.format("AND status = $2") + f" LIMIT {PAGE_SIZE}",
+     ("user_id", "status"), "idx_cards_user_status_created"),
+    ("карты: по статусу, по курсору",
+     CARD_PAGE.format("AND status = $2 " + card_cursor(3)) + f" LIMIT {PAGE_SIZE}",
+     ("user_id", "status", "created_at", "card_id"), "idx_cards_user_status_created"),
+    ("карты: по типу",
+     CARD_PAGE.format(f"AND card_type = $2 {LIVE}") + f" LIMIT {PAGE_SIZE}",
+     ("user_id", "card_type"), "idx_cards_user_type_created"),
+    ("карты: по типу и статусу",
+     CARD_PAGE.format("AND card_type = $2 AND status = $3") + f" LIMIT {PAGE_SIZE}",
+     ("user_id", "card_type", "status"), None),
+    ("карта по id",
+     f"SELECT {PROJECTIONS['card_owner']} FROM cards WHERE id = $1",
+     ("card_id",), "cards_pkey"),
+    ("изменения: цели",
+     f"SELECT {PROJECTIONS['goal']} FROM goals WHERE user_id = $1 AND updated_at > $2 ORDER BY updated_at",
+     ("user_id", "since"), None),
+    ("изменения: карты",
+     f"SELECT {PROJECTIONS['card']} FROM cards WHERE user_id = $1 AND updated_at > $2 ORDER BY updated_at",
+     ("user_id", "since"), None),
+    ("изменения: действия",
+     f"SELECT {PROJECTIONS['daily_action']} FROM daily_actions WHERE user_id = $1 AND created_at > $2 "
+     "ORDER BY created_at",
+     ("user_id", "since"), None),
+    ("изменения: карты в архиве",
+     f"SELECT {PROJECTIONS['archived_card_tombstone']} FROM cards_archive WHERE user_id = $1 AND archived_at > $2 "
+     "ORDER BY archived_at",
+     ("user_id", "since"), None),
+    ("архив карт: страница",
+     f"SELECT {PROJECTIONS['archived_card']} FROM cards_archive WHERE user_id = $1 "
+     f"ORDER BY archived_at DESC, id DESC LIMIT {PAGE_SIZE}",
+     ("user_id",), "idx_cards_archive_user_archived"),
+    ("архивация: партия",
+     "SELECT id FROM cards WHERE (status = 'deleted' AND updated_at < $1) "
+     "OR (status = 'archived' AND updated_at < $1) ORDER BY updated_at LIMIT 1000",
+     ("since",), "idx_cards_archivable"),
+]
+
+# Строки пользователей перемешаны по времени (ORDER BY g DESC, u.id), как в рабочей
+# таблице, куда пишут все пользователи сразу. Общий план оценивает число строк по
+# среднему пользователю, поэтому строк у каждого столько, сколько у давнего
+# активного пользователя: на десятке строк планировщик справедливо предпочитает
+# Bitmap Scan с сортировкой. Действия - каждый третий день (серии прерываются),
+# за последние ROWS_PER_USER дней, и попадают в две секции daily_actions.
+SEED = [
+    "INSERT INTO users (telegram_id, username) "
+    "SELECT -g, 'plan_check_' || g FROM generate_series(1, $1::integer) g",
+    "INSERT INTO goals (user_id, goal_type, is_completed, created_at) "
+    "SELECT u.id, 'goal_' || (g % 4), g % 3 = 0, now() - g * interval '1 day' "
+    "FROM users u, generate_series(10, $1::integer, 10) g WHERE u.telegram_id < 0 "
+    "ORDER BY g DESC, u.id",
+    "INSERT INTO daily_actions (user_id, action_date, created_at) "
+    "SELECT u.id, current_date - g, now() - g * interval '1 day' "
+    "FROM users u, generate_series(3, $1::integer, 3) g WHERE u.telegram_id < 0 "
+    "ORDER BY g DESC, u.id",
+    # Больше половины карт - выполненные, архивные и удаленные, как у давних пользователей
+    "INSERT INTO cards (user_id, title, card_type, status, priority, created_at) "
+    "SELECT u.id, 'Карта ' || g, (ARRAY['goal', 'habit', 'task', 'note', 'milestone'])[1 + g % 5], "
+    "(ARRAY['active', 'completed', 'archived', 'deleted', 'deleted', 'completed'])[1 + g % 6], "
+    "1 + g % 5, now() - g * interval '1 hour' "
+    "FROM users u, generate_series(1, $1::integer) g WHERE u.telegram_id < 0 "
+    "ORDER BY g DESC, u.id",
+    "INSERT INTO cards_archive (id, user_id, title, card_type, status, created_at, updated_at, archived_at) "
+    "SELECT uuid_generate_v4(), u.id, 'Карта ' || g, 'task', 'deleted', "
+    "now() - g * interval '1 day', now() - g * interval '1 day', now() - g * interval '1 hour' "
+    "FROM users u, generate_series(1, $1::integer) g WHERE u.telegram_id < 0 "
+    "ORDER BY g DESC, u.id",
+]
+
+PLAN_MODES = ("force_custom_plan", "force_generic_plan")
+
+
+def plan_nodes(node: dict):
+    """Все узлы плана EXPLAIN (FORMAT JSON)"""
+    yield node
+    for child in node.get("Plans", []):
+        yield from plan_nodes(child)
+
+
+def describe(node: dict) -> str:
+    """Краткое описание узла: тип, индекс и таблица"""
+    text = node["Node Type"]
+    if "Index Name" in node:
+        text += f" using {node['Index Name']}"
+    if "Relation Name" in node:
+        text += f" on {node['Relation Name']}"
+    return text
+
+
+async def partition_indexes(connection) -> dict:
+    """Индексы секций -> индекс родительской таблицы, из которого они созданы"""
+    rows = await connection.fetch(
+        "SELECT child.relname AS child, parent.relname AS parent FROM pg_inherits i "
+        "JOIN pg_class child ON child.oid = i.inhrelid JOIN pg_class parent ON parent.oid = i.inhparent "
+        "WHERE child.relkind = 'i'"
+    )
+    return {row["child"]: row["parent"] for row in rows}
+
+
+async def empty_tables(connection) -> set:
+    """Таблицы и секции без строк: Seq Scan по ним ничего не читает"""
+    rows = await connection.fetch("SELECT relname FROM pg_class WHERE relkind = 'r' AND reltuples = 0")
+    return {row["relname"] for row in rows}
+
+
+async def seed(connection):
+    """Создает тестовые данные (внутри транзакции) и обновляет статистику"""
+    await connection.execute(SEED[0], USERS)
+    for query in SEED[1:]:
+        await connection.execute(query, ROWS_PER_USER)
+    await connection.execute("ANALYZE users, goals, daily_actions, cards, cards_archive, user_counters")
+
+
+async def sample(connection) -> dict:
+    """Значения параметров: тестовый пользователь и курсор второй страницы его карт"""
+    user = await connection.fetchrow("SELECT id, telegram_id FROM users WHERE telegram_id = -1")
+    card = await connection.fetchrow(
+        "SELECT id, created_at FROM cards WHERE user_id = $1 ORDER BY created_at DESC, id DESC OFFSET $2 LIMIT 1",
+        user["id"], PAGE_SIZE - 2
+    )
+    return {
+        "user_id": user["id"],
+        "telegram_id": user["telegram_id"],
+        "card_id": card["id"],
+        "created_at": card["created_at"],
+        "status": "active",
+        "card_type": "task",
+        "today": date.today(),
+        "since": card["created_at"],
+    }
+
+
+async def explain(connection, query: str, args: tuple, plan_mode: str) -> dict:
+    """План подготовленного запроса в режиме plan_cache_mode = plan_mode"""
+    await connection.execute(f"SET LOCAL plan_cache_mode = {plan_mode}")
+    await connection.execute(f"PREPARE plan_check AS {query}")
+    try:
+        # EXECUTE не принимает параметры протокола: значения передаются литералами,
+        # а типы им задает подготовленный запрос
+        literals = ", ".join("'" + str(value).replace("'", "''") + "'" for value in args)
+        return json.loads(await connection.fetchval(
+            f"EXPLAIN (FORMAT JSON) EXECUTE plan_check({literals})"
+        ))[0]["Plan"]
+    finally:
+        await connection.execute("DEALLOCATE plan_check")
+
+
+@pytest.fixture(scope="module")
+def database():
+    """Подключение с тестовыми данными в транзакции, которая откатывается после тестов"""
+    if not DATABASE_URL:
+        pytest.skip("Нужен DATABASE_URL с базой по схеме config/database_schema.sql")
+    asyncpg = pytest.importorskip("asyncpg")
+
+    loop = asyncio.new_event_loop()
+    connection = loop.run_until_complete(asyncpg.connect(DATABASE_URL))
+    transaction = connection.transaction()
+    loop.run_until_complete(transaction.start())
+    try:
+        loop.run_until_complete(seed(connection))
+        values = loop.run_until_complete(sample(connection))
+        parents = loop.run_until_complete(partition_indexes(connection))
+        empty = loop.run_until_complete(empty_tables(connection))
+        yield loop, connection, values, parents, empty
+    finally:
+        loop.run_until_complete(transaction.rollback())
+        loop.run_until_complete(connection.close())
+        loop.close()
+
+
+@pytest.mark.parametrize("plan_mode", PLAN_MODES, ids=("custom", "generic"))
+@pytest.mark.parametrize("name, query, params, expected_index", HOT_QUERIES, ids=[q[0] for q in HOT_QUERIES])
+def test_query_plan(database, plan_mode, name, query, params, expected_index):
+    loop, connection, values, parents, empty = database
+    plan = loop.run_until_complete(explain(connection, query, tuple(values[param] for param in params), plan_mode))
+
+    nodes = list(plan_nodes(plan))
+    problems = [describe(node) for node in nodes
+                if node["Node Type"] == "Seq Scan" and node["Relation Name"] not in empty]
+    # Общий план оценивает число строк по среднему пользователю и может отсортировать
+    # оставшиеся после курсора десятки строк; план для конкретных значений видит
+    # всю историю пользователя и обязан читать страницу в порядке индекса
+    if expected_index and "LIMIT" in query and plan_mode == "force_custom_plan":
+        problems += [describe(node) for node in nodes if node["Node Type"] in ("Sort", "Incremental Sort")]
+    indexes = {parents.get(node["Index Name"], node["Index Name"]) for node in nodes if "Index Name" in node}
+    if expected_index and expected_index not in indexes:
+        problems.append(f"не используется {expected_index}")
+
+    assert not problems, f"{name}: {'; '.join(problems)}"